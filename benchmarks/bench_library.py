@@ -0,0 +1,144 @@
+"""benchmark the library hot paths on a synthetic library and tag
+database: ``AudioLib.walker`` per action, ``TagDatabase`` load/refresh/
+update_sets, ``match_from_perms``, ``get_nearest_name`` and the time to
+import the command line and library modules.
+
+    $ PYTHONPATH=. python benchmarks/bench_library.py \\
+        --n_artist 2000 --n_album 100 --output bench_library.json
+
+Everything is written to a temporary folder; the configured library and
+database are never touched.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+import harness
+import synth
+
+from clamm import config
+from clamm import installed_location
+from clamm import tags
+from clamm import audiolib
+
+ACTIONS = [
+    "prune_artist_tags", "remove_junk_tags", "get_artist_counts",
+    "get_arrangement_set", "synchronize_arrangement"]
+MODULES = ["clamm.__main__", "clamm.audiolib", "clamm.streams.to_tracks"]
+
+
+def import_time(module, repeat):
+    """ wall time of a fresh interpreter importing ``module`` """
+    return harness.timeit(
+        subprocess.check_call,
+        [sys.executable, "-c", "import {}".format(module)],
+        repeat=repeat)
+
+
+def walk(root, action):
+    """ one ``clamm library action --<action>`` over ``root`` """
+    args = argparse.Namespace(dir=root, sub_cmd="action", key=None,
+                              val=None)
+    alib = audiolib.AudioLib(args)
+    alib.func = action
+    alib.walker(getattr(alib.ltfa, action))
+
+
+def noop(tagfile):
+    pass
+
+
+def walk_only(root):
+    """ a walk applying nothing, the cost of reading every file """
+    args = argparse.Namespace(dir=root, sub_cmd="action", key=None,
+                              val=None)
+    audiolib.AudioLib(args).walker(noop)
+
+
+def main():
+    prs = harness.parser(__doc__, "bench_library.json")
+    prs.add_argument("--n_artist", type=int, default=1000)
+    prs.add_argument("--n_composer", type=int, default=300)
+    prs.add_argument("--n_album", type=int, default=50)
+    prs.add_argument("--n_track", type=int, default=10)
+    prs.add_argument("--n_lookup", type=int, default=200,
+                     help="names looked up per lookup case")
+    prs.add_argument("--actions", nargs="+", default=ACTIONS)
+    args = prs.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    # TagDatabase.backup copies the database over the packaged template,
+    # so the template is taken from the temporary folder too
+    os.makedirs(os.path.join(tmp, "templates"))
+    tags.installed_location = tmp
+
+    results = {"size": {key: getattr(args, key) for key in (
+        "n_artist", "n_composer", "n_album", "n_track")}, "timings": {}}
+    timings = results["timings"]
+    try:
+        root = os.path.join(tmp, "library")
+        config["path"].update({
+            "library": root,
+            "database": os.path.join(tmp, "tags.json"),
+            "stats": os.path.join(tmp, "stats.json"),
+            "loudness": os.path.join(tmp, "loudness.json"),
+            "enrich": os.path.join(tmp, "enrich.json"),
+            "playlist": tmp})
+        config["verbosity"] = 0
+        tagdb_dict = synth.make_tagdb(
+            config["path"]["database"], args.n_artist, args.n_composer)
+        synth.make_library(root, tagdb_dict, args.n_album, args.n_track)
+
+        for module in MODULES:
+            timings["import " + module] = import_time(module, args.repeat)
+
+        # database
+        tagdb = tags.TagDatabase()
+        timings["TagDatabase.load"] = harness.timeit(
+            tagdb.load, repeat=args.repeat)
+        timings["TagDatabase.update_sets"] = harness.timeit(
+            tagdb.update_sets, repeat=args.repeat)
+        timings["TagDatabase.refresh"] = harness.timeit(
+            tagdb.refresh, repeat=args.repeat)
+
+        # lookups, of names spread through the database, and misses
+        names = [tagdb.artist[key]["permutations"][-1]
+                 for key in sorted(tagdb.artist)]
+        queries = names[::max(1, len(names) // args.n_lookup)]
+
+        def match_all():
+            for name in queries:
+                try:
+                    tagdb.match_from_perms(name)
+                except tags.KeyNotFoundError:
+                    pass
+
+        def nearest_all():
+            for name in queries[:max(1, args.n_lookup // 10)]:
+                tags.get_nearest_name(name + "x", tagdb.sets["artist"])
+
+        timings["match_from_perms x{}".format(len(queries))] = \
+            harness.timeit(match_all, repeat=args.repeat)
+        timings["get_nearest_name x{}".format(
+            max(1, args.n_lookup // 10))] = harness.timeit(
+                nearest_all, repeat=args.repeat)
+
+        # library walks, a plain walk first as the floor
+        timings["walker"] = harness.timeit(
+            walk_only, root, repeat=args.repeat)
+        for action in args.actions:
+            timings["walker " + action] = harness.timeit(
+                walk, root, action, repeat=args.repeat)
+    finally:
+        tags.installed_location = installed_location
+        shutil.rmtree(tmp)
+
+    harness.report(results, args)
+
+
+if __name__ == "__main__":
+    main()
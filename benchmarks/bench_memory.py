@@ -0,0 +1,109 @@
+"""benchmark the memory footprint of the tag database on a large synthetic
+``tags.json``, against the dict-of-dicts representation it replaced: the
+parsed ``json``, its sets, the list copies of the sets and seven
+eagerly filled suggestor histories.
+
+    $ PYTHONPATH=. python benchmarks/bench_memory.py --n_artist 50000
+
+The load time is measured from the binary snapshot, which the first
+load writes, and from the ``json`` itself.
+
+Sizes are the memory held once the database is built, as traced by
+``tracemalloc``, so they include every string, dict, list and record.
+"""
+
+import os
+import gc
+import json
+import shutil
+import tempfile
+import tracemalloc
+
+import prompt_toolkit as ptk
+
+import harness
+import synth
+
+from clamm import config
+from clamm import installed_location
+from clamm import tags
+
+
+def legacy_database(path):
+    """ the tag database as it used to be held in memory """
+    with open(path) as fptr:
+        tagdb = json.load(fptr)
+
+    sets = {
+        "artist": tags.perms2set(tagdb["artist"]),
+        "composer": tags.perms2set(tagdb["composer"]),
+        "period": tags.messylist2set(
+            [val["period"] for val in tagdb["composer"].values()]),
+        "nationality": tags.messylist2set(
+            [val["nationality"] for val in tagdb["artist"].values()] +
+            [val["nationality"] for val in tagdb["composer"].values()]),
+        "instrument": tags.messylist2set(
+            [val["instrument"] for val in tagdb["artist"].values()])}
+    tagdb["sets"] = {key: list(val) for key, val in sets.items()}
+
+    histories = []
+    for category in list(sets) + ["artist", "composer"]:
+        history = ptk.history.InMemoryHistory()
+        append = getattr(history, "append_string", None) or history.append
+        for item in tagdb["sets"][category]:
+            append(item)
+        histories.append(history)
+
+    return tagdb, sets, histories
+
+
+def held(build, *args):
+    """ bytes still allocated once ``build(*args)`` returns, with its
+    result alive, and the peak while building """
+    gc.collect()
+    tracemalloc.start()
+    result = build(*args)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {"held": current, "peak": peak}
+
+
+def main():
+    prs = harness.parser(__doc__, "bench_memory.json")
+    prs.add_argument("--n_artist", type=int, default=20000)
+    prs.add_argument("--n_composer", type=int, default=5000)
+    args = prs.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    # TagDatabase.load backs the database up over the packaged template
+    template = os.path.join(installed_location, "templates", "tags.json")
+    with open(template, "rb") as fptr:
+        template_bytes = fptr.read()
+
+    results = {"n_artist": args.n_artist, "n_composer": args.n_composer}
+    try:
+        config["path"]["database"] = os.path.join(tmp, "tags.json")
+        config["database"]["snapshot"] = True
+        synth.make_tagdb(
+            config["path"]["database"], args.n_artist, args.n_composer)
+        results["legacy"] = held(legacy_database, config["path"]["database"])
+        results["TagDatabase"] = held(tags.TagDatabase)
+        results["timings"] = {"TagDatabase (snapshot)": harness.timeit(
+            tags.TagDatabase, repeat=args.repeat)}
+        config["database"]["snapshot"] = False
+        results["timings"]["TagDatabase (json)"] = harness.timeit(
+            tags.TagDatabase, repeat=args.repeat)
+    finally:
+        with open(template, "wb") as fptr:
+            fptr.write(template_bytes)
+        shutil.rmtree(tmp)
+
+    results["reduction"] = 1 - (
+        results["TagDatabase"]["held"] / results["legacy"]["held"])
+    harness.report(results, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""benchmark in-process pcm/flac conversion (``clamm.streams.pcm``)
+against the ``ffmpeg`` subprocess round-trips it replaces, on a synthetic
+stream.
+
+    $ PYTHONPATH=. python benchmarks/bench_pcm.py \\
+        --minutes 60 --output bench_pcm.json
+
+Backends that are not available (no ``ffmpeg`` on the path, ``soundfile``
+not installed) are skipped.
+"""
+
+import os
+import hashlib
+import shutil
+import tempfile
+import subprocess
+
+import numpy as np
+
+import harness
+
+from clamm.streams import envelope
+from clamm.streams import pcm
+from clamm.streams import to_tracks
+
+CHUNK_SEC = 60
+
+
+def synthesize(path, minutes):
+    """ a stereo stream of tone plus noise, written a minute at a time """
+    rng = np.random.default_rng(0)
+    t = np.arange(CHUNK_SEC * pcm.FS) / pcm.FS
+    tone = 6000 * np.sin(2 * np.pi * 220 * t)
+    with open(path, "wb") as fptr:
+        for _ in range(minutes):
+            mono = tone + rng.normal(0, 300, t.shape[0])
+            frames = np.repeat(mono.astype(np.int16), 2)
+            fptr.write(frames.tobytes())
+
+
+def envelope_of(path):
+    with pcm.open_stream(path) as reader:
+        to_tracks.wave_envelope(reader)
+
+
+def md5_of(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as fptr:
+        for buf in iter(lambda: fptr.read(1 << 22), b""):
+            digest.update(buf)
+    return digest.hexdigest()
+
+
+def three_passes(path, wav):
+    """ wav copy, checksum and envelope, each reading the stream """
+    pcm.write_wav(path, wav)
+    md5_of(path)
+    with pcm.open_stream(path) as reader:
+        envelope.Pyramid.compute(reader, envelope.levels_from_config())
+
+
+def scan_pass(path):
+    """ checksum and envelope in one read of the memory map, no wav """
+    digest = hashlib.md5()
+    accumulator = envelope.Accumulator(
+        envelope.levels_from_config(),
+        os.path.getsize(path) // envelope.FRAME_BYTES)
+    pcm.scan(path, (digest.update, accumulator.update))
+    accumulator.pyramid()
+
+
+def one_pass(path, wav, in_place):
+    """ wav, checksum and envelope in the single read of ``write_wav`` """
+    digest = hashlib.md5()
+    accumulator = envelope.Accumulator(
+        envelope.levels_from_config(),
+        os.path.getsize(path) // envelope.FRAME_BYTES)
+    pcm.write_wav(path, wav, sinks=(digest.update, accumulator.update),
+                  in_place=in_place)
+    accumulator.pyramid()
+
+
+def main():
+    prs = harness.parser(__doc__, "bench_pcm.json")
+    prs.add_argument("--minutes", type=int, default=60)
+    prs.add_argument("--segment", type=int, default=5,
+                     help="minutes of stream encoded to flac")
+    args = prs.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    has_ffmpeg = shutil.which("ffmpeg") is not None
+    results = {"size": {"minutes": args.minutes, "segment": args.segment},
+               "timings": {}}
+    timings = results["timings"]
+    try:
+        stream = os.path.join(tmp, "stream.pcm")
+        synthesize(stream, args.minutes)
+        wav = os.path.join(tmp, "stream.wav")
+
+        # pcm --> something wave-readable
+        timings["wav_view_memmap"] = harness.timeit(
+            pcm.open_stream, stream, repeat=args.repeat)
+        timings["wav_write_inprocess"] = harness.timeit(
+            pcm.write_wav, stream, wav, repeat=args.repeat)
+        if has_ffmpeg:
+            timings["wav_write_ffmpeg"] = harness.timeit(
+                subprocess.call,
+                ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+                 "-f", "s16le", "-ar", "44.1k", "-ac", "2", "-i", stream,
+                 wav], repeat=args.repeat)
+
+        # analysis reads
+        timings["envelope_from_pcm"] = harness.timeit(
+            envelope_of, stream, repeat=args.repeat)
+
+        # wav, checksum and envelope: three reads or one, copy or in place
+        timings["wav_md5_envelope_3_passes"] = harness.timeit(
+            three_passes, stream, wav, repeat=args.repeat)
+        timings["md5_envelope_scan"] = harness.timeit(
+            scan_pass, stream, repeat=args.repeat)
+        timings["wav_md5_envelope_1_pass"] = harness.timeit(
+            one_pass, stream, wav, False, repeat=args.repeat)
+        victim = os.path.join(tmp, "victim.pcm")
+        timings["wav_md5_envelope_in_place"] = harness.timeit(
+            one_pass, victim, wav, True, repeat=args.repeat,
+            setup=lambda: shutil.copyfile(stream, victim))
+
+        # flac encoding of one segment
+        n_frame = args.segment * 60 * pcm.FS
+        frames = pcm.open_stream(stream).frames[:n_frame]
+        flac = os.path.join(tmp, "segment.flac")
+        backends = []
+        if pcm.soundfile is not None:
+            backends.append("soundfile")
+        if has_ffmpeg:
+            backends.append("ffmpeg")
+        for backend in backends:
+            timings["flac_" + backend] = harness.timeit(
+                pcm.encode_flac, frames, flac, backend, repeat=args.repeat)
+    finally:
+        shutil.rmtree(tmp)
+
+    harness.report(results, args)
+
+
+if __name__ == "__main__":
+    main()
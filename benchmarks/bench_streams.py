@@ -0,0 +1,95 @@
+"""benchmark the stream analysis hot paths: ``wave_envelope`` of a
+synthetic stream, computing its envelope pyramid and loading it back from
+the cache, and track boundary detection (``Album.locate_track``) over a
+synthetic album envelope.
+
+    $ PYTHONPATH=. python benchmarks/bench_streams.py --minutes 60
+
+See also ``bench_pcm.py`` for pcm/flac conversion.
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import harness
+import synth
+from bench_pcm import synthesize
+
+from clamm import config
+from clamm.streams import envelope
+from clamm.streams import pcm
+from clamm.streams import metadata
+from clamm.streams import to_tracks
+
+
+def envelope_of(path):
+    with pcm.open_stream(path) as reader:
+        to_tracks.wave_envelope(reader)
+
+
+def album_of(durations, seed=0):
+    """ an ``Album`` over a synthetic envelope, as ``process`` leaves it
+    just before locating tracks """
+    album = to_tracks.Album.__new__(to_tracks.Album)
+    album.envelope = synth.make_envelope(durations, seed=seed)
+    album.track = [
+        to_tracks.Track(metadata.TrackRecord({
+            "trackTimeMillis": int(1000 * (duration + 2)),
+            "trackName": "track {}".format(i), "artistName": "",
+            "trackNumber": i + 1}))
+        for i, duration in enumerate(durations)]
+    album.current = 0
+    return album
+
+
+def locate_all(album):
+    album.current = 0
+    for album.current in range(len(album.track)):
+        album.locate_track()
+
+
+def main():
+    prs = harness.parser(__doc__, "bench_streams.json")
+    prs.add_argument("--minutes", type=int, default=20)
+    prs.add_argument("--n_track", type=int, default=40)
+    args = prs.parse_args()
+
+    rng = np.random.default_rng(0)
+    durations = rng.uniform(60, 600, args.n_track).round()
+    album = album_of(durations)
+
+    results = {"minutes": args.minutes, "n_track": args.n_track,
+               "timings": {}}
+    timings = results["timings"]
+    tmp = tempfile.mkdtemp()
+    try:
+        stream = os.path.join(tmp, "stream.pcm")
+        synthesize(stream, args.minutes)
+        timings["wave_envelope"] = harness.timeit(
+            envelope_of, stream, repeat=args.repeat)
+
+        config["path"]["envelopes"] = os.path.join(tmp, "envelopes")
+        config["streams"]["envelope"]["cache"] = False
+        timings["pyramid (computed)"] = harness.timeit(
+            envelope.get, stream, repeat=args.repeat)
+        config["streams"]["envelope"]["cache"] = True
+        timings["pyramid (cached)"] = harness.timeit(
+            envelope.get, stream, repeat=args.repeat,
+            setup=lambda: envelope.get(stream))
+        timings["locate_track x{}".format(args.n_track)] = harness.timeit(
+            locate_all, album, repeat=args.repeat)
+    finally:
+        shutil.rmtree(tmp)
+
+    starts = np.array([t.start_frame // to_tracks.DF for t in album.track])
+    expected = 2 + np.concatenate([[0], np.cumsum(durations + 2)[:-1]])
+    results["max_start_error_sec"] = float(np.max(np.abs(starts - expected)))
+
+    harness.report(results, args)
+
+
+if __name__ == "__main__":
+    main()
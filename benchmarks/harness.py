@@ -0,0 +1,71 @@
+"""timing and reporting shared by the benchmarks.
+
+Each benchmark script writes its results as ``json``, with the timings of
+each case as ``{"min": .., "median": .., "repeat": ..}`` seconds. Given
+the results of an earlier run with ``--baseline``, cases that got slower
+by more than ``--tolerance`` are reported and the script exits non-zero,
+so a regression can fail a release check.
+"""
+
+import sys
+import json
+import time
+import argparse
+import statistics
+
+
+def parser(description, output):
+    """ argument parser with the options every benchmark takes """
+    prs = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    prs.add_argument("--repeat", type=int, default=3,
+                     help="runs of each case, the fastest is compared")
+    prs.add_argument("--output", default=output)
+    prs.add_argument("--baseline", default=None,
+                     help="results of an earlier run to compare against")
+    prs.add_argument("--tolerance", type=float, default=0.25,
+                     help="slow down, as a fraction, counted as regression")
+    return prs
+
+
+def timeit(func, *args, repeat=3, setup=None):
+    """time ``func(*args)`` ``repeat`` times, calling ``setup()`` untimed
+    before each run """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        tic = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - tic)
+    return {"min": min(times), "median": statistics.median(times),
+            "repeat": repeat}
+
+
+def compare(results, baseline, tolerance):
+    """ names of the cases of ``results`` slower than in ``baseline`` """
+    slower = []
+    for name, timing in results.get("timings", {}).items():
+        before = baseline.get("timings", {}).get(name)
+        if before is None:
+            continue
+        ratio = timing["min"] / max(before["min"], 1e-9)
+        if ratio > 1 + tolerance:
+            print("REGRESSION {}: {:.4f} --> {:.4f} sec ({:.2f}x)".format(
+                name, before["min"], timing["min"], ratio))
+            slower.append(name)
+    return slower
+
+
+def report(results, args):
+    """ print and write ``results``, then compare to the baseline """
+    print(json.dumps(results, indent=4))
+    with open(args.output, "w") as fptr:
+        json.dump(results, fptr, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as fptr:
+            baseline = json.load(fptr)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
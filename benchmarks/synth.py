@@ -0,0 +1,135 @@
+"""synthetic data for the benchmarks: a ``tags.json`` tag database and a
+library of tagged flac/wav files drawing their names from it.
+
+Names are made up from syllables, so databases of any size can be made
+reproducibly (for a given ``seed``) and look enough like real names for
+the edit distance based lookups to do representative work.
+"""
+
+import os
+import json
+import random
+
+import numpy as np
+import soundfile
+import taglib
+
+SYLLABLES = [
+    "ba", "ch", "mo", "zart", "gou", "ld", "schi", "ff", "ri", "chter",
+    "hei", "fetz", "ma", "ro", "stro", "po", "vich", "el", "gar", "du",
+    "pre", "ber", "lioz", "han", "del", "vi", "val", "di", "sa", "tie"]
+INSTRUMENTS = [
+    "piano", "violin", "cello", "conductor", "orchestra", "soprano",
+    "guitar", "harpsichord", "choir", "viola"]
+NATIONALITIES = ["German", "French", "Russian", "Italian", "American"]
+PERIODS = ["Baroque", "Classical", "Romantic", "Modern", "Contemporary"]
+
+
+def make_name(rng):
+    def word():
+        return "".join(rng.choice(SYLLABLES)
+                       for _ in range(rng.randint(2, 3))).capitalize()
+    return "{} {}".format(word(), word())
+
+
+def make_entry(rng, name, **fields):
+    first, last = name.split(" ")
+    entry = {
+        "full_name": name,
+        "sort": "{}, {}".format(last, first),
+        "borndied": "19{:02d}-".format(rng.randint(0, 99)),
+        "permutations": [name, "{}, {}".format(last, first), last],
+        "nationality": rng.choice(NATIONALITIES)}
+    entry.update(fields)
+    return entry
+
+
+def make_tagdb(path, n_artist, n_composer, seed=0):
+    """write a ``tags.json`` of ``n_artist`` artists and ``n_composer``
+    composers to ``path``, returns the database dict """
+    rng = random.Random(seed)
+    artist, composer = {}, {}
+    while len(artist) < n_artist:
+        name = make_name(rng)
+        artist[name] = make_entry(
+            rng, name, instrument=rng.choice(INSTRUMENTS),
+            ordinality="Individual", count=rng.randint(1, 200))
+    while len(composer) < n_composer:
+        name = make_name(rng)
+        if name not in artist:
+            composer[name] = make_entry(
+                rng, name, abbreviated=name.split(" ")[1],
+                period=rng.choice(PERIODS))
+
+    def names(entries):
+        return sorted({perm for key, val in entries.items()
+                       for perm in [key] + val["permutations"]})
+
+    sets = {
+        "artist": names(artist), "composer": names(composer),
+        "period": PERIODS, "nationality": NATIONALITIES,
+        "instrument": INSTRUMENTS}
+    tagdb = {
+        "artist": artist, "composer": composer, "sets": sets,
+        "exceptions": {"composer_AND_artist": [], "artists_to_ignore": []}}
+    with open(path, "w") as fptr:
+        json.dump(tagdb, fptr, ensure_ascii=False, indent=4)
+    return tagdb
+
+
+def make_library(root, tagdb, n_album, n_track, wav_fraction=0.2,
+                 track_sec=0.1, seed=0):
+    """write ``n_album`` folders of ``n_track`` short tagged tracks under
+    ``root``, with artists and composers from ``tagdb``. Tracks also
+    carry the kind of tags the library actions prune.
+
+    Returns
+    -------
+    paths: list
+    """
+    rng = random.Random(seed)
+    artists = sorted(tagdb["artist"])
+    composers = sorted(tagdb["composer"])
+    frames = np.zeros((int(track_sec * 44100), 2), dtype=np.int16)
+
+    paths = []
+    for i_album in range(n_album):
+        folder = os.path.join(root, "album{:05d}".format(i_album))
+        os.makedirs(folder, exist_ok=True)
+        ext = ".wav" if rng.random() < wav_fraction else ".flac"
+        performers = rng.sample(artists, rng.randint(1, 3))
+        credited = [rng.choice(tagdb["artist"][name]["permutations"])
+                    for name in performers]
+        composer = rng.choice(composers)
+
+        for i_track in range(n_track):
+            path = os.path.join(folder, "{:02d} track{}".format(
+                i_track + 1, ext))
+            soundfile.write(path, frames, 44100)
+            tagfile = taglib.File(path)
+            tagfile.tags.update({
+                "ARTIST": ["; ".join(credited)],
+                "ALBUMARTIST": [credited[0]],
+                "ARTISTSORT": [credited[0]],
+                "COMPOSER": [composer],
+                "ALBUM": ["Album {}".format(i_album)],
+                "TITLE": ["Track {}".format(i_track + 1)],
+                "TRACKNUMBER": [str(i_track + 1)],
+                "MUSICBRAINZ_TRACKID": ["{:08x}".format(rng.getrandbits(32))],
+                "ASIN": ["B000000000"]})
+            tagfile.save()
+            tagfile.close()
+            paths.append(path)
+
+    return paths
+
+
+def make_envelope(durations, gap_sec=2, seed=0):
+    """an envelope (one value per ``to_tracks.DF`` block, i.e. per second)
+    of tracks of ``durations`` seconds separated by quiet gaps """
+    rng = np.random.default_rng(seed)
+    parts = [rng.uniform(0, 50, gap_sec)]
+    for duration in durations:
+        parts.append(rng.uniform(1e4, 1e6, int(duration)))
+        parts.append(rng.uniform(0, 50, gap_sec))
+    return np.concatenate(parts)
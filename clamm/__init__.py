@@ -38,5 +38,10 @@ config['path'] = {
         "osa": os.path.join(cfg_home, "osa"),
         "envelopes": os.path.join(cfg_home, "envelopes"),
         "database": os.path.join(cfg_home, "tags.json"),
+        "metadata": os.path.join(cfg_home, "metadata.json"),
+        "stats": os.path.join(cfg_home, "stats.json"),
+        "loudness": os.path.join(cfg_home, "loudness.json"),
+        "enrich": os.path.join(cfg_home, "enrich.json"),
+        "recent": os.path.join(cfg_home, "recent.json"),
         "troubled_tracks": os.path.join(cfg_home, "troubled_tracks.json")
     }
@@ -6,6 +6,8 @@ import argparse
 from subprocess import call
 import os
 import json
+import cProfile
+import pstats
 
 from clamm import config, get_config_path, config_template
 from clamm import util
@@ -25,6 +27,21 @@ def create_library_parsers(subps):
                 the target directory (default: config['path']['library'])
                 """)
 
+    lib_p.add_argument(
+        "--timing", action="store_true",
+        help="""
+                print wall time per phase of each walk (listing, taglib,
+                the action, commits, ...) and the slowest files
+                """)
+
+    lib_p.add_argument(
+        "--timing_json", type=str, default=None,
+        help="export the per-phase timings of each walk to a json file")
+
+    lib_p.add_argument(
+        "--profile", type=str, default=None,
+        help="run under cProfile and write the pstats dump to this path")
+
     lib_subps = lib_p.add_subparsers(dest="sub_cmd")
 
     # ACTION
@@ -50,8 +67,9 @@ def create_library_parsers(subps):
     lib_act_p.add_argument(
         "--recently_added", action="store_true",
         help="""
-                Generate a recently_added playlist by looking at the
-                date of the parent directory.
+                Update the recently-added playlist from the index of
+                library folder ctimes, examining only folders changed
+                since the last update, and push the change to cmus.
                 """)
 
     lib_act_p.add_argument(
@@ -61,6 +79,14 @@ def create_library_parsers(subps):
                 removes tags in config['library']['tags']['junk'].
                 """)
 
+    lib_act_p.add_argument(
+        "--delete_tag_globber", action="store_true",
+        help="""
+                Remove families of tags matching the comma separated
+                glob (or re:regex) patterns given with -k, as in
+                -k 'MUSICBRAINZ_*,ITUN*'
+                """)
+
     lib_act_p.add_argument(
         "--change_tag_by_name", action="store_true",
         help="""
@@ -102,8 +128,16 @@ def create_library_parsers(subps):
     lib_act_p.add_argument(
         "--get_artist_counts", action="store_true",
         help="""
-                Update the occurence count of each artist in tags.json.
-                These are then used for ordering new arrangements.
+                Walk the library to bring the artist occurence counts
+                up to date. These are used for ordering new arrangements.
+                """)
+
+    lib_act_p.add_argument(
+        "--replaygain", action="store_true",
+        help="""
+                Measure the loudness (EBU R128) of each track and album
+                and write ReplayGain 2.0 REPLAYGAIN_* tags. Results are
+                cached, so only new material is decoded on re-runs.
                 """)
 
     lib_act_p.add_argument(
@@ -126,6 +160,31 @@ def create_library_parsers(subps):
              synchronize the library file tags with the tags
              database""")
 
+    lib_stat_p = lib_subps.add_parser(
+        "stats",
+        help="""
+             show artist/composer/grouping counts of the library, as
+             maintained by library walks and tag writes
+             """)
+    lib_stat_p.add_argument(
+        "-n", "--n_top", type=int, default=20,
+        help="number of entries to show per count (default: 20)")
+    lib_stat_p.add_argument(
+        "--prune", action="store_true",
+        help="forget files that no longer exist before showing")
+
+    lib_watch_p = lib_subps.add_parser(
+        "watch",
+        help="""
+             watch the library and stream folders, split new streams
+             and apply config['library']['watch']['actions'] to new
+             or changed albums as they land
+             """)
+    lib_watch_p.add_argument(
+        "-b", "--backend", type=str, default=None,
+        choices=["auto", "inotify", "poll"],
+        help="how changes are found (default: config)")
+
     lib_play_p = lib_subps.add_parser("playlist", help="")
 
     lib_play_p.add_argument(
@@ -187,6 +246,13 @@ def create_stream_parsers(subps):
         "-l", "--listing", type=str, default="templates/listing.json",
         help="Path to listing.json specification.")
 
+    strm_init_p.add_argument(
+        "-p", "--prefetch", action="store_true",
+        help="""
+                 look up the metadata of every album in the listing
+                 concurrently before streaming
+                 """)
+
     strm_trck_p = strm_subps.add_parser(
         "tracks",
         help="""
@@ -196,6 +262,43 @@ def create_stream_parsers(subps):
         "-s", "--streampath", type=str, default="",
         help=" path to a raw pcm stream file ")
 
+    ncfg = config["streams"]["network"]
+    strm_serv_p = strm_subps.add_parser(
+        "serve",
+        help="""
+                 serve a pcm stream over the network to a single
+                 listener, see clamm.lp2flac.z_streamr
+                 """)
+    strm_serv_p.add_argument(
+        "-s", "--source", type=str, default="-",
+        help="""
+                 raw s16le stereo frames on stdin (-), a folder of flac
+                 albums, a .pcm file or any audio file ffmpeg can decode
+                 """)
+    strm_serv_p.add_argument(
+        "-a", "--host", type=str, default=ncfg["host"],
+        help="address to listen on")
+    strm_serv_p.add_argument(
+        "-p", "--port", type=int, default=ncfg["port"])
+    strm_serv_p.add_argument(
+        "-c", "--codec", type=str, default=ncfg["codec"],
+        choices=["none", "zlib", "flac"],
+        help="compression applied to each frame on the wire")
+
+    strm_lstn_p = strm_subps.add_parser(
+        "listen",
+        help="""
+                 write a stream served by clamm streams serve to disk
+                 """)
+    strm_lstn_p.add_argument(
+        "-a", "--host", type=str, required=True,
+        help="address of the serving machine")
+    strm_lstn_p.add_argument(
+        "-p", "--port", type=int, default=ncfg["port"])
+    strm_lstn_p.add_argument(
+        "-o", "--output", type=str, required=True,
+        help="target .wav file, or raw frames for any other extension")
+
     strm_strm_p = strm_subps.add_parser(
         "stream",
         help="""
@@ -289,8 +392,30 @@ def streams_listing(args):
 
        $ clamm library initialize
     """
-    import clamm.streams
-    clamm.streams.listing2streams(args.listing)
+    from clamm.streams import from_listing
+    from_listing.main(args.listing, prefetch=args.prefetch)
+
+
+def streams_serve(args):
+    """ Calls :func:`~clamm.lp2flac.z_streamr.serve`
+
+    .. code-block:: bash
+
+       $ arecord -f cd -t raw | clamm streams serve -s -
+    """
+    from clamm.lp2flac import z_streamr
+    z_streamr.serve(args.source, args.host, args.port, args.codec)
+
+
+def streams_listen(args):
+    """ Calls :func:`~clamm.lp2flac.z_streamr.listen`
+
+    .. code-block:: bash
+
+       $ clamm streams listen -a callisto -o side_a.wav
+    """
+    from clamm.lp2flac import z_streamr
+    z_streamr.listen(args.host, args.port, args.output)
 
 
 def streams_stream(args):
@@ -318,6 +443,10 @@ def library_action(args):
         if flag:
             util.printr(funcname)
             alib.func = funcname
+            if funcname == "recently_added":
+                # kept by an index of folders rather than by a walk
+                alib.recently_added()
+                continue
             func = eval("alib.ltfa.{}".format(funcname))
             alib.walker(func)
 
@@ -350,6 +479,37 @@ def library_synchronize(args):
     clamm.audiolib.AudioLib(args).synchronize()
 
 
+def library_stats(args):
+    """ show the library statistics kept in ``config['path']['stats']``,
+    without walking the library.
+
+    Example
+
+    .. code-block:: bash
+
+       $ clamm library stats -n 10
+    """
+    from clamm import stats
+    libstats = stats.LibraryStats.load()
+    if args.prune:
+        libstats.prune()
+        libstats.save()
+    libstats.show(args.n_top)
+
+
+def library_watch(args):
+    """ runs the :class:`~clamm.watch.Watch` daemon until interrupted.
+
+    Example
+
+    .. code-block:: bash
+
+       $ clamm library watch
+    """
+    from clamm import watch
+    watch.Watch(args).run()
+
+
 def library_playlist(args):
     """ calls :func:`~clamm.audiolib.AudioLib.playlist` with ``args``
     provided at command line.
@@ -380,4 +540,19 @@ def main():
         raise ne
 
     util.printr("parsed and executing {}...".format(full_cmd))
-    functor(args)
+    if getattr(args, "profile", None):
+        profile(functor, args)
+    else:
+        functor(args)
+
+
+def profile(functor, args, n_top=25):
+    """ run ``functor(args)`` under ``cProfile``, dump the stats to
+    ``args.profile`` and print the top entries by cumulative time """
+    prof = cProfile.Profile()
+    try:
+        prof.runcall(functor, args)
+    finally:
+        prof.dump_stats(args.profile)
+        util.printr("profile written to {}".format(args.profile))
+        pstats.Stats(prof).sort_stats("cumulative").print_stats(n_top)
@@ -8,9 +8,14 @@ import sys
 import time
 import subprocess
 
+import taglib
 from colorama import Fore
 
 from clamm import tags
+from clamm import stats
+from clamm import loudness
+from clamm import recent
+from clamm import timing
 from clamm import config
 from clamm import util
 
@@ -25,6 +30,11 @@ class AudioLib():
         self.func = self.args.sub_cmd
         self.ltfa = LibTagFileAction(self.args)
 
+        # walk instrumentation, see clamm.timing
+        self.show_timing = getattr(args, "timing", False)
+        self.timing_json = getattr(args, "timing_json", None)
+        self.timings = {}
+
     def walker(self, func, **kwargs):
         """
         Recursively walks the directories/sub-directories under
@@ -37,55 +47,117 @@ class AudioLib():
             action to apply to audio files.
         """
         util.printr("walking with %s..." % (str(func)))
+        timer = timing.PhaseTimer()
+        self.ltfa.timer = self.ltfa.tagdb.timer = tags.SafeTagFile.timer = \
+            timer
+        action = "action:{}".format(getattr(func, "__name__", func))
+
+        # tag writes of the walk and its follow-up keep the stats current
+        with util.commit_hook(self.ltfa.stats.on_commit):
+            walk = os.walk(self.root, topdown=False)
+            while True:
+                with timer.phase("listdir"):
+                    entry = next(walk, None)
+                if entry is None:
+                    break
+                folder, _, files = entry
+                if not files:
+                    continue
 
-        for folder, _, files in os.walk(self.root, topdown=False):
-            if not files:
-                continue
+                if config["verbosity"] > 2:
+                    util.printr("walked into {}...".format(folder.replace(
+                        config["path"]["library"], "$LIBRARY")))
+                else:
+                    util.printr(lambda: [
+                        sys.stdout.write(Fore.GREEN + "." + Fore.WHITE),
+                        sys.stdout.flush()])
+
+                self.ltfa.count["album"] += 1
+
+                for name in files:
+                    if not util.is_audio_file(name):
+                        continue
+                    self.ltfa.count["file"] += 1
+                    tic = time.perf_counter()
+                    tagfile = tags.SafeTagFile(join(folder, name))
+                    with timer.phase("stats"):
+                        self.ltfa.stats.observe(tagfile.path, tagfile.tags)
+                    with timer.phase(action):
+                        func(tagfile, **kwargs)
+                    timer.file(tagfile.path, time.perf_counter() - tic)
+
+            # initiate post-walk follow_up
+            with timer.phase("follow_up"):
+                self.follow_up()
+        timer.stop()
+        self.ltfa.timer = self.ltfa.tagdb.timer = tags.SafeTagFile.timer = \
+            None
+        self.report_timing(action, timer)
+
+    def report_timing(self, action, timer):
+        """ show and/or export the timings of a walk, as configured """
+        if self.show_timing:
+            timer.show()
+        if self.timing_json:
+            self.timings[action] = timer.summary()
+            timing.dump(self.timings, self.timing_json)
 
-            if config["verbosity"] > 2:
-                util.printr("walked into {}...".format(
-                    folder.replace(config["path"]["library"], "$LIBRARY")))
-            else:
-                util.printr(lambda: [
-                    sys.stdout.write(Fore.GREEN + "." + Fore.WHITE),
-                    sys.stdout.flush()])
+    def follow_up(self, **kwargs):
+        """ follow up """
+        if self.ltfa.converter is not None:
+            util.printr("waiting on conversions...")
+            with timing.timed(self.ltfa.timer, "conversions"):
+                count = self.ltfa.converter.join()
+            util.printr("converted {done} of {submitted}, {failed} failed"
+                        .format(**count))
+            for (src, _, _), error in self.ltfa.converter.errors:
+                util.printr("failed to convert {}: {}".format(src, error))
+            # the sources are gone, their tracks live on converted
+            for (src, _, ftags), dst in self.ltfa.converter.results:
+                if dst is None:
+                    continue
+                self.ltfa.stats.remove(src)
+                self.ltfa.stats.observe(dst, ftags)
+            self.ltfa.converter.shutdown()
+            self.ltfa.converter = None
 
-            self.ltfa.count["album"] += 1
+        if self.ltfa.album_gain is not None:
+            util.printr("waiting on loudness analyses...")
+            with timing.timed(self.ltfa.timer, "replaygain"):
+                self.ltfa.apply_replaygain()
 
-            for name in files:
-                if not util.is_audio_file(name):
-                    continue
-                self.ltfa.count["file"] += 1
-                func(tags.SafeTagFile(join(folder, name)), **kwargs)
+        if self.ltfa.album_rows:
+            with timing.timed(self.ltfa.timer, "arrangements"):
+                self.ltfa.apply_arrangements()
 
-        # initiate post-walk follow_up
-        self.follow_up()
+        if self.ltfa.rewriter is not None:
+            self.ltfa.rewriter.report()
+            self.ltfa.rewriter = None
+
+        if self.ltfa.tagdb.enricher is not None:
+            self.ltfa.tagdb.enricher.close()
+            self.ltfa.tagdb.enricher = None
 
-    def follow_up(self, **kwargs):
-        """ follow up """
         after_action_review(self.ltfa.count)
+        with timing.timed(self.ltfa.timer, "stats.save"):
+            self.ltfa.stats.save()
 
         if self.func == "playlist":
             pass
 
-        elif self.func == "recently_added":
-            # now, write the accumulated list to a simple pls file format
-            pl_name = "recently-added-{}".format(time.ctime()[:10])
-            pl_path = os.path.join(config["path"]["playlist"], pl_name)
-            with open(pl_path, mode="w") as playlist_file:
-                [playlist_file.write("{}\n".format(track))
-                 for track in self.ltfa.the_playlist]
-
-            # finally, tell cmus to add the playlist to its catalog
-            subprocess.call([
-                "cmus-remote", config["opt"]["cmus-remote"],
-                "pl-import " + pl_path])
-
         elif self.func == "get_artist_counts":
             for key, val in self.ltfa.artist_count.items():
                 self.ltfa.tagdb.artist[key]["count"] = val
-
+            self.ltfa.artist_count = {}
             self.ltfa.tagdb.refresh()
+            self.ltfa.stats.show()
+
+    def recently_added(self):
+        """bring the recently added playlist up to date from its folder
+        index, without a walk, and push the change to cmus, see
+        ``recent.refresh``
+        """
+        recent.refresh()
 
     def synchronize(self):
         """
@@ -126,14 +198,21 @@ class LibTagFile():
         self.args = args
         self.tagdb = tags.TagDatabase()
         self.action = self.args.sub_cmd
-        self.tagdb.update_sets()
 
         # stats
         self.count = {"tag": 0, "track": 0, "album": 0, "file": 0}
 
+        # library aggregates, kept current by every walk and tag write
+        self.stats = stats.LibraryStats.load()
+        self.tagdb.stats = self.stats
+
+        # instrumentation of the walk in progress, if any
+        self.timer = None
+
     def write2tagfile(self, tagfile):
         """ write2tagfile """
-        (atrack, atag) = util.commit_to_libfile(tagfile)
+        with timing.timed(self.timer, "commit"):
+            (atrack, atag) = util.commit_to_libfile(tagfile)
         self.count["track"] += atrack
         self.count["tag"] += atag
 
@@ -162,10 +241,25 @@ class LibTagFileAction(LibTagFile):
 
         self.instrument_groupings = {}
 
+        # format conversions, scheduler created on first use
+        self.converter = None
+
+        # tag removal engine, created on first use by an action
+        self.rewriter = None
+
+        # tag rows collected per album for arrangement planning
+        self.album_rows = {}
+
+        # loudness analysis, created on first use
+        self.album_gain = None
+
+        # whether unknown names were handed to the enricher yet
+        self.prefetched = {"artist": False, "composer": False}
+
         # auto_suggest
-        self.artist_suggest = tags.Suggestor(self.tagdb, category="artist")
+        self.artist_suggest = self.tagdb.suggest["artist"]
 
-        self.composer_suggest = tags.Suggestor(self.tagdb, category="composer")
+        self.composer_suggest = self.tagdb.suggest["composer"]
 
         # wrap methods in dictionary for dynamic access
         self.func = {}
@@ -177,38 +271,30 @@ class LibTagFileAction(LibTagFile):
     def audio2preferred_format(self, tagfile, **kwargs):
         """
         using ``ffmpeg``, convert arbitrary audio file to a
-        preferred type, ``flac`` by default
+        preferred type, ``flac`` by default.
+
+        Conversions run on a ``util.BoundedExecutor`` with one worker per
+        core; the walk blocks while the queue is full and ``follow_up``
+        waits for the last of them. See ``convert_audio``.
         """
 
         # unpack
-        (fpath, fname) = os.path.split(tagfile.path)
-        fext = os.path.splitext(tagfile.path)
+        (base, fext) = os.path.splitext(tagfile.path)
+        preferred = config["file"]["preferred_type"]
 
         # short-circuit if file is already preferred_type
-        if fext == config["file"]["preferred_type"]:
+        if fext.lower() == preferred:
             return
 
         # otherwise, proceed
-        print("converting {} to {}...".format(fname, fext))
-        src = tagfile.path
-        dst = join(
-            fpath, fname.replace(fext, config["file"]["preferred_type"]))
-
-        # and the conversion itself
-        with open("/dev/null", "w") as redirect:
-            subprocess.Popen(
-                ["ffmpeg", config["opt"]["ffmpeg"],
-                 "-i", src, dst], stdout=redirect)
-
-    def recently_added(self, tagfile, **kwargs):
-        """generate a recently added playlist by looking at the
-        date of the parent directory.
-        """
-        parent = os.path.split(tagfile.path)[0]
-        age_in_days = (time.time() - os.stat(parent).st_ctime) / \
-            util.SEC_PER_DAY
-        if age_in_days < config["library"]["recently_added_day_age"]:
-            self.the_playlist.append(tagfile.path)
+        if self.converter is None:
+            self.converter = util.BoundedExecutor()
+
+        util.printr("converting {} to {}...".format(
+            os.path.basename(tagfile.path), preferred))
+        self.converter.submit(
+            convert_audio, tagfile.path, base + preferred,
+            dict(tagfile.tags))
 
     def make_playlist(self, tagfile, **kwargs):
         """ playlist filter
@@ -273,35 +359,39 @@ class LibTagFileAction(LibTagFile):
 
     def remove_junk_tags(self, tagfile, **kwargs):
         """similar to prune_artist_tags, but removes all tags that
-        are in ``config["library"]["tags"]["junk"]``
+        are in ``config["library"]["tags"]["junk"]``. A preset of
+        ``tags.TagRewriter``.
         """
 
-        ftags = tagfile.tags
+        if self.rewriter is None:
+            self.rewriter = tags.TagRewriter.junk()
 
-        # apply deletion
-        tagfile.ftags = {
-            key: val for key, val in ftags.items()
-            if key not in config["library"]["tags"]["junk"]
-        }
-
-        # write to file
-        self.write2tagfile(tagfile)
+        # apply deletion and write to file, only if anything matched
+        if self.rewriter.apply(tagfile):
+            self.write2tagfile(tagfile)
 
     def delete_tag_globber(self, tagfile, **kwargs):
         """Unlike ``remove_junk_tags``, allows removing as glob of
         similarly named tags, as in the MUSICBRAINZ_* tags, without
         cluttering  ``config["library"]["tags"]["junk"]`` with
         excessive entries.
-        """
 
-        untag = self.args.key
-        ftags = tagfile.tags
+        Several patterns may be given, comma separated, and regular
+        expressions are prefixed with ``re:``, see ``tags.TagMatcher``.
 
-        # apply deletion
-        tagfile.tags = {k: v for k, v in ftags.items() if untag not in untag}
+        Examples
+        --------
+            $ clamm library action --delete_tag_globber \
+                    -k 'MUSICBRAINZ_*,re:ITUN(NORM|SMPB)'
+        """
 
-        # write to file
-        self.write2tagfile(tagfile)
+        if self.rewriter is None:
+            self.rewriter = tags.TagRewriter(
+                [pattern.strip() for pattern in self.args.key.split(",")])
+
+        # apply deletion and write to file, only if anything matched
+        if self.rewriter.apply(tagfile):
+            self.write2tagfile(tagfile)
 
     def change_tag_by_name(self, tagfile, **kwargs):
         """
@@ -353,27 +443,79 @@ class LibTagFileAction(LibTagFile):
 
     def synchronize_arrangement(self, tagfile, **kwargs):
         """Find arrangement that is best fit for a given file.
+
+        Files are only collected here, keyed by album. Once the walk is
+        complete, ``apply_arrangements`` plans and applies each album as a
+        whole, so the order files are walked in does not matter.
         """
 
-        aset = tags.get_artist_tagset(tagfile)
+        self.album_rows.setdefault(album_key(tagfile), []).append(
+            (tagfile.path, dict(tagfile.tags)))
+
+    def apply_arrangements(self):
+        """plan the arrangement of each collected album, in parallel, then
+        prompt (once per album, if configured) and write them serially.
+        """
 
-        # arrangement, defined as the pairing of artist to instrument
-        arrange = self.tagdb.verify_arrangement(
-            aset,
-            tagfile,
-            skipflag=config["database"]["skip_existing_arrangements"])
+        skipflag = config["database"]["skip_existing_arrangements"]
+        executor = util.BoundedExecutor()
+        futures = {
+            key: executor.submit(self.tagdb.plan_album, rows, skipflag)
+            for key, rows in self.album_rows.items()}
+        executor.shutdown()
+        self.album_rows = {}
+
+        for key in sorted(futures):
+            plans = futures[key].result()
+            if config["database"]["prompt_for_album_artist"]:
+                prompt_album_artist(key, plans)
+
+            for path, plan in plans.items():
+                (atrack, atag) = plan.apply(tags.SafeTagFile(path))
+                self.count["track"] += atrack
+                self.count["tag"] += atag
+
+    def replaygain(self, tagfile, **kwargs):
+        """compute ReplayGain 2.0 track and album gains and peaks (EBU
+        R128 loudness, see ``loudness``), written as ``REPLAYGAIN_*``
+        tags. An album is a folder and ALBUM tag, as for arrangements.
+
+        Tracks are analysed in worker processes while the walk goes on,
+        unless they are cached as analysed already; tags are written once
+        the walk is complete, see ``apply_replaygain``.
+        """
 
-        if not arrange:
-            return
+        if self.album_gain is None:
+            self.album_gain = loudness.AlbumGain()
 
-        arrange.apply(tagfile)
+        self.album_gain.add(str(tagfile.path), album_key(tagfile))
+
+    def apply_replaygain(self):
+        """ write the ``REPLAYGAIN_*`` tags of every analysed track """
+        album_gain, self.album_gain = self.album_gain, None
+        for path, rgtags in album_gain.tags():
+            tagfile = tags.SafeTagFile(path)
+            tagfile.tags.update(rgtags)
+            self.write2tagfile(tagfile)
+            album_gain.cache.touch(path)
+        for (path, ), error in album_gain.executor.errors:
+            util.printr("failed to analyse {}: {}".format(path, error))
+        album_gain.cache.save()
 
     def synchronize_artist(self, tagfile, **kwargs):
         """Verify there is an artist entry in ``tags.json`` for each
         artist found in audiofile.
         Will not update ARTIST/ALBUMARTIST until arrangement is verified
+
+        Wikipedia candidates of every unknown artist the library stats
+        know of are prefetched on the first file, so prompts for new
+        artists do not wait on the network.
         """
 
+        if not self.prefetched["artist"]:
+            self.prefetched["artist"] = True
+            self.tagdb.prefetch(list(self.stats.artist), category="artist")
+
         for name in tags.get_artist_tagset(tagfile):
             self.tagdb.verify_artist(name, tagfile)
 
@@ -381,9 +523,16 @@ class LibTagFileAction(LibTagFile):
         """Verify there is a corresponding entry in ``tags.json`` for
         the composer found in the audiofile.
 
-        If an entry is not found, prompt to add a new composer.
+        If an entry is not found, prompt to add a new composer. Unknown
+        composers are prefetched as unknown artists are, see
+        ``synchronize_artist``.
         """
 
+        if not self.prefetched["composer"]:
+            self.prefetched["composer"] = True
+            self.tagdb.prefetch(
+                list(self.stats.composer), category="composer")
+
         # must first assume the file is missing COMPOSER
         # and bootstrap from there
         if "COMPOSER" not in tagfile.tags.keys():
@@ -421,18 +570,20 @@ class LibTagFileAction(LibTagFile):
 
     def get_artist_counts(self, tagfile, **kwargs):
         """count/record artist occurences (to use as ranking)
-        """
-
-        aset = tags.get_artist_tagset(tagfile)
 
-        for aname in aset:
-            artistname = self.tagdb.match_from_perms(aname)
-            if artistname is None:
+        Occurrences are counted per database artist, across permutations,
+        and stored as the ``count`` of each artist in ``tags.json`` by
+        ``follow_up``. Arrangements are ranked from ``stats.LibraryStats``
+        where it has seen an artist, and from this ``count`` otherwise,
+        see ``tags.TagDatabase.artist_rank``. The walk populates the
+        statistics of a library for the first time too.
+        """
+        for aname in tags.get_artist_tagset(tagfile):
+            try:
+                akey = self.tagdb.match_from_perms(aname)
+            except tags.KeyNotFoundError:
                 continue
-            if artistname in self.artist_count.keys():
-                self.artist_count[artistname] += 1
-            else:
-                self.artist_count[artistname] = 1
+            self.artist_count[akey] = self.artist_count.get(akey, 0) + 1
 
     def get_arrangement_set(self, tagfile, **kwargs):
         """get set and count of instrumental groupings via sorted
@@ -453,6 +604,76 @@ class LibTagFileAction(LibTagFile):
             self.instrument_groupings[sar] = 1
 
 
+def convert_audio(src, dst, ftags):
+    """convert ``src`` to ``dst`` with ``ffmpeg``, carrying ``ftags``
+    across, then atomically swap ``dst`` in for ``src``.
+
+    The conversion is written to a temporary name next to ``dst``, which
+    only becomes ``dst`` once it is complete and tagged, after which
+    ``src`` is removed. A failed conversion leaves ``src`` untouched, as
+    does an existing ``dst``, e.g. a foo.flac next to foo.mp3, which is
+    never overwritten: nothing is converted and ``None`` is returned.
+    """
+    if os.path.exists(dst):
+        util.printr("not converting {}, {} exists".format(src, dst))
+        return None
+
+    (base, ext) = os.path.splitext(dst)
+    tmp = "{}.converting{}".format(base, ext)
+
+    try:
+        with open(os.devnull, "w") as redirect:
+            subprocess.check_call(
+                ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+                 "-i", src, "-map_metadata", "0", "-vn", tmp],
+                stdout=redirect)
+
+        # taglib may not read everything ffmpeg maps, so write explicitly
+        converted = taglib.File(tmp)
+        converted.tags.update(ftags)
+        converted.save()
+        converted.close()
+
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    os.remove(src)
+    return dst
+
+
+def album_key(tagfile):
+    """ identify the album of ``tagfile`` by its folder and ALBUM tag """
+    return (os.path.dirname(tagfile.path),
+            ", ".join(tagfile.tags.get("ALBUM", [])))
+
+
+def prompt_album_artist(key, plans):
+    """prompt once for the ALBUMARTIST ordering of an album's
+    arrangements, when any of them has more than one artist.
+    """
+
+    ranked = []
+    for plan in plans.values():
+        if len(plan.sar) > 1 and plan not in ranked:
+            ranked.append(plan)
+    if not ranked:
+        return
+
+    util.printr("ranking arrangement:")
+    print("\n\tfolder: {}\n\talbum: {}".format(*key))
+    for plan in ranked:
+        print("\tarrangement: {}".format(list(plan.sar.keys())))
+
+    response = input("[#]ordering, [<CR>] default ordering ... ? ")
+    if response.strip().isdigit():
+        for plan in ranked:
+            plan.reorder(int(response))
+    elif response:
+        util.printr("Unable to parse response, using default ordering")
+
+
 def after_action_review(count):
     """ after_action_review """
     util.printr(
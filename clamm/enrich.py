@@ -0,0 +1,241 @@
+"""background enrichment of new tag database items, i.e. the wikipedia
+pages a new artist or composer is filled in from.
+
+Pages come from a provider. ``WikipediaProvider`` asks wikipedia via the
+``wikipedia`` package, ``FixtureProvider`` answers from a local ``json``
+file, for tests and offline runs. Either is wrapped in a
+``CachedProvider`` so each search and page is only fetched once per
+``config["database"]["enrich"]["ttl_days"]``.
+
+An ``Enricher`` runs an ``asyncio`` event loop in a background thread.
+``prefetch`` schedules the searches, and the top candidate pages, of
+many names at once and returns right away, so by the time a walk gets
+to prompting for an unknown name its candidates are usually there
+already. Each name is fetched on its own, so a prompt only ever waits on
+the name it is for. Providers are blocking, they run on the loop's
+worker threads, ``n_workers`` at a time.
+"""
+
+import abc
+import json
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from clamm import config
+from clamm import util
+
+SEC_PER_DAY = 60 * 60 * 24
+
+
+class WikiProvider(abc.ABC):
+    """ Interface of a page provider.
+
+    Pages are dicts with ``title``, ``summary`` and ``url``.
+    """
+
+    @abc.abstractmethod
+    def search(self, term):
+        """ page titles matching a search ``term`` """
+
+    @abc.abstractmethod
+    def page(self, title):
+        """ the page titled ``title``, ``None`` if there is none """
+
+
+class WikipediaProvider(WikiProvider):
+    """ wikipedia, via the ``wikipedia`` package """
+
+    def search(self, term):
+        import wikipedia
+        return wikipedia.search(term)
+
+    def page(self, title):
+        import wikipedia
+        try:
+            page = wikipedia.page(title, auto_suggest=False)
+        except (wikipedia.exceptions.PageError,
+                wikipedia.exceptions.DisambiguationError):
+            return None
+        return {"title": page.title, "summary": page.summary,
+                "url": page.url}
+
+
+class FixtureProvider(WikiProvider):
+    """ answers from a local ``json`` file of the form::
+
+        {"search": {"<term>": ["<title>", ...]},
+         "page": {"<title>": {"title": ..., "summary": ..., "url": ...}}}
+    """
+
+    def __init__(self, path):
+        with open(path) as fptr:
+            self.fixture = json.load(fptr)
+
+    def search(self, term):
+        return self.fixture["search"].get(term, [])
+
+    def page(self, title):
+        return self.fixture["page"].get(title)
+
+
+class CachedProvider(WikiProvider):
+    """ persistent response cache in front of another provider. The
+    cache is written by ``save``, not on every miss.
+
+    Parameters
+    ----------
+    provider: WikiProvider
+    cache: util.JsonCache
+    """
+
+    def __init__(self, provider, cache):
+        self.provider = provider
+        self.cache = cache
+
+    def cached(self, key, func, arg):
+        """ cached response for ``key``, filled by ``func(arg)`` on a
+        miss. Empty responses are not cached. """
+        response = self.cache.get(key)
+        if response is None:
+            response = func(arg)
+            if response:
+                self.cache.set(key, response)
+        return response
+
+    def search(self, term):
+        return self.cached(
+            "search:{}".format(term), self.provider.search, term) or []
+
+    def page(self, title):
+        return self.cached("page:{}".format(title), self.provider.page, title)
+
+    def save(self):
+        self.cache.save()
+
+
+class Page():
+    """ attribute access to a page dict, as ``wikipedia.WikipediaPage``
+    offers it """
+
+    def __init__(self, page):
+        self.title = page["title"]
+        self.summary = page["summary"]
+        self.url = page.get("url")
+
+
+def get_provider():
+    """ the configured provider, behind the response cache """
+    ecfg = config["database"]["enrich"]
+    if ecfg["provider"] == "fixture":
+        provider = FixtureProvider(ecfg["fixture"])
+    else:
+        provider = WikipediaProvider()
+
+    cache = util.JsonCache(
+        config["path"]["enrich"], ttl=ecfg["ttl_days"] * SEC_PER_DAY)
+    return CachedProvider(provider, cache)
+
+
+class Enricher():
+    """ Candidate pages of names, fetched concurrently in the background.
+
+    Parameters
+    ----------
+    provider: CachedProvider, optional
+        default is ``get_provider()``
+
+    Attributes
+    ----------
+    futures: dict
+        per name, the ``concurrent.futures.Future`` of its own fetch,
+        whose result holds its candidates
+    n_pending: int
+        fetches not finished yet; the response cache is saved whenever
+        none are left, and on ``close``
+    """
+
+    def __init__(self, provider=None):
+        ecfg = config["database"]["enrich"]
+        self.provider = provider or get_provider()
+        self.n_pages = ecfg["n_pages"]
+        self.pool = ThreadPoolExecutor(max_workers=ecfg["n_workers"])
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.pool)
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.n_pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    async def fetch(self, name):
+        """ search ``name`` and fetch its top ``n_pages`` pages """
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(
+            None, self.provider.search, name)
+        pages = await asyncio.gather(*(
+            loop.run_in_executor(None, self.provider.page, title)
+            for title in results[:self.n_pages]))
+        return {"results": results,
+                "pages": {page["title"]: page for page in pages if page}}
+
+    def prefetch(self, names):
+        """ start fetching the candidates of every one of ``names`` not
+        already asked for, returns without waiting """
+        names = sorted(set(names) - set(self.futures))
+        if not names:
+            return
+        util.printr("prefetching wikipedia candidates of {} names".format(
+            len(names)))
+        with self.lock:
+            self.n_pending += len(names)
+        for name in names:
+            future = asyncio.run_coroutine_threadsafe(
+                self.fetch(name), self.loop)
+            future.add_done_callback(self.fetched)
+            self.futures[name] = future
+
+    def fetched(self, future):
+        """ done-callback of each fetch, saves the cache after the last
+        one outstanding """
+        with self.lock:
+            self.n_pending -= 1
+            idle = self.n_pending == 0
+        if idle:
+            self.provider.save()
+
+    def candidates(self, name):
+        """``{"results": [title, ...], "pages": {title: page}}`` of
+        ``name``, waiting on its prefetch, or fetching it, if need be.
+        ``pages`` holds the top results only, see ``page``.
+        """
+        if name not in self.futures:
+            self.prefetch([name])
+        try:
+            return self.futures[name].result()
+        except Exception as err:
+            util.printr("failed to fetch {}: {}".format(name, err))
+            del self.futures[name]
+            return {"results": [], "pages": {}}
+
+    def page(self, name, title):
+        """ the ``Page`` titled ``title``, among the candidates of ``name``
+        or fetched """
+        page = self.candidates(name)["pages"].get(title)
+        if page is None:
+            page = self.provider.page(title)
+        return Page(page) if page else None
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.pool.shutdown()
+        self.provider.save()
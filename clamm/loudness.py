@@ -0,0 +1,439 @@
+"""
+loudness analysis (ITU-R BS.1770 / EBU R128) for ReplayGain 2.0 tagging.
+
+Each track is decoded once, a block of frames at a time, so it is never
+held in memory whole. Each block is K-weighted and reduced to the mean
+square power of its 100 ms hops, from which the gating blocks (400 ms,
+75% overlap) follow, and its true peak is taken from a 4x oversampled
+copy; the filters carry their state from one block to the next, see
+``BlockFilter``. A track is summarized by a histogram of the
+loudness of its blocks (0.1 LU bins), from which both its own and its
+album's gated integrated loudness follow, since gating an album is gating
+the union of its tracks' blocks. Histograms are small enough to cache, so
+an album gets its gain again without decoding the tracks that are
+unchanged.
+
+Filtering is done with ``scipy.signal`` when it is installed, else with
+numpy alone, by FFT convolution with the filters' impulse responses.
+Decoding is done by ``soundfile`` when it is installed, else by
+``ffmpeg``. Both packages are optional.
+
+The cache (``config["path"]["loudness"]``) keys results by file path and
+modification time; for flac files the MD5 of the audio in STREAMINFO is
+kept too, so editing tags does not count as new material.
+"""
+
+import os
+import json
+import subprocess
+from functools import lru_cache
+
+import numpy as np
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+try:
+    from scipy import signal
+except ImportError:
+    signal = None
+
+from clamm import config
+from clamm import util
+
+REFERENCE = -18.0       # ReplayGain 2.0 reference loudness, LUFS
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+BLOCK_SEC, HOP_SEC = 0.4, 0.1
+OVERSAMPLE = 4
+BIN_LU = 0.1
+N_BIN = int((10 - ABSOLUTE_GATE) / BIN_LU)      # -70 to +10 LUFS
+DECODE_FRAMES = 1 << 16
+
+
+def k_weighting(rate):
+    """``(b, a)`` of the two biquads of the BS.1770 K-weighting filter,
+    a high shelf then a high pass, at sample ``rate``
+    """
+    gain, f_shelf, q_shelf = 3.999843853973347, 1681.974450955533, \
+        0.7071752369554196
+    k = np.tan(np.pi * f_shelf / rate)
+    v_h = 10 ** (gain / 20)
+    v_b = v_h ** 0.4996667741545416
+    a_0 = 1 + k / q_shelf + k * k
+    shelf = (
+        np.array([v_h + v_b * k / q_shelf + k * k, 2 * (k * k - v_h),
+                  v_h - v_b * k / q_shelf + k * k]) / a_0,
+        np.array([1, 2 * (k * k - 1) / a_0, (1 - k / q_shelf + k * k) / a_0]))
+
+    f_pass, q_pass = 38.13547087602444, 0.5003270373238773
+    k = np.tan(np.pi * f_pass / rate)
+    a_0 = 1 + k / q_pass + k * k
+    highpass = (
+        np.array([1.0, -2.0, 1.0]),
+        np.array([1, 2 * (k * k - 1) / a_0, (1 - k / q_pass + k * k) / a_0]))
+    return shelf, highpass
+
+
+@lru_cache()
+def k_impulse(rate, seconds=1.0):
+    """ impulse response of ``k_weighting(rate)``, long enough for the
+    tail to be negligible """
+    response = np.zeros(int(seconds * rate))
+    response[0] = 1.0
+    for b, a in k_weighting(rate):
+        out = np.zeros_like(response)
+        x_1 = x_2 = y_1 = y_2 = 0.0
+        for i, x_0 in enumerate(response):
+            y_0 = b[0] * x_0 + b[1] * x_1 + b[2] * x_2 - \
+                a[1] * y_1 - a[2] * y_2
+            out[i] = y_0
+            x_2, x_1, y_2, y_1 = x_1, x_0, y_1, y_0
+        response = out
+    return response
+
+
+def fft_convolve(x_data, response):
+    """ full convolution of the columns of ``x_data`` with ``response`` """
+    n_out = len(x_data) + len(response) - 1
+    n_fft = 1 << int(np.ceil(np.log2(n_out)))
+    spectrum = np.fft.rfft(response, n_fft)[:, None]
+    return np.fft.irfft(
+        np.fft.rfft(x_data, n_fft, axis=0) * spectrum, n_fft, axis=0)[:n_out]
+
+
+class BlockFilter():
+    """ A linear filter over a signal that arrives in blocks of frames.
+
+    With ``scipy``, each ``(b, a)`` of ``stages`` runs through ``lfilter``,
+    its state carried from block to block. Without, the stages are applied
+    as their combined impulse response, ``impulse()``, by FFT convolution,
+    the tail of each block being added into the next.
+    """
+
+    def __init__(self, stages, impulse):
+        self.stages = stages
+        self.impulse = impulse
+        self.state = None
+
+    def __call__(self, block):
+        if signal is not None:
+            if self.state is None:
+                self.state = [
+                    np.zeros((max(len(a), len(b)) - 1, block.shape[1]))
+                    for b, a in self.stages]
+            for i, (b, a) in enumerate(self.stages):
+                block, self.state[i] = signal.lfilter(
+                    b, a, block, axis=0, zi=self.state[i])
+            return block
+
+        full = fft_convolve(block, self.impulse())
+        if self.state is not None:
+            full[:len(self.state)] += self.state
+        self.state = full[len(block):]
+        return full[:len(block)]
+
+
+@lru_cache()
+def oversampling_filter(factor=OVERSAMPLE, taps_per_phase=12):
+    """ windowed sinc interpolation filter for ``factor`` x oversampling
+    """
+    n_tap = factor * taps_per_phase
+    t = (np.arange(n_tap) - (n_tap - 1) / 2) / factor
+    return np.sinc(t) * np.kaiser(n_tap, 8.0)
+
+
+class TrackLoudness():
+    """ Loudness of a track at sample ``rate``, fed a block of frames at a
+    time by ``update``.
+
+    Attributes
+    ----------
+    hops: list
+        arrays of the mean square power, summed over channels, of each
+        complete 100 ms hop of the K-weighted signal
+    rest: numpy.ndarray
+        squares of the frames of the hop not complete yet
+    peak: float
+        true peak so far, linear: the largest absolute sample value
+        oversampled to at least 176.4 kHz
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.hop = int(HOP_SEC * rate)
+        self.k_filter = BlockFilter(
+            k_weighting(rate), lambda: k_impulse(rate))
+        self.factor = max(1, int(np.ceil(OVERSAMPLE * 44100 / rate)))
+        taps = oversampling_filter(self.factor)
+        self.oversampler = BlockFilter(
+            [(taps, np.ones(1))], lambda: taps)
+        self.hops = []
+        self.rest = np.zeros(0)
+        self.peak = 0.0
+
+    def update(self, block):
+        """ take in the next ``(n, channels)`` frames """
+        if not len(block):
+            return
+        squared = np.concatenate(
+            [self.rest, np.square(self.k_filter(block)).sum(axis=1)])
+        n_hop = len(squared) // self.hop
+        self.hops.append(squared[:n_hop * self.hop].reshape(
+            n_hop, self.hop).mean(axis=1))
+        self.rest = squared[n_hop * self.hop:]
+
+        peak = np.max(np.abs(block))
+        if self.factor > 1:
+            stuffed = np.zeros((len(block) * self.factor, block.shape[1]))
+            stuffed[::self.factor] = block
+            peak = max(peak, np.max(np.abs(self.oversampler(stuffed))))
+        self.peak = max(self.peak, float(peak))
+
+    def powers(self):
+        """ mean square power of every gating block so far """
+        hops = np.concatenate(self.hops) if self.hops else np.zeros(0)
+        per_block = int(BLOCK_SEC / HOP_SEC)
+        if len(hops) < per_block:
+            return np.zeros(0)
+        window = np.convolve(hops, np.ones(per_block), mode="valid")
+        return window / per_block
+
+    def summary(self):
+        return {"histogram": histogram(self.powers()), "peak": self.peak}
+
+
+def true_peak(x_data, rate):
+    """ true peak of the frames ``x_data``, linear, see ``TrackLoudness``
+    """
+    track = TrackLoudness(rate)
+    track.update(x_data)
+    return track.peak
+
+
+def block_powers(x_data, rate):
+    """ mean square power, summed over channels, of every gating block of
+    K-weighted ``x_data`` """
+    track = TrackLoudness(rate)
+    track.update(x_data)
+    return track.powers()
+
+
+def to_lufs(power):
+    return -0.691 + 10 * np.log10(power)
+
+
+def histogram(powers):
+    """ sparse histogram of the loudness of blocks ``powers`` above the
+    absolute gate, as ``{bin: count}`` """
+    with np.errstate(divide="ignore"):
+        lufs = to_lufs(powers)
+    lufs = lufs[lufs > ABSOLUTE_GATE]
+    bins = np.minimum(((lufs - ABSOLUTE_GATE) / BIN_LU).astype(int), N_BIN - 1)
+    index, counts = np.unique(bins, return_counts=True)
+    return {int(i): int(c) for i, c in zip(index, counts)}
+
+
+def integrated(histograms):
+    """gated integrated loudness, in LUFS, of the blocks of
+    ``histograms``, e.g. those of one track or of every track of an
+    album. ``None`` when there is nothing above the absolute gate.
+    """
+    counts = np.zeros(N_BIN)
+    for hist in histograms:
+        for index, count in hist.items():
+            counts[int(index)] += count
+    if not counts.any():
+        return None
+
+    centers = ABSOLUTE_GATE + (np.arange(N_BIN) + 0.5) * BIN_LU
+    powers = 10 ** ((centers + 0.691) / 10)
+
+    def gated_mean(mask):
+        return np.sum(counts[mask] * powers[mask]) / np.sum(counts[mask])
+
+    relative = to_lufs(gated_mean(counts > 0)) + RELATIVE_GATE
+    mask = (counts > 0) & (centers > relative)
+    if not mask.any():
+        return None
+    return float(to_lufs(gated_mean(mask)))
+
+
+def decode(path, n_frame=DECODE_FRAMES):
+    """``(rate, blocks)`` of ``path``: its sample rate and an iterator
+    over its frames, at most ``n_frame`` at a time, as float samples in
+    [-1, 1], one column per channel """
+    if soundfile is not None:
+        try:
+            rate = soundfile.info(path).samplerate
+        except RuntimeError:
+            pass
+        else:
+            return rate, soundfile.blocks(
+                path, blocksize=n_frame, dtype="float64", always_2d=True)
+    return 44100, ffmpeg_blocks(path, 44100, n_frame)
+
+
+def ffmpeg_blocks(path, rate, n_frame):
+    """ frames of ``path`` decoded to stereo at ``rate`` by ``ffmpeg`` """
+    frame_bytes = 2 * 4
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", path,
+           "-f", "f32le", "-ac", "2", "-ar", str(rate), "pipe:1"]
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+        for raw in iter(lambda: proc.stdout.read(n_frame * frame_bytes),
+                        b""):
+            raw = raw[:len(raw) - len(raw) % frame_bytes]
+            yield np.frombuffer(raw, dtype=np.float32).reshape(
+                -1, 2).astype(np.float64)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def analyse(path):
+    """ pool worker, the loudness summary of the track at ``path`` """
+    rate, blocks = decode(path)
+    track = TrackLoudness(rate)
+    for block in blocks:
+        track.update(block)
+    return track.summary()
+
+
+def flac_md5(path):
+    """ hex MD5 of the decoded audio, from the STREAMINFO block of a flac
+    file, or ``None`` when it is not a flac file or the MD5 is unset """
+    with open(path, "rb") as fptr:
+        head = fptr.read(42)
+    if len(head) < 42 or head[:4] != b"fLaC" or head[4] & 0x7f != 0:
+        return None
+    md5 = head[26:42].hex()
+    return None if md5 == "0" * 32 else md5
+
+
+def replaygain(histograms, peak):
+    """ ``(gain, peak)`` tag values, or ``None`` when silent """
+    loudness = integrated(histograms)
+    if loudness is None:
+        return None
+    return "{:.2f} dB".format(REFERENCE - loudness), "{:.6f}".format(peak)
+
+
+class LoudnessCache():
+    """ Loudness summaries of library files, see ``analyse``.
+
+    Attributes
+    ----------
+    files: dict
+        per path, ``mtime``, flac ``md5`` (or ``None``), ``histogram`` and
+        ``peak``
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config["path"]["loudness"]
+        self.files = {}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path=None):
+        """ the cache from disk, empty if there is none yet """
+        cache = cls(path)
+        try:
+            with open(cache.path) as fptr:
+                cache.files = json.load(fptr)["files"]
+        except (IOError, ValueError, KeyError):
+            cache.files = {}
+        return cache
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as fptr:
+            json.dump({"files": self.files}, fptr)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    def get(self, path):
+        """ the summary of ``path`` if it is still current, else ``None``
+        """
+        entry = self.files.get(path)
+        if entry is None:
+            return None
+        mtime = os.path.getmtime(path)
+        if entry["mtime"] != mtime:
+            if entry["md5"] is None or entry["md5"] != flac_md5(path):
+                return None
+            self.touch(path)
+        return entry
+
+    def put(self, path, summary):
+        self.files[path] = dict(
+            summary, mtime=os.path.getmtime(path), md5=flac_md5(path))
+        self.dirty = True
+
+    def touch(self, path):
+        """ ``path`` was written without changing its audio """
+        self.files[path]["mtime"] = os.path.getmtime(path)
+        self.dirty = True
+
+
+class AlbumGain():
+    """ ReplayGain of the tracks and albums a library walk passes over.
+
+    Tracks are analysed, by ``analyse`` in worker processes, as soon as
+    they are added, unless the cache holds them already. Album gains need
+    every track of the album, so tags are only given once the walk is
+    done, by ``tags``.
+
+    Attributes
+    ----------
+    albums: dict
+        paths of the tracks of each album
+    executor: util.BoundedExecutor
+        ``config["library"]["loudness"]["n_workers"]`` worker processes,
+        or one per core when that is ``null``
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache or LoudnessCache.load()
+        self.executor = util.BoundedExecutor(
+            max_workers=config["library"]["loudness"]["n_workers"],
+            processes=True)
+        self.albums = {}
+        self.pending = {}
+
+    def add(self, path, album):
+        self.albums.setdefault(album, []).append(path)
+        if self.cache.get(path) is None:
+            self.pending[path] = self.executor.submit(analyse, path)
+
+    def tags(self):
+        """ wait for the analyses, then yield ``(path, tags)`` with the
+        ``REPLAYGAIN_*`` tags of each track that could be analysed """
+        self.executor.shutdown()
+        for path, future in self.pending.items():
+            if future.exception() is None:
+                self.cache.put(path, future.result())
+        self.pending = {}
+
+        for album in sorted(self.albums):
+            summaries = {path: self.cache.files[path]
+                         for path in self.albums[album]
+                         if path in self.cache.files}
+            album_gain = replaygain(
+                [s["histogram"] for s in summaries.values()],
+                max([s["peak"] for s in summaries.values()], default=0.0))
+            for path, summary in summaries.items():
+                track_gain = replaygain(
+                    [summary["histogram"]], summary["peak"])
+                if track_gain is None or album_gain is None:
+                    continue
+                yield path, {
+                    "REPLAYGAIN_TRACK_GAIN": [track_gain[0]],
+                    "REPLAYGAIN_TRACK_PEAK": [track_gain[1]],
+                    "REPLAYGAIN_ALBUM_GAIN": [album_gain[0]],
+                    "REPLAYGAIN_ALBUM_PEAK": [album_gain[1]],
+                    "REPLAYGAIN_REFERENCE_LOUDNESS": [
+                        "{:.2f} LUFS".format(REFERENCE)]}
+        self.albums = {}
@@ -1,128 +1,577 @@
-#!/usr/bin/env python
+"""stream pcm audio between machines over tcp, e.g. from the computer
+attached to the turntable to the one doing the heavy lifting.
 
-import pyaudio
-import zmq
-import socket
+A connection opens with a ``HELLO`` describing the stream, after which
+audio travels in frames of ``FRAME`` header plus payload. Each frame
+carries a sequence number, so the listener can tell a lost block from a
+late one, and its payload is optionally compressed by a ``CODECS`` entry.
+A frame with no frames of audio ends the stream.
+
+The sender never lets a slow listener stall its source: blocks wait in a
+``SendBuffer`` of bounded depth, and a live source drops the oldest
+blocks once the buffer is full rather than falling behind. The drops and
+the depth of the buffer are reported as metrics. The listener writes
+what it receives to disk through a memory buffer, and fills any gap in
+the sequence with silence so the recording keeps its timing.
+
+A folder of flac files is served as one gapless stream by
+``AlbumSource``, which decodes ahead of the socket in a background
+thread, so the next track is already waiting in its ring buffer when the
+current one ends.
+
+Usage, on the machine with the audio::
+
+    $ arecord -f cd -t raw | clamm streams serve -s -
+
+or, to play back a shelf of albums::
+
+    $ clamm streams serve -s ~/music/classical/Gould
+
+and on the machine writing it to disk::
+
+    $ clamm streams listen -a callisto -o side_a.wav
+"""
+
+import io
+import os
 import sys
+import zlib
 import time
-import wave
-from subprocess import Popen, call
-from glob import glob
-from os.path import join
-import os
+import socket
+import struct
+import threading
+import subprocess
+from collections import deque
+
+import numpy as np
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+from clamm import config
+from clamm import util
+from clamm.streams import pcm
+
+MAGIC = b"CLZS"
+HELLO = struct.Struct("!4sIBBI")    # magic, rate, channels, codec, block
+FRAME = struct.Struct("!QII")       # sequence, n_frame, payload bytes
+FRAME_BYTES = pcm.N_CHANNEL * pcm.SAMPWIDTH
+
+
+class StreamrError(Exception):
+    """ StreamrError """
+
+    def __init__(self, expression, message):
+        self.expression = expression
+        self.message = message
+
+
+def flac_encode(data, rate):
+    frames = np.frombuffer(data, dtype=np.int16).reshape(-1, pcm.N_CHANNEL)
+    buf = io.BytesIO()
+    soundfile.write(buf, frames, rate, format="FLAC", subtype="PCM_16")
+    return buf.getvalue()
+
+
+def flac_decode(payload, rate):
+    frames, _ = soundfile.read(io.BytesIO(payload), dtype="int16")
+    return frames.tobytes()
+
+
+# codec name: (wire id, encode(data, rate), decode(payload, rate))
+CODECS = {
+    "none": (0, lambda data, rate: data, lambda payload, rate: payload),
+    "zlib": (1, lambda data, rate: zlib.compress(data, 1),
+             lambda payload, rate: zlib.decompress(payload)),
+    "flac": (2, flac_encode, flac_decode)}
+CODEC_NAMES = {val[0]: key for key, val in CODECS.items()}
+
+
+def check_codec(codec):
+    """ raise ``StreamrError`` if ``codec`` can not be used here """
+    if codec not in CODECS:
+        raise StreamrError(
+            "codec", "unknown codec {}, one of {}".format(
+                codec, sorted(CODECS)))
+    if codec == "flac" and soundfile is None:
+        raise StreamrError("codec", "flac codec requires soundfile")
+
+
+def recv_exact(sock, n_byte):
+    """ exactly ``n_byte`` from ``sock``, ``None`` if it closes first """
+    buf = bytearray()
+    while len(buf) < n_byte:
+        chunk = sock.recv(n_byte - len(buf))
+        if not chunk:
+            return None
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+class SendBuffer():
+    """ Bounded queue of ``(sequence, block)`` between the source and the
+    socket.
+
+    Parameters
+    ----------
+    max_blocks: int
+        depth of the buffer
+
+    drop: bool
+        when full, drop the oldest block (live sources) rather than block
+        the source until the listener catches up (file sources).
+
+    Attributes
+    ----------
+    dropped: int
+        number of blocks dropped
+
+    max_depth: int
+        deepest the buffer has been, i.e. the worst lag of the listener in
+        blocks
+    """
+
+    def __init__(self, max_blocks, drop=True):
+        self.blocks = deque()
+        self.max_blocks = max_blocks
+        self.drop = drop
+        self.cond = threading.Condition()
+        self.sequence = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.closed = False
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def put(self, block):
+        """ queue ``block`` under the next sequence number, returns
+        ``False`` once the buffer is closed """
+        with self.cond:
+            while not self.drop and len(self.blocks) >= self.max_blocks \
+                    and not self.closed:
+                self.cond.wait()
+            if self.closed:
+                return False
+            if len(self.blocks) >= self.max_blocks:
+                self.blocks.popleft()
+                self.dropped += 1
+            self.blocks.append((self.sequence, block))
+            self.sequence += 1
+            self.max_depth = max(self.max_depth, len(self.blocks))
+            self.cond.notify_all()
+        return True
+
+    def get(self):
+        """ the oldest ``(sequence, block)``, ``None`` once closed and
+        drained """
+        with self.cond:
+            while not self.blocks and not self.closed:
+                self.cond.wait()
+            if not self.blocks:
+                return None
+            item = self.blocks.popleft()
+            self.cond.notify_all()
+            return item
+
+    def close(self):
+        """ no more blocks will be put """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class StreamServer():
+    """ Serve a pcm stream to a single listener.
+
+    Parameters
+    ----------
+    host, port: str, int
+        address to listen on, port 0 picks a free one (see ``address``).
+
+    codec: str
+        one of ``CODECS``
+
+    rate: int
+        sample rate of the source
+
+    Attributes
+    ----------
+    metrics: dict
+        blocks sent/dropped, raw/wire bytes and the deepest the send
+        buffer got, in seconds of audio.
+    """
+
+    def __init__(self, host, port, codec="zlib", rate=pcm.FS):
+        check_codec(codec)
+        ncfg = config["streams"]["network"]
+        self.codec = codec
+        self.rate = rate
+        self.block_frames = ncfg["block_frames"]
+        self.max_blocks = max(1, int(
+            ncfg["buffer_sec"] * rate / self.block_frames))
+        self.lsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.lsock.bind((host, port))
+        self.lsock.listen(1)
+        self.address = self.lsock.getsockname()
+        self.conn = None
+        self.buffer = None
+        self.error = None
+        self.metrics = {}
+
+    def accept(self, timeout=None):
+        """ wait for the listener and greet it """
+        self.lsock.settimeout(timeout)
+        self.conn, peer = self.lsock.accept()
+        self.lsock.close()
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.conn.sendall(HELLO.pack(
+            MAGIC, self.rate, pcm.N_CHANNEL, CODECS[self.codec][0],
+            self.block_frames))
+        util.printr("streaming to {}:{} ({})".format(
+            peer[0], peer[1], self.codec))
+
+    def send_loop(self):
+        """ drain the send buffer into the socket, encoding on the way """
+        encode = CODECS[self.codec][1]
+        try:
+            while True:
+                item = self.buffer.get()
+                if item is None:
+                    self.conn.sendall(FRAME.pack(self.buffer.sequence, 0, 0))
+                    break
+                sequence, block = item
+                payload = encode(block, self.rate)
+                self.conn.sendall(FRAME.pack(
+                    sequence, len(block) // FRAME_BYTES, len(payload)))
+                self.conn.sendall(payload)
+                self.metrics["sent"] += 1
+                self.metrics["bytes_raw"] += len(block)
+                self.metrics["bytes_wire"] += FRAME.size + len(payload)
+        except OSError as err:
+            self.error = err
+            self.buffer.close()
+
+    def serve(self, source, drop=True):
+        """stream ``source`` to the listener until it is exhausted.
+
+        Parameters
+        ----------
+        source: file
+            readable binary file of s16le stereo frames
+
+        drop: bool
+            see ``SendBuffer``
+
+        Returns
+        -------
+        metrics: dict
+        """
+        if self.conn is None:
+            self.accept()
+
+        self.buffer = SendBuffer(self.max_blocks, drop=drop)
+        self.metrics = {"sent": 0, "bytes_raw": 0, "bytes_wire": 0}
+        sender = threading.Thread(target=self.send_loop, daemon=True)
+        sender.start()
+
+        n_block = self.block_frames * FRAME_BYTES
+        while True:
+            block = read_block(source, n_block)
+            if not block or not self.buffer.put(block):
+                break
+        self.buffer.close()
+        sender.join()
+        self.conn.close()
+
+        self.metrics["dropped"] = self.buffer.dropped
+        self.metrics["max_lag_sec"] = \
+            self.buffer.max_depth * self.block_frames / self.rate
+        if self.error is not None:
+            raise StreamrError("serve", "listener went away: {}".format(
+                self.error))
+
+        return self.metrics
+
+
+def read_block(source, n_byte):
+    """ up to ``n_byte`` from ``source``, short only at its end, and
+    always a whole number of frames """
+    buf = bytearray()
+    while len(buf) < n_byte:
+        chunk = source.read(n_byte - len(buf))
+        if not chunk:
+            break
+        buf.extend(chunk)
+    return bytes(buf[:len(buf) - len(buf) % FRAME_BYTES])
+
+
+class StreamListener():
+    """ Receive a stream from a ``StreamServer`` and write it to disk.
+
+    Parameters
+    ----------
+    host, port: str, int
+        address of the server
+
+    Attributes
+    ----------
+    metrics: dict
+        frames received, blocks missing from the sequence, raw/wire bytes
+    """
+
+    def __init__(self, host, port, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        hello = recv_exact(self.sock, HELLO.size)
+        if hello is None:
+            raise StreamrError("listen", "server closed before greeting")
+        magic, self.rate, self.nchannels, codec, self.block_frames = \
+            HELLO.unpack(hello)
+        if magic != MAGIC:
+            raise StreamrError("listen", "not a clamm stream")
+        self.codec = CODEC_NAMES[codec]
+        check_codec(self.codec)
+        self.metrics = {}
+
+    def frames(self):
+        """ generator of decoded blocks, silence stands in for missing
+        blocks """
+        decode = CODECS[self.codec][2]
+        expected = 0
+        while True:
+            header = recv_exact(self.sock, FRAME.size)
+            if header is None:
+                raise StreamrError("listen", "stream ended without a close")
+            sequence, n_frame, n_payload = FRAME.unpack(header)
+            if n_frame == 0:
+                break
+            payload = recv_exact(self.sock, n_payload)
+            if payload is None:
+                raise StreamrError("listen", "stream cut mid frame")
+
+            n_missing = sequence - expected
+            if n_missing > 0:
+                self.metrics["missing"] += n_missing
+                yield bytes(n_missing * self.block_frames * FRAME_BYTES)
+            expected = sequence + 1
+
+            self.metrics["received"] += 1
+            self.metrics["bytes_wire"] += FRAME.size + n_payload
+            yield decode(payload, self.rate)
+
+        self.sock.close()
+
+    def listen(self, path, buffer_bytes=1 << 22):
+        """write the stream to ``path``, a ``.wav`` file, or raw frames
+        for any other extension.
 
-# Record over network usage example
-# on remote machine
-#$ ./streamr.py callisto stream sound
-# on local machine
-#$ ./streamr.py callisto listen disk filename
+        Returns
+        -------
+        metrics: dict
+        """
+        self.metrics = {"received": 0, "missing": 0, "bytes_raw": 0,
+                        "bytes_wire": 0}
+        as_wav = path.endswith(".wav")
+        with open(path, "wb", buffering=buffer_bytes) as fptr:
+            if as_wav:
+                fptr.write(pcm.wav_header(0, framerate=self.rate))
+            for data in self.frames():
+                if as_wav and \
+                        self.metrics["bytes_raw"] + len(data) > \
+                        pcm.MAX_WAV_DATA:
+                    raise pcm.StreamError(
+                        path, "stream outgrew the 4 GiB limit of a wav "
+                        "file, listen to a raw file instead")
+                fptr.write(data)
+                self.metrics["bytes_raw"] += len(data)
 
-# setup options
-ip = sys.argv[1]
-role = sys.argv[2] # stream/listen
-device = sys.argv[3] # disk/sound
+            if as_wav:
+                fptr.seek(0)
+                fptr.write(pcm.wav_header(
+                    self.metrics["bytes_raw"] // FRAME_BYTES,
+                    framerate=self.rate))
 
-# setup pyaudio
-pa = pyaudio.PyAudio()
-FORMAT = pyaudio.paInt16
-CHANNELS = 2
-RATE = 48000
+        return self.metrics
 
-# setup zmq
-ctx = zmq.Context()
-lu = {'stream': [zmq.PUB, 'from'], 'listen': [zmq.SUB, 'to']}
-sock = ctx.socket(lu[role][0])
 
-# setup wave
-if device == 'disk':
-    disk_target = sys.argv[4]
+class RingBuffer():
+    """ Fixed-capacity byte fifo between one writer and one reader
+    thread; ``write`` waits for room and ``read`` for data.
+    """
 
-    if role == 'listen':
-        wav = wave.open(disk_target, 'wb')
-        wav.setnchannels(CHANNELS)
-        wav.setsampwidth(pa.get_sample_size(pyaudio.paInt16))
-        wav.setframerate(RATE)
+    def __init__(self, capacity):
+        self.buf = bytearray(capacity)
+        self.capacity = capacity
+        self.head = 0       # next byte to read
+        self.size = 0
+        self.cond = threading.Condition()
+        self.closed = False
 
-    elif role == 'stream':
-        flac_files = glob(join(disk_target, '*.flac'))
+    def write(self, data):
+        view = memoryview(data)
+        while len(view):
+            with self.cond:
+                while self.size == self.capacity and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                tail = (self.head + self.size) % self.capacity
+                n_byte = min(len(view), self.capacity - self.size,
+                             self.capacity - tail)
+                self.buf[tail:tail + n_byte] = view[:n_byte]
+                self.size += n_byte
+                view = view[n_byte:]
+                self.cond.notify_all()
 
-        wav_file = "/Users/paul/tmp.wav"
-        if os.path.exists(wav_file):
-            os.remove(wav_file)
+    def read(self, n_byte):
+        """ up to ``n_byte``, waiting for at least one unless closed;
+        ``b""`` once closed and drained """
+        with self.cond:
+            while not self.size and not self.closed:
+                self.cond.wait()
+            n_byte = min(n_byte, self.size, self.capacity - self.head)
+            data = bytes(self.buf[self.head:self.head + n_byte])
+            self.head = (self.head + n_byte) % self.capacity
+            self.size -= n_byte
+            self.cond.notify_all()
+            return data
 
-        call(['ffmpeg', '-loglevel', 'quiet', '-i', flac_files[0], wav_file])
-        wav = wave.open(wav_file, 'rb')
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
 
-def callback(data, frame_count, time_info, status):
-    if role == 'listen':
-        data = sock.recv()
 
-        if device == 'disk': wav.writeframes(data)
+def decode_track(path, rate, n_frame=1 << 16):
+    """generator of s16le stereo blocks of the audio file at ``path``,
+    decoded in-process by ``soundfile`` when the file is already at
+    ``rate`` in stereo, else through ``ffmpeg``.
+    """
+    if soundfile is not None:
+        info = soundfile.info(path)
+        if info.samplerate == rate and info.channels == pcm.N_CHANNEL:
+            with soundfile.SoundFile(path) as sfile:
+                for block in sfile.blocks(blocksize=n_frame, dtype="int16"):
+                    yield block.tobytes()
+            return
 
-    elif role == 'stream':
-        if device == 'disk': data = wav.readframes(1024)
+    proc = subprocess.Popen(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", path,
+         "-f", "s16le", "-ar", str(rate), "-ac", "2", "pipe:1"],
+        stdout=subprocess.PIPE)
+    while True:
+        data = proc.stdout.read(n_frame * FRAME_BYTES)
+        if not data:
+            break
+        yield data
+    proc.wait()
 
-        sock.send(data)
 
-    return (data, pyaudio.paContinue)
+class AlbumSource():
+    """ The flac files under a folder as one gapless stream of s16le
+    frames, albums in folder order and tracks in name order.
 
-def init_zmq():
-    tcp = "tcp://%s:5555" % socket.gethostbyname(ip)
-    if role == 'listen':
-        # zmq
-        sock.connect(tcp)
-        sock.setsockopt(zmq.SUBSCRIBE, '')
+    A background thread decodes into a ``RingBuffer`` of ``ring_sec``
+    seconds, so decoding the next track overlaps streaming the current
+    one and nothing is written to disk in between.
 
-    elif role == 'stream':
-        # zmq
-        sock.bind(tcp)
+    Attributes
+    ----------
+    tracks: list
+        paths of the flac files, in streaming order
+    """
 
-if role == 'listen':
-    stream = pa.open(format=FORMAT,
-        channels=CHANNELS,
-        rate=RATE,
-        output=True,
-        stream_callback=callback)
+    def __init__(self, folder, rate=pcm.FS, ring_sec=None):
+        if ring_sec is None:
+            ring_sec = config["streams"]["network"]["ring_sec"]
+        self.rate = rate
+        self.tracks = [
+            os.path.join(root, name)
+            for root, dirs, files in sorted(os.walk(folder))
+            for name in sorted(files) if name.endswith(".flac")]
+        self.ring = RingBuffer(int(ring_sec * rate) * FRAME_BYTES)
+        self.error = None
+        self.decoder = threading.Thread(target=self.decode, daemon=True)
+        self.decoder.start()
 
-elif role == 'stream':
-    stream = pa.open(format=FORMAT,
-        channels=CHANNELS,
-        rate=RATE,
-        input=True,
-        stream_callback=callback)
+    def decode(self):
+        try:
+            for path in self.tracks:
+                util.printr("decoding {}".format(os.path.basename(path)))
+                for data in decode_track(path, self.rate):
+                    self.ring.write(data)
+                    if self.ring.closed:
+                        return
+        except Exception as err:
+            self.error = err
+        finally:
+            self.ring.close()
 
-print "%sing %s %s on %s" % (role, lu[role][1], device, ip)
+    def read(self, n_byte):
+        data = self.ring.read(n_byte)
+        if not data and self.error is not None:
+            raise StreamrError("decode", str(self.error))
+        return data
 
-init_zmq()
+    def close(self):
+        self.ring.close()
+        self.decoder.join()
 
-while stream.is_active():
-    time.sleep(0.1)
 
-# stop stream
-stream.stop_stream()
-stream.close()
+def open_source(path, rate=pcm.FS):
+    """a readable stream of s16le frames: ``-`` is stdin, a folder is its
+    flac files back to back (``AlbumSource``), a ``.pcm`` file is read as
+    is and anything else is decoded through ``ffmpeg``.
 
-# close pyaudio/zmq
-pa.terminate()
+    Returns
+    -------
+    source: file
+    live: bool
+        whether the source runs in real time, i.e. should drop rather
+        than wait for a slow listener
+    """
+    if path == "-":
+        return sys.stdin.buffer, True
+    if os.path.isdir(path):
+        return AlbumSource(path, rate=rate), False
+    if path.endswith(".pcm"):
+        return open(path, "rb"), False
 
-def album():
-    init_zmq()
-    stream = init_stream()
+    proc = subprocess.Popen(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", path,
+         "-f", "s16le", "-ar", str(rate), "-ac", "2", "pipe:1"],
+        stdout=subprocess.PIPE)
+    return proc.stdout, False
 
-    for flac in flac_files:
 
-        if os.path.exists(wav_file):
-            os.remove(wav_file)
+def report(metrics, elapsed):
+    """ print the metrics of a finished stream """
+    ratio = metrics["bytes_wire"] / max(1, metrics["bytes_raw"])
+    util.printr("{:.1f} MB in {:.1f} sec, wire/raw {:.2f}, {}".format(
+        metrics["bytes_raw"] / 1e6, elapsed, ratio,
+        ", ".join("{} {}".format(key, val) for key, val in
+                  sorted(metrics.items()) if not key.startswith("bytes"))))
 
-        call(['ffmpeg', '-loglevel', 'quiet', '-i', flac, wav_file])
-        wav = wave.open(wav_file, 'rb')
 
-        while stream.is_active():
-            time.sleep(0.1)
+def serve(path, host, port, codec):
+    """ serve ``path`` (see ``open_source``) to one listener """
+    server = StreamServer(host, port, codec=codec)
+    util.printr("waiting for a listener on {}:{}...".format(*server.address))
+    source, live = open_source(path)
+    tic = time.time()
+    try:
+        metrics = server.serve(source, drop=live)
+    finally:
+        source.close()
+    report(metrics, time.time() - tic)
 
-        # stop stream
-        stream.stop_stream()
-        stream.close()
 
-    # close pyaudio/zmq
-    pa.terminate()
+def listen(host, port, path):
+    """ write the stream served at ``host`` to ``path`` """
+    listener = StreamListener(host, port)
+    tic = time.time()
+    metrics = listener.listen(path)
+    report(metrics, time.time() - tic)
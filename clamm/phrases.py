@@ -0,0 +1,147 @@
+"""multi-word phrase matching, to guess tag values from free text.
+
+``PhraseMatcher`` is an Aho-Corasick automaton over words rather than
+characters: phrases and text are split the way ``nltk``'s
+``WordPunctTokenizer`` splits them, into runs of word characters and runs
+of punctuation, and compared case-insensitively. A value such as
+"Soviet-born American" then matches as a whole, and "American" still
+matches within it, but never within "Americana". Every occurrence of every
+phrase is found in a single scan of the text.
+
+Phrases can be added and removed at any time; the trie grows in place and
+the failure links are recomputed, once, before the next scan.
+"""
+
+import re
+from collections import deque
+
+TOKEN = re.compile(r"\w+|[^\w\s]+")
+
+
+def tokenize(text):
+    """ ``(offset, token)`` of each token of ``text``, case folded """
+    return [(match.start(), match.group().casefold())
+            for match in TOKEN.finditer(text)]
+
+
+class PhraseMatcher():
+    """ Aho-Corasick automaton over the tokens of a set of phrases.
+
+    Attributes
+    ----------
+    phrases: set
+        the phrases matched
+
+    goto: list
+        per node, the node reached by each next token
+
+    output: list
+        per node, the phrases whose tokens end there, if any
+    """
+
+    def __init__(self, phrases=()):
+        self.phrases = set()
+        self.goto = [{}]
+        self.depth = [0]
+        self.output = [set()]
+        self.fail = [0]
+        self.out_link = [0]
+        self.linked = True
+        self.update(phrases)
+
+    def __contains__(self, phrase):
+        return phrase in self.phrases
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def node_of(self, phrase, create=False):
+        """ the node the tokens of ``phrase`` lead to, or ``None`` """
+        node = 0
+        for _, token in tokenize(phrase):
+            nxt = self.goto[node].get(token)
+            if nxt is None:
+                if not create:
+                    return None
+                nxt = len(self.goto)
+                self.goto[node][token] = nxt
+                self.goto.append({})
+                self.depth.append(self.depth[node] + 1)
+                self.output.append(set())
+            node = nxt
+        return node or None
+
+    def add(self, phrase):
+        node = self.node_of(phrase, create=True)
+        if node is not None:
+            self.phrases.add(phrase)
+            self.output[node].add(phrase)
+            self.linked = False
+
+    def discard(self, phrase):
+        node = self.node_of(phrase)
+        if node is not None and phrase in self.output[node]:
+            self.output[node].discard(phrase)
+            self.linked = False
+        self.phrases.discard(phrase)
+
+    def update(self, phrases):
+        """ match exactly ``phrases`` from now on, by adding and removing
+        the difference only """
+        phrases = set(phrases)
+        for phrase in self.phrases - phrases:
+            self.discard(phrase)
+        for phrase in phrases - self.phrases:
+            self.add(phrase)
+
+    def link(self):
+        """ breadth first, the failure link of each node (the node of its
+        longest proper suffix) and its output link (the nearest node with
+        output along the failure links) """
+        if self.linked:
+            return
+        n_node = len(self.goto)
+        self.fail = [0] * n_node
+        self.out_link = [0] * n_node
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self.goto[node].items():
+                fail = self.fail[node]
+                while fail and token not in self.goto[fail]:
+                    fail = self.fail[fail]
+                fail = self.goto[fail].get(token, 0)
+                self.fail[child] = fail
+                self.out_link[child] = \
+                    fail if self.output[fail] else self.out_link[fail]
+                queue.append(child)
+        self.linked = True
+
+    def find(self, text):
+        """every occurrence of a phrase in ``text``, as ``(offset,
+        phrase)``, by position, longer phrases first at the same position
+        """
+        self.link()
+        tokens = tokenize(text)
+        goto, fail, output = self.goto, self.fail, self.output
+        found = []
+        node = 0
+        for i, (_, token) in enumerate(tokens):
+            while node and token not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(token, 0)
+            hit = node if output[node] else self.out_link[node]
+            while hit:
+                start = tokens[i - self.depth[hit] + 1][0]
+                for phrase in output[hit]:
+                    found.append((start, -self.depth[hit], phrase))
+                hit = self.out_link[hit]
+        found.sort()
+        return [(start, phrase) for start, _, phrase in found]
+
+    def ranked(self, text):
+        """ the distinct phrases found in ``text``, by first occurrence """
+        ranked = {}
+        for _, phrase in self.find(text):
+            ranked.setdefault(phrase, None)
+        return list(ranked)
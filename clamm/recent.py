@@ -0,0 +1,198 @@
+"""
+the recently-added playlist, kept incrementally.
+
+An album is recently added while the ctime of its folder is younger than
+``config["library"]["recently_added_day_age"]`` days. Rather than walking
+the library and stating the folder of every file, ``RecentlyAdded`` keeps
+an index of the ctime of every folder of the library, and a high-water
+mark: the time the last update started. An update stats the indexed
+folders only, and lists just those changed since the high-water mark (a
+folder's ctime moves whenever an entry is added to, removed from or
+renamed in it), so new albums are found without listing the rest of the
+library. Albums that aged out are expired from the same index.
+
+Each update returns what it added and removed; only when that delta is
+not empty is the playlist file rewritten, and only the tracks added are
+sent to cmus, see ``push``.
+"""
+
+import os
+import json
+import time
+import subprocess
+
+from clamm import config
+from clamm import util
+
+PLAYLIST_NAME = "recently-added.m3u"
+
+# file system timestamps come from a coarse clock, which can lag
+# ``time.time()``; the high-water mark is kept this far back
+SLACK_SEC = 2
+
+
+class RecentlyAdded():
+    """ Recently added albums, with the folder index they are found by.
+
+    Attributes
+    ----------
+    folders: dict
+        ctime of each folder of the library, keyed by path
+    albums: dict
+        tracks of each recently added album folder, keyed by path
+    high_water: float
+        start of the last full update, folders whose ctime is older have
+        not changed since
+    """
+
+    def __init__(self, path=None, root=None):
+        self.path = path or config["path"]["recent"]
+        self.root = os.path.abspath(root or config["path"]["library"])
+        self.folders = {}
+        self.albums = {}
+        self.high_water = 0.0
+
+    @classmethod
+    def load(cls, path=None, root=None):
+        """ the index from disk, empty if there is none yet, or it is of
+        another library root """
+        recent = cls(path, root)
+        try:
+            with open(recent.path) as fptr:
+                saved = json.load(fptr)
+        except (IOError, ValueError):
+            return recent
+        if saved.get("root") == recent.root:
+            recent.folders = saved["folders"]
+            recent.albums = saved["albums"]
+            recent.high_water = saved["high_water"]
+        return recent
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as fptr:
+            json.dump({"root": self.root, "high_water": self.high_water,
+                       "folders": self.folders, "albums": self.albums},
+                      fptr, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    @property
+    def tracks(self):
+        """ every recently added track, newest album first """
+        return [track for folder in sorted(
+                    self.albums, key=lambda f: -self.folders[f])
+                for track in self.albums[folder]]
+
+    def examine(self, folder, cutoff, delta):
+        """list ``folder``, updating its ctime and album, ``delta`` is
+        ``(added, removed)``. Returns the sub-folders not indexed yet.
+        """
+        try:
+            entries = list(os.scandir(folder))
+            ctime = os.stat(folder).st_ctime
+        except OSError:
+            self.forget(folder, delta)
+            return []
+
+        self.folders[folder] = ctime
+        tracks = sorted(entry.path for entry in entries
+                        if entry.is_file() and util.is_audio_file(entry.name))
+        old = self.albums.get(folder, [])
+        if not tracks or ctime < cutoff:
+            tracks = []
+            self.albums.pop(folder, None)
+        else:
+            self.albums[folder] = tracks
+        delta[0].extend(sorted(set(tracks) - set(old)))
+        delta[1].extend(sorted(set(old) - set(tracks)))
+
+        return [entry.path for entry in entries
+                if entry.is_dir() and entry.path not in self.folders]
+
+    def forget(self, folder, delta):
+        """ drop ``folder``, which is gone, and any of its sub-folders """
+        prefix = folder + os.sep
+        for gone in [f for f in self.folders
+                     if f == folder or f.startswith(prefix)]:
+            del self.folders[gone]
+            delta[1].extend(self.albums.pop(gone, []))
+
+    def update(self, folders=None, now=None):
+        """bring the index up to date: list the folders changed since the
+        high-water mark (or just ``folders``, leaving the mark alone) and
+        any new folders under them, and expire albums that aged out by
+        ``now``.
+
+        Returns
+        -------
+        added, removed: list
+            tracks that entered and left the recently added set
+        """
+        now = time.time() if now is None else now
+        cutoff = now - config["library"]["recently_added_day_age"] * \
+            util.SEC_PER_DAY
+        delta = ([], [])
+
+        if folders is not None:
+            queue = list(folders)
+        elif self.root not in self.folders:
+            queue = [self.root]
+        else:
+            queue = []
+            for folder in list(self.folders):
+                try:
+                    changed = os.stat(folder).st_ctime >= self.high_water
+                except OSError:
+                    self.forget(folder, delta)
+                    continue
+                if changed:
+                    queue.append(folder)
+        if folders is None:
+            self.high_water = time.time() - SLACK_SEC
+
+        while queue:
+            queue.extend(self.examine(queue.pop(), cutoff, delta))
+
+        for folder in [f for f in self.albums if self.folders[f] < cutoff]:
+            delta[1].extend(self.albums.pop(folder))
+        return delta
+
+    def write_playlist(self):
+        """ the recently added tracks, as an m3u playlist """
+        path = os.path.join(config["path"]["playlist"], PLAYLIST_NAME)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fptr:
+            fptr.writelines(track + "\n" for track in self.tracks)
+        return path
+
+
+def push(added):
+    """hand the ``added`` tracks to cmus, with the options
+    ``config["opt"]["cmus-remote"]``: ``-q`` queues them, ``-P`` adds them
+    to the playlist marked in cmus. A playlist cannot be selected by name
+    remotely, so expired tracks are left to the playlist file, see
+    ``RecentlyAdded.write_playlist``.
+    """
+    if not added:
+        return
+    try:
+        status = subprocess.call(
+            ["cmus-remote", config["opt"]["cmus-remote"]] + added)
+    except OSError as err:
+        status = err
+    if status:
+        util.printr("could not update cmus: {}".format(status))
+
+
+def refresh(folders=None):
+    """ update the saved index, the playlist file and cmus, see
+    ``RecentlyAdded.update`` """
+    recent = RecentlyAdded.load()
+    added, removed = recent.update(folders)
+    if added or removed:
+        util.printr("recently added: {} new, {} expired tracks".format(
+            len(added), len(removed)))
+        recent.write_playlist()
+        push(added)
+    recent.save()
+    return added, removed
@@ -0,0 +1,159 @@
+"""binary snapshot of the tag database, for fast loading.
+
+``tags.json`` stays the human-editable source of truth; the snapshot is a
+cache of it, stored next to it and rebuilt whenever it is stale. It is
+columnar: every distinct string is stored once in a string table, and
+each field of the artist/composer records is a column of references
+into it. Decoding is then a pass over a few flat lists rather than
+parsing text and building a dict per record. The layout is ``marshal``
+encoded, so the snapshot is only valid for the Python version that wrote
+it.
+
+A snapshot is used only if its header carries the ``sha256`` of the
+``json`` bytes. Its age does not matter, so a ``json`` rewritten with the
+same content keeps its snapshot. Even a snapshot that cannot be used
+tells what content it was made from, see ``saved_digest``.
+"""
+
+import os
+import gc
+import sys
+import struct
+import marshal
+import hashlib
+
+MAGIC = b"CLMS"
+VERSION = 1
+HEADER = struct.Struct("!4sBBB32s")     # magic, version, py major/minor, digest
+MISSING = -1
+
+
+def path_for(json_path):
+    """ the snapshot of ``json_path`` """
+    return os.path.splitext(json_path)[0] + ".snap"
+
+
+def digest(data):
+    return hashlib.sha256(data).digest()
+
+
+def encode(tagdb, fields, categories):
+    """columnar layout of ``tagdb``.
+
+    Strings are replaced by their index in the string table, lists are
+    encoded item by item and any other value (numbers, ``None``) is
+    wrapped in a 1-tuple. Fields outside ``fields`` go, per record, into
+    an ``extra`` column as they are.
+    """
+    strings = {}
+
+    def enc(val):
+        if isinstance(val, str):
+            return strings.setdefault(val, len(strings))
+        if isinstance(val, list):
+            return [enc(item) for item in val]
+        return (val,)
+
+    payload = {"rest": {key: val for key, val in tagdb.items()
+                        if key not in categories and key != "sets"}}
+    for category in categories:
+        records = tagdb[category]
+        payload[category] = {
+            "keys": [enc(key) for key in records],
+            "columns": {
+                field: [enc(rec[field]) if field in rec else MISSING
+                        for rec in records.values()]
+                for field in fields},
+            "extra": [{key: val for key, val in rec.items()
+                       if key not in fields} or None
+                      for rec in records.values()]}
+
+    table = [None] * len(strings)
+    for string, index in strings.items():
+        table[index] = string
+    payload["strings"] = table
+    return payload
+
+
+def decode(payload, record_type, categories):
+    """ inverse of ``encode``, building ``record_type`` records directly,
+    with every string interned """
+    table = [sys.intern(string) for string in payload["strings"]]
+
+    def dec(val):
+        if val.__class__ is int:
+            return table[val]
+        if val.__class__ is list:
+            return [dec(item) for item in val]
+        return val[0]
+
+    tagdb = dict(payload["rest"])
+    new = record_type.__new__
+    for category in categories:
+        layout = payload[category]
+        records = [new(record_type) for _ in layout["keys"]]
+        for record, extra in zip(records, layout["extra"]):
+            record.extra = extra
+        for field, column in layout["columns"].items():
+            for record, val in zip(records, column):
+                if val.__class__ is int:
+                    if val != MISSING:
+                        setattr(record, field, table[val])
+                else:
+                    setattr(record, field, dec(val))
+        tagdb[category] = dict(zip(
+            (table[key] for key in layout["keys"]), records))
+
+    return tagdb
+
+
+def saved_digest(json_path):
+    """ the digest of the ``json`` content the snapshot of ``json_path``
+    was made from, whatever the Python version that made it, or ``None``
+    """
+    try:
+        with open(path_for(json_path), "rb") as fptr:
+            magic, _, _, _, json_digest = HEADER.unpack(
+                fptr.read(HEADER.size))
+    except (OSError, struct.error):
+        return None
+    return json_digest if magic == MAGIC else None
+
+
+def load(json_path, json_digest, record_type, categories):
+    """ the database held by the snapshot of ``json_path``, or ``None``
+    when there is no valid snapshot for content ``json_digest`` """
+    snap_path = path_for(json_path)
+    try:
+        with open(snap_path, "rb") as fptr:
+            header = HEADER.unpack(fptr.read(HEADER.size))
+            if header != (MAGIC, VERSION) + sys.version_info[:2] + \
+                    (json_digest,):
+                return None
+            data = fptr.read()
+    except (OSError, struct.error):
+        return None
+
+    # many small containers are made at once, no cycles among them
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return decode(marshal.loads(data), record_type, categories)
+    except (ValueError, EOFError, TypeError, KeyError, IndexError):
+        return None
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def save(json_path, json_digest, tagdb, fields, categories):
+    """ write the snapshot of ``tagdb``, loaded from content
+    ``json_digest`` """
+    snap_path = path_for(json_path)
+    tmp = snap_path + ".tmp"
+    with open(tmp, "wb") as fptr:
+        fptr.write(HEADER.pack(
+            MAGIC, VERSION, sys.version_info[0], sys.version_info[1],
+            json_digest))
+        marshal.dump(encode(tagdb, fields, categories), fptr)
+    os.replace(tmp, snap_path)
@@ -0,0 +1,158 @@
+"""
+materialized library statistics: artist and composer frequency counts,
+instrument groupings and per-album summaries.
+
+Rather than walking the whole library to count, each file's contribution
+to the aggregates is stored alongside them, so a file whose tags change is
+applied as a diff: its old contribution is subtracted and the new one
+added. Files are observed as any library walk passes over them, and
+``util.commit_to_libfile`` reports every write, so the aggregates stay
+current as a side effect of normal use. ``clamm library stats`` reads
+them without touching the library.
+"""
+
+import os
+import json
+from collections import Counter
+
+from clamm import config
+from clamm import util
+
+
+def contribution(ftags):
+    """ the part of a file's tags that the aggregates are made of """
+    return {
+        "artists": sorted(util.artist_tagset(ftags)),
+        "composers": sorted(set(ftags.get("COMPOSER", []))),
+        "grouping": ", ".join(ftags.get("ARRANGEMENT", [])),
+        "album": ", ".join(ftags.get("ALBUM", [])),
+        "albumartist": ", ".join(ftags.get("ALBUMARTIST", []))}
+
+
+class LibraryStats():
+    """ Library aggregates, maintained incrementally.
+
+    Attributes
+    ----------
+    files: dict
+        contribution of each file, keyed by path
+    artist: collections.Counter
+        tracks per artist name, as found in the ARTIST-like tags
+    composer: collections.Counter
+        tracks per COMPOSER
+    grouping: collections.Counter
+        tracks per instrumental ARRANGEMENT
+    album: dict
+        per album folder, ALBUM/ALBUMARTIST, track count and composer
+        counts
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config["path"]["stats"]
+        self.files = {}
+        self.artist = Counter()
+        self.composer = Counter()
+        self.grouping = Counter()
+        self.album = {}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path=None):
+        """ stats from disk, empty if there are none yet """
+        stats = cls(path)
+        try:
+            with open(stats.path) as fptr:
+                files = json.load(fptr)["files"]
+        except (IOError, ValueError, KeyError):
+            files = {}
+        for fpath, contrib in files.items():
+            stats.add(fpath, contrib)
+        stats.dirty = False
+        return stats
+
+    def save(self):
+        """ write the per-file contributions; aggregates are rebuilt from
+        them on load """
+        if not self.dirty:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as fptr:
+            json.dump({"files": self.files}, fptr, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    def add(self, path, contrib):
+        self.files[path] = contrib
+        self.artist.update(contrib["artists"])
+        self.composer.update(contrib["composers"])
+        if contrib["grouping"]:
+            self.grouping[contrib["grouping"]] += 1
+
+        folder = os.path.dirname(path)
+        summary = self.album.setdefault(folder, {
+            "album": contrib["album"], "albumartist": contrib["albumartist"],
+            "n_track": 0, "composers": Counter()})
+        summary["n_track"] += 1
+        summary["composers"].update(contrib["composers"])
+        self.dirty = True
+
+    def remove(self, path):
+        """ subtract the contribution of ``path``, if it has one """
+        contrib = self.files.pop(str(path), None)
+        if contrib is None:
+            return
+        self.artist.subtract(contrib["artists"])
+        self.composer.subtract(contrib["composers"])
+        if contrib["grouping"]:
+            self.grouping[contrib["grouping"]] -= 1
+
+        folder = os.path.dirname(path)
+        summary = self.album[folder]
+        summary["n_track"] -= 1
+        summary["composers"].subtract(contrib["composers"])
+        if summary["n_track"] == 0:
+            del self.album[folder]
+
+        # drop names that no longer occur
+        for counter in (self.artist, self.composer, self.grouping,
+                        summary["composers"]):
+            for key in [k for k, v in counter.items() if v <= 0]:
+                del counter[key]
+        self.dirty = True
+
+    def observe(self, path, ftags):
+        """ bring ``path`` up to date with ``ftags``, a no-op when its
+        contribution is unchanged """
+        path = str(path)    # pytaglib may hand out a pathlib.Path
+        contrib = contribution(ftags)
+        if self.files.get(path) == contrib:
+            return
+        self.remove(path)
+        self.add(path, contrib)
+
+    def on_commit(self, tagfile):
+        """ ``util.commit_hooks`` callback """
+        self.observe(tagfile.path, tagfile.tags)
+
+    def prune(self):
+        """ forget files that no longer exist """
+        for path in [p for p in self.files if not os.path.exists(p)]:
+            self.remove(path)
+
+    def artist_count(self, names):
+        """ tracks credited to any of ``names``, e.g. the permutations of
+        a database artist """
+        return sum(self.artist[name] for name in set(names))
+
+    def show(self, n_top=20):
+        """ print the top of each aggregate """
+        def top(title, counter):
+            util.printr("{} ({} distinct)".format(title, len(counter)))
+            for key, count in counter.most_common(n_top):
+                print("\t{:6d}  {}".format(count, key))
+
+        top("artists", self.artist)
+        top("composers", self.composer)
+        top("instrument groupings", self.grouping)
+        util.printr("{} tracks in {} albums".format(
+            len(self.files), len(self.album)))
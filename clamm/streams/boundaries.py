@@ -0,0 +1,145 @@
+"""track boundary detection from spectral novelty, constrained by the
+expected track durations.
+
+The envelope detector of ``to_tracks.Album`` looks for broadband
+activity over a fixed threshold, track by track, which misplaces
+boundaries between movements played attacca and at quiet passages. Here
+every point of the stream gets a boundary score, from the mel spectrogram
+(``spectral.Spectrogram``), on a grid of ``grid_sec``:
+
+- spectral flux, the half-wave rectified rise of the level of each band
+  from one frame to the next, summed over bands: high where something new
+  starts, including the next movement of an attacca
+- quietness, how close the level is to the quietest of the stream: high in
+  the gaps between tracks
+
+Boundaries are then placed all at once, by dynamic programming: each
+track must last its expected (iTunes) duration within a tolerance, a
+deviation from it costs ``duration_weight`` times its square relative to
+the tolerance, and the path of boundaries with the best total score wins.
+"""
+
+import numpy as np
+
+from clamm import config
+
+CHUNK_FRAMES = 1 << 14
+
+
+class BoundaryError(Exception):
+    """ BoundaryError """
+
+    def __init__(self, expression, message):
+        self.expression = expression
+        self.message = message
+
+
+def features(spec, grid_sec):
+    """spectral flux and level (dB) of ``spec`` per cell of ``grid_sec``,
+    and the number of STFT frames per cell. Frames are read in chunks, so
+    the level of the whole spectrogram is never held at once.
+    """
+    per_cell = max(1, int(round(grid_sec * spec.frame_rate)))
+    n_cell = spec.mel.shape[0] // per_cell
+    n_frame = n_cell * per_cell
+    flux = np.zeros(n_frame)
+    energy = spec.mel[:n_frame].sum(axis=1, dtype=np.float64)
+
+    chunk = CHUNK_FRAMES // per_cell * per_cell or per_cell
+    for start in range(0, n_frame, chunk):
+        stop = min(start + chunk, n_frame)
+        level = spec.level(max(start - 1, 0), stop)
+        rise = np.maximum(np.diff(level, axis=0), 0).sum(axis=1)
+        flux[start + (start == 0):stop] = rise
+
+    flux = flux.reshape(n_cell, per_cell).sum(axis=1)
+    level = 10 * np.log10(
+        energy.reshape(n_cell, per_cell).mean(axis=1) + 1e-10)
+    return flux, level, per_cell
+
+
+def boundary_score(flux, level, ncfg):
+    """ per cell, weighted sum of normalized flux and quietness """
+    flux = np.clip(flux / max(np.percentile(flux, 99), 1e-12), 0, 1)
+    floor, top = np.percentile(level, [5, 95])
+    quiet = 1 - np.clip((level - floor) / max(top - floor, 1e-12), 0, 1)
+    return ncfg["flux_weight"] * flux + ncfg["quiet_weight"] * quiet
+
+
+def best_path(score, first, durations, tolerances, weight):
+    """the cells of the boundaries that maximise the total ``score``,
+    minus the duration penalties, given the first boundary at ``first``.
+
+    Parameters
+    ----------
+    durations, tolerances: list
+        expected length of each track and how far off it may be, in cells
+
+    Returns
+    -------
+    path: list
+        ``len(durations) + 1`` cells, ``first`` and the end of each track
+    """
+    n_cell = len(score)
+    lo_prev, cost_prev = first, np.zeros(1)
+    choices = []
+    for i, (duration, tol) in enumerate(zip(durations, tolerances)):
+        hi_prev = lo_prev + len(cost_prev) - 1
+        deltas = range(max(duration - tol, 1), duration + tol + 1)
+        lo = lo_prev + deltas[0]
+        hi = min(hi_prev + deltas[-1], n_cell - 1)
+        if hi < lo:
+            raise BoundaryError(
+                "best_path", "track {} cannot fit in the stream".format(i))
+
+        cost = np.full(hi - lo + 1, np.inf)
+        prev = np.zeros(hi - lo + 1, dtype=int)
+        for delta in deltas:
+            start, stop = lo_prev + delta, min(hi_prev + delta, hi)
+            if start > stop:
+                continue
+            candidate = cost_prev[start - delta - lo_prev:
+                                  stop - delta - lo_prev + 1] + \
+                weight * ((delta - duration) / tol) ** 2
+            cells = slice(start - lo, stop - lo + 1)
+            better = candidate < cost[cells]
+            cost[cells] = np.where(better, candidate, cost[cells])
+            prev[cells] = np.where(
+                better, np.arange(start, stop + 1) - delta, prev[cells])
+
+        cost -= score[lo:hi + 1]
+        choices.append((lo, prev))
+        lo_prev, cost_prev = lo, cost
+
+    path = [lo_prev + int(np.argmin(cost_prev))]
+    for lo, prev in reversed(choices):
+        path.append(int(prev[path[-1] - lo]))
+    return path[::-1]
+
+
+def locate(spec, durations, start):
+    """sample positions of the boundaries of tracks of expected
+    ``durations`` (seconds), the first starting at sample ``start``.
+    Configured by ``config["streams"]["novelty"]``.
+
+    Returns
+    -------
+    bounds: list
+        ``len(durations) + 1`` sample positions, ``start`` first
+    """
+    ncfg = config["streams"]["novelty"]
+    flux, level, per_cell = features(spec, ncfg["grid_sec"])
+    score = boundary_score(flux, level, ncfg)
+
+    cell_samples = per_cell * spec.hop
+    cell_sec = cell_samples / spec.rate
+    first = int(round(start / cell_samples))
+    cells = [max(1, int(round(d / cell_sec))) for d in durations]
+    tolerances = [
+        max(1, int(round(max(ncfg["tolerance_sec"],
+                             ncfg["tolerance_frac"] * d) / cell_sec)))
+        for d in durations]
+
+    path = best_path(score, first, cells, tolerances,
+                     ncfg["duration_weight"])
+    return [start] + [cell * cell_samples for cell in path[1:]]
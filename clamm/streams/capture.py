@@ -0,0 +1,264 @@
+"""real-time capture of a raw pcm stream, as delivered by ``shairport-sync``
+on its stdout.
+
+The stream is read in fixed-size blocks of ``to_tracks.DF`` frames. Each
+block is reduced to the same energy value that makes up the envelope in
+``to_tracks``, which is used to decide, in real time, when the album has
+started and when it has finished. Blocks are written to a sink as they
+arrive, so the album is already compressed when the stream ends, and the
+envelope is saved alongside for ``Album.process`` to pick up.
+"""
+
+import os
+import select
+import subprocess
+from collections import deque
+
+import numpy as np
+
+from clamm import config
+from clamm import util
+from clamm.streams import to_tracks
+
+FRAME_BYTES = 4     # s16le, 2 channels
+BLOCK_FRAMES = int(to_tracks.DF)
+
+
+class ActivityMonitor():
+    """ Decide stream start/finish from a sequence of block energies.
+
+    Attributes
+    ----------
+    state: str
+        one of {waiting, active, finished}
+
+    threshold: float
+        energy above which a block counts as activity, same units as
+        ``to_tracks.wave_envelope``.
+
+    persistence: int
+        number of consecutive active blocks required to declare a start.
+
+    n_silent_stop: int
+        number of consecutive silent blocks that end an active stream.
+    """
+
+    def __init__(self, capcfg):
+        self.state = "waiting"
+        self.threshold = capcfg["threshold"]
+        self.persistence = capcfg["persistence"]
+        self.n_silent_stop = int(
+            capcfg["silence_sec"] * to_tracks.FS / BLOCK_FRAMES)
+        self.n_active = 0
+        self.n_silent = 0
+
+    def update(self, energy):
+        """ advance the state machine by one block, returns the new state
+        """
+        is_active = energy > self.threshold
+
+        if self.state == "waiting":
+            self.n_active = self.n_active + 1 if is_active else 0
+            if self.n_active >= self.persistence:
+                self.state = "active"
+
+        elif self.state == "active":
+            self.n_silent = 0 if is_active else self.n_silent + 1
+            if self.n_silent >= self.n_silent_stop:
+                self.state = "finished"
+
+        return self.state
+
+
+class PcmSink():
+    """ write raw s16le frames to a file """
+
+    ext = ".pcm"
+
+    def __init__(self, path):
+        self.path = path
+        self.fptr = open(path, "wb")
+
+    def write(self, data):
+        self.fptr.write(data)
+
+    def close(self):
+        self.fptr.close()
+
+
+class FlacSink():
+    """ compress raw s16le frames to flac on the fly by piping them
+    through a single ``ffmpeg`` encoder process.
+    """
+
+    ext = ".flac"
+
+    def __init__(self, path):
+        self.path = path
+        self.proc = subprocess.Popen(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+             "-f", "s16le", "-ar", "44.1k", "-ac", "2", "-i", "pipe:0",
+             "-f", "flac", path], stdin=subprocess.PIPE)
+
+    def write(self, data):
+        self.proc.stdin.write(data)
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+
+SINKS = {"pcm": PcmSink, "flac": FlacSink}
+
+
+class Capture():
+    """ Capture a live pcm stream into a sink, block by block.
+
+    Parameters
+    ----------
+    source: file
+        readable pipe carrying s16le stereo frames, e.g. the stdout of
+        ``shairport-sync``.
+
+    sink: PcmSink or FlacSink
+        destination of the captured frames.
+
+    consumers: list, optional
+        objects fed each block alongside ``sink``, via
+        ``consumer.feed(block, energy)``, and closed at the end of the
+        stream, e.g. ``splitter.OnlineSplitter``.
+
+    Attributes
+    ----------
+    envelope: list
+        energy of each block written to ``sink``, i.e. the envelope of the
+        captured stream at ``to_tracks.DF`` resolution.
+    """
+
+    def __init__(self, source, sink, consumers=()):
+        capcfg = config["streams"]["capture"]
+        self.fd = source.fileno()
+        self.sink = sink
+        self.consumers = list(consumers)
+        self.n_block = BLOCK_FRAMES * FRAME_BYTES
+        self.monitor = ActivityMonitor(capcfg)
+        self.stall_sec = capcfg["stall_sec"]
+        self.start_sec = capcfg["start_sec"]
+        self.eof = False
+        self.envelope = []
+
+        # blocks leading up to the detected start are kept
+        n_preroll = int(
+            capcfg["preroll_sec"] * to_tracks.FS / BLOCK_FRAMES)
+        self.preroll = deque(maxlen=n_preroll + self.monitor.persistence)
+
+        # silent blocks are held back until activity resumes, so that the
+        # silence which ends the stream is never written
+        self.held = []
+
+    def read_block(self, timeout):
+        """ read one full block from the source, returns ``None`` if
+        nothing arrives within ``timeout`` seconds or the source is closed.
+        """
+        buf = bytearray()
+        while len(buf) < self.n_block:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if not ready:
+                break
+            chunk = os.read(self.fd, self.n_block - len(buf))
+            if not chunk:
+                self.eof = True
+                break
+            buf.extend(chunk)
+
+        return bytes(buf) if buf else None
+
+    def write(self, block, energy):
+        """ pass a block to the sink and consumers, extend the envelope """
+        self.sink.write(block)
+        self.envelope.append(energy)
+        for consumer in self.consumers:
+            consumer.feed(block, energy)
+
+    def run(self):
+        """ capture until the monitor declares the stream finished, or the
+        source stalls/closes after the stream has started.
+
+        Returns
+        -------
+        envelope: numpy.ndarray
+        """
+        n_waited = 0
+        while not self.eof:
+            block = self.read_block(self.stall_sec)
+            if block is None:
+                if self.monitor.state == "active":
+                    break
+                n_waited += self.stall_sec
+                if n_waited > self.start_sec:
+                    raise to_tracks.StreamError(
+                        "capture", "stream did not start within {} sec"
+                        .format(self.start_sec))
+                continue
+
+            energy = to_tracks.block_energy(block)
+            was = self.monitor.state
+            state = self.monitor.update(energy)
+
+            if state == "waiting":
+                self.preroll.append((block, energy))
+
+            elif state == "active" and was == "waiting":
+                self.preroll.append((block, energy))
+                util.printr("Stream successfully started, "
+                            "now capturing until finish...")
+                for item in self.preroll:
+                    self.write(*item)
+                self.preroll.clear()
+
+            elif state == "active":
+                if energy > self.monitor.threshold:
+                    for item in self.held:
+                        self.write(*item)
+                    self.held = []
+                    self.write(block, energy)
+                else:
+                    self.held.append((block, energy))
+
+            else:
+                break
+
+        self.sink.close()
+        for consumer in self.consumers:
+            consumer.close()
+        if self.monitor.state == "waiting":
+            raise to_tracks.StreamError(
+                "capture", "source closed before the stream started")
+
+        return np.array(self.envelope)
+
+
+def capture_stream(source, name, consumers=()):
+    """capture a stream from ``source`` into ``config["path"]["pcm"]``
+    with the envelope saved to ``config["path"]["envelopes"]``.
+
+    The capture is written under a ``.part`` name and only renamed once
+    finished, so a partial stream is never mistaken for a complete one.
+
+    Returns
+    -------
+    path: str
+        path to the captured stream
+    """
+    sink_type = SINKS[config["streams"]["capture"]["format"]]
+    path = os.path.join(config["path"]["pcm"], name + sink_type.ext)
+    partial = path + ".part"
+
+    envelope = Capture(source, sink_type(partial), consumers).run()
+    os.rename(partial, path)
+    np.save(to_tracks.envelope_path(name), envelope)
+
+    util.printr("captured {:.1f} minutes to {}".format(
+        len(envelope) * BLOCK_FRAMES / to_tracks.FS / 60, path))
+
+    return path
@@ -0,0 +1,253 @@
+"""multi-resolution audio envelopes, cached on disk.
+
+The envelope of a stream is the energy (variance of the channel mean, see
+``to_tracks.block_energy``) of consecutive blocks of frames. A
+``Pyramid`` holds it at several block sizes at once, e.g. 10 ms, 100 ms
+and 1 s, all computed in one pass over the stream: the finest level is
+reduced from the frames as first and second moments, and each coarser
+level is reduced from the moments of the one below it.
+
+Pyramids are saved in ``config["path"]["envelopes"]``, one ``.npy`` file
+per level in a folder named after a hash of the stream, so re-analysing a
+stream (e.g. re-running a failed split) loads, memory mapped, in
+milliseconds instead of reading the whole stream again.
+
+Block sizes must be a whole number of frames and each must divide the
+next, so the finest level that can be configured at 44.1 kHz is 10 ms.
+"""
+
+import os
+import shutil
+import hashlib
+
+import numpy as np
+from tqdm import tqdm
+
+from clamm import config
+from clamm.streams import pcm
+
+FRAME_BYTES = pcm.N_CHANNEL * pcm.SAMPWIDTH
+HASH_SPAN = 1 << 20
+CHUNK_SEC = 60
+
+
+class EnvelopeError(Exception):
+    """ EnvelopeError """
+
+    def __init__(self, expression, message):
+        self.expression = expression
+        self.message = message
+
+
+def levels_from_config():
+    """ configured block sizes, in frames, finest first """
+    levels = []
+    for msec in sorted(config["streams"]["envelope"]["levels_ms"]):
+        frames = msec * pcm.FS / 1000
+        if frames != int(frames) or (levels and int(frames) % levels[-1]):
+            raise EnvelopeError(
+                "levels_ms", "{} ms is not a whole number of frames, or a "
+                "multiple of the finer levels".format(msec))
+        levels.append(int(frames))
+    return tuple(levels)
+
+
+def stream_hash(path):
+    """identifies the content of the stream at ``path`` from its size and
+    its first, middle and last MiB, so it does not need to be read
+    through.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as fptr:
+        for offset in (0, size // 2, size - HASH_SPAN):
+            fptr.seek(max(offset, 0))
+            digest.update(fptr.read(HASH_SPAN))
+    return digest.hexdigest()
+
+
+def cache_path(path):
+    """ folder of the cached pyramid of the stream at ``path`` """
+    return os.path.join(config["path"]["envelopes"], stream_hash(path))
+
+
+class Pyramid():
+    """ Envelope of a stream at several block sizes.
+
+    Attributes
+    ----------
+    levels: tuple
+        block sizes, in frames, finest first
+
+    energy: dict
+        block size -> envelope at that block size
+    """
+
+    def __init__(self, energy):
+        self.energy = energy
+        self.levels = tuple(sorted(energy))
+
+    def __getitem__(self, frames):
+        return self.energy[frames]
+
+    @property
+    def coarse(self):
+        """ the coarsest level, which is the one to search and plot """
+        return self.energy[self.levels[-1]]
+
+    @classmethod
+    def compute(cls, reader, levels, chunk_sec=CHUNK_SEC):
+        """one pass over ``reader`` (``wave.Wave_read`` like), in chunks
+        of whole coarse blocks. Trailing frames short of a coarse block
+        are left out, as they are of every level.
+        """
+        coarse = levels[-1]
+        chunk = max(1, int(chunk_sec * pcm.FS) // coarse) * coarse
+        accumulator = Accumulator(levels, reader.getnframes())
+
+        with tqdm(total=accumulator.n_fine * levels[0], unit="frame",
+                  unit_scale=True, leave=False) as progress:
+            while not accumulator.full:
+                data = reader.readframes(chunk)
+                if not data:
+                    break
+                accumulator.update(data)
+                progress.update(len(data) // FRAME_BYTES)
+        return accumulator.pyramid()
+
+    def save(self, folder):
+        """ one ``<frames>.npy`` per level in ``folder``, which is replaced
+        as a whole """
+        tmp = folder + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for frames, energy in self.energy.items():
+            np.save(os.path.join(tmp, "{}.npy".format(frames)), energy)
+        shutil.rmtree(folder, ignore_errors=True)
+        os.replace(tmp, folder)
+
+    @classmethod
+    def load(cls, folder, levels):
+        """ the pyramid saved in ``folder``, memory mapped, or ``None``
+        when it is missing any of ``levels`` """
+        try:
+            return cls({
+                frames: np.load(
+                    os.path.join(folder, "{}.npy".format(frames)),
+                    mmap_mode="r")
+                for frames in levels})
+        except (OSError, ValueError):
+            return None
+
+    def onset(self, frame, threshold):
+        """refine the onset found in the coarse block starting at
+        ``frame``: descend the levels, each time keeping the first block
+        louder than ``threshold`` in a window of the block found at the
+        level above and the one before it. Returns a frame.
+        """
+        span = self.levels[-1]
+        for frames in reversed(self.levels[:-1]):
+            first = max(frame - span, 0) // frames
+            energy = self.energy[frames][first:(frame + span) // frames]
+            above = np.flatnonzero(energy > threshold)
+            if not above.size:
+                break
+            frame, span = (first + above[0]) * frames, frames
+        return frame
+
+    def quietest(self, frame):
+        """refine the quietest point found in the coarse block starting at
+        ``frame``: descend the levels, each time keeping the quietest block
+        within the block found at the level above and its neighbours.
+        Returns a frame.
+        """
+        span = self.levels[-1]
+        for frames in reversed(self.levels[:-1]):
+            first = max(frame - span, 0) // frames
+            energy = self.energy[frames][first:(frame + 2 * span) // frames]
+            if not energy.size:
+                break
+            frame, span = (first + int(np.argmin(energy))) * frames, frames
+        return frame
+
+
+class Accumulator():
+    """The moments of the finest level of a ``Pyramid``, fed the raw
+    frames of a stream of ``n_frame`` frames in order, as bytes, in chunks
+    of any size. This is how the envelope is computed along with another
+    pass over the stream, see ``pcm.write_wav``.
+    """
+
+    def __init__(self, levels, n_frame):
+        self.levels = levels
+        self.n_fine = n_frame // levels[-1] * levels[-1] // levels[0]
+        self.mean = np.zeros(self.n_fine)
+        self.meansq = np.zeros(self.n_fine)
+        self.pos = 0
+        self.rest = b""
+
+    @property
+    def full(self):
+        return self.pos >= self.n_fine
+
+    def update(self, data):
+        """ add the frames in ``data``, keeping back a trailing partial
+        block for the next call """
+        if self.rest:
+            data = self.rest + data
+        block_bytes = self.levels[0] * FRAME_BYTES
+        n_new = min(len(data) // block_bytes, self.n_fine - self.pos)
+        used = n_new * block_bytes
+        self.rest = data[used:] if self.pos + n_new < self.n_fine else b""
+
+        x_data = np.frombuffer(
+            data, dtype=np.int16, count=used // pcm.SAMPWIDTH).reshape(
+                -1, self.levels[0], pcm.N_CHANNEL).mean(axis=2)
+        self.mean[self.pos:self.pos + n_new] = x_data.mean(axis=1)
+        self.meansq[self.pos:self.pos + n_new] = \
+            np.square(x_data).mean(axis=1)
+        self.pos += n_new
+
+    def pyramid(self):
+        """ every level, reduced from the finest """
+        energy = {}
+        for frames in self.levels:
+            factor = frames // self.levels[0]
+            level_mean = self.mean.reshape(-1, factor).mean(axis=1)
+            level_meansq = self.meansq.reshape(-1, factor).mean(axis=1)
+            energy[frames] = np.maximum(
+                level_meansq - np.square(level_mean), 0)
+        return Pyramid(energy)
+
+
+def put(path, pyramid):
+    """ cache ``pyramid`` as that of the stream at ``path`` """
+    os.makedirs(config["path"]["envelopes"], exist_ok=True)
+    pyramid.save(cache_path(path))
+
+
+def get(path, reader=None):
+    """the pyramid of the stream at ``path``, from the cache when it is
+    there, otherwise computed from ``reader`` (or a reader opened on
+    ``path``) and cached.
+    """
+    levels = levels_from_config()
+    use_cache = config["streams"]["envelope"]["cache"]
+    if use_cache:
+        folder = cache_path(path)
+        pyramid = Pyramid.load(folder, levels)
+        if pyramid is not None:
+            return pyramid
+
+    if reader is None:
+        with pcm.open_stream(path) as reader:
+            pyramid = Pyramid.compute(reader, levels)
+    else:
+        pos = reader.tell()
+        reader.rewind()
+        pyramid = Pyramid.compute(reader, levels)
+        reader.setpos(pos)
+
+    if use_cache:
+        put(path, pyramid)
+    return pyramid
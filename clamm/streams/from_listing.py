@@ -9,9 +9,10 @@ import json
 
 from clamm import config
 from clamm import util
-
-
-TMPSTREAM = os.path.join(config["path"]["wav"], "temp.wav")
+from clamm.streams import capture
+from clamm.streams import metadata
+from clamm.streams import splitter
+from clamm.streams import to_tracks
 
 
 def dial_itunes(artist, album):
@@ -26,16 +27,28 @@ def dial_itunes(artist, album):
     subprocess.Popen(['osascript', osa_prog])
 
 
-def main(listing):
+def main(listing, prefetch=False):
     """a program for batch streaming a ``json`` listing of albums
     from iTunes to raw pcm files via ``shairport-sync``.
 
     iTunes is controlled using macos' built-in ``osascript`` tool and
     simple javascript request templates.
 
-    When the listings have finished streaming, the pcm files (streams)
-    can be processed by ``stream2tracks`` and converted from streams
-    to a collection of flac tracks.
+    Each stream is captured straight off the ``shairport-sync`` pipe by
+    ``capture.capture_stream``, which detects the start and end of the
+    album from the signal energy and writes the stream, along with its
+    envelope, as it plays.
+
+    When the listings have finished streaming, the streams can be
+    processed by ``stream2tracks`` and converted from streams
+    to a collection of flac tracks. With
+    ``config["streams"]["capture"]["split_online"]`` set, this happens
+    during the capture instead, by ``splitter.OnlineSplitter``. Tracks
+    split online skip ``Album.finalize``, so they are neither trimmed nor
+    placed by the novelty detector; the option is off by default.
+
+    With ``prefetch``, the album metadata of the whole listing is looked
+    up concurrently up front, see ``metadata.prefetch``.
     """
 
     util.printr("Begin streams.from_listing...")
@@ -44,34 +57,51 @@ def main(listing):
     with open(listing) as fptr:
         batch = json.load(fptr)
 
+    prefetched = None
+    if prefetch:
+        prefetched = metadata.prefetch(
+            [(val['artist'], val['album']) for val in batch.values()])
+
     # iterate over albums in the listing
     for key, val in batch.items():
 
-        util.start_shairport(TMPSTREAM)
+        shairport = util.start_shairport()
 
         artist, album = val['artist'], val['album']
-        wav = "{}; {}.wav".format(artist, album)
-        wav_path = os.path.join(config["path"]["wav"], wav)
+        name = "{}; {}".format(artist, album)
 
         util.printr("{} --> begin listing2streams stream of {}..."
-                    .format(time.ctime(), wav))
+                    .format(time.ctime(), name))
 
-        dial_itunes(artist, album)
+        consumers, finisher, marker = [], None, None
+        if config["streams"]["capture"]["split_online"]:
+            stream = to_tracks.Stream(
+                os.path.join(config["path"]["pcm"], name + ".pcm"))
+            stream.decode_path().itunes_query(prefetched).prepare_target()
+            online, finisher = splitter.album_splitter(stream)
+            consumers.append(online)
 
-        monitor = util.SimpleState(TMPSTREAM)
-        while not monitor.get_state("startd"):
-            time.sleep(1)
+            # keeps stream2tracks and the watch daemon off the stream
+            marker = to_tracks.split_marker_path(name)
+            open(marker, "w").close()
 
-        util.printr("Stream successfully started, "
-                    " now waiting for finish (one dot per minute)...")
+        dial_itunes(artist, album)
 
-        while not monitor.get_state("finishd"):
-            time.sleep(1)
+        try:
+            try:
+                capture.capture_stream(shairport.stdout, name, consumers)
+            finally:
+                shairport.terminate()
+            if finisher is not None:
+                finisher.wait()
+        except BaseException:
+            # not split after all, leave the stream to stream2tracks
+            if marker is not None:
+                os.remove(marker)
+            raise
 
         util.printr("Stream successfully finished.")
 
-        os.rename(TMPSTREAM, wav_path)
-
     util.printr("Batch successfully finished.")
 
 
@@ -0,0 +1,137 @@
+"""diagnostic images of stream envelopes.
+
+An envelope has one value per block, hours of audio are hundreds of
+thousands of values, far more than there are pixel columns to show them.
+Envelopes are therefore decimated to a min/max band per pixel column
+before anything is drawn, which looks the same as plotting every point
+since the extremes of each column are kept, and the image width is capped
+(``config["streams"]["images"]``). Track markers are drawn as a single
+``LineCollection``.
+
+Figures are made with the object-oriented API on an Agg canvas, not
+``pyplot``, and ``ImageWorker`` renders them in a separate process, so
+track splitting does not wait for its diagnostics. Only the decimated
+bands cross the process boundary.
+"""
+
+import multiprocessing as mp
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+
+from clamm import config
+from clamm import util
+
+
+def minmax(x_data, n_col):
+    """decimate ``x_data`` to ``n_col`` columns (or fewer, if it is
+    shorter), returns the first sample index, min and max of each column
+    """
+    x_data = np.asarray(x_data)
+    n_col = max(1, min(n_col, len(x_data)))
+    edges = np.linspace(0, len(x_data), n_col + 1).astype(int)[:-1]
+    return (edges, np.minimum.reduceat(x_data, edges),
+            np.maximum.reduceat(x_data, edges))
+
+
+class Image():
+    """ what to draw, already decimated, so it is cheap to pickle.
+
+    Attributes
+    ----------
+    bands: list
+        ``(index, low, high, color)`` min/max bands
+
+    markers: list
+        ``(positions, color, linestyle)`` vertical lines, in samples
+    """
+
+    def __init__(self, path, n_sample, ylim=None):
+        imcfg = config["streams"]["images"]
+        self.path = path
+        self.n_sample = n_sample
+        self.ylim = ylim
+        self.dpi = imcfg["dpi"]
+        self.width = int(np.clip(
+            n_sample, imcfg["min_width_px"], imcfg["max_width_px"]))
+        self.height = imcfg["height_px"]
+        self.bands = []
+        self.markers = []
+
+    def band(self, x_data, color):
+        """ add the min/max band of ``x_data``, one per pixel column """
+        index, low, high = minmax(x_data, self.width)
+        self.bands.append((index, low, high, color))
+        return self
+
+    def mark(self, positions, color, linestyle="--"):
+        """ add vertical lines at sample ``positions`` """
+        self.markers.append((np.asarray(positions, dtype=float), color,
+                             linestyle))
+        return self
+
+    def render(self):
+        """ draw and save to ``path`` """
+        fig = Figure(figsize=(self.width / self.dpi, self.height / self.dpi),
+                     dpi=self.dpi)
+        FigureCanvasAgg(fig)
+        axes = fig.add_axes([0.02, 0.08, 0.96, 0.88])
+        for index, low, high, color in self.bands:
+            axes.fill_between(index, low, high, color=color, linewidth=0.5,
+                              step="post")
+        for positions, color, linestyle in self.markers:
+            axes.add_collection(LineCollection(
+                [((pos, 0), (pos, 1)) for pos in positions],
+                colors=color, linestyles=linestyle, linewidths=0.6,
+                transform=axes.get_xaxis_transform()))
+        axes.set_xlim(0, self.n_sample)
+        if self.ylim is not None:
+            axes.set_ylim(*self.ylim)
+        fig.savefig(self.path)
+        return self.path
+
+
+def render(image):
+    """ pool worker """
+    return image.render()
+
+
+class ImageWorker():
+    """ a worker process rendering ``Image``s in the background, in the
+    order they are submitted """
+
+    def __init__(self):
+        self.pool = mp.Pool(1)
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, image):
+        util.printr("rendering {}".format(image.path))
+        self.results.append(self.pool.apply_async(render, (image,)))
+
+    def wait(self):
+        """ block until every submitted image is saved, returns paths """
+        done = [result.get() for result in self.results]
+        self.results = []
+        return done
+
+    def close(self):
+        self.wait()
+        self.pool.close()
+        self.pool.join()
+
+
+def show(image, worker=None):
+    """ render ``image`` with ``worker``, or right away without one """
+    if worker is None:
+        util.printr("saving to {}".format(image.path))
+        image.render()
+    else:
+        worker.submit(image)
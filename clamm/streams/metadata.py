@@ -0,0 +1,212 @@
+"""album metadata for streams, i.e. the iTunes album/track listing used to
+split and tag a stream.
+
+Metadata comes from a provider. ``ItunesProvider`` asks the iTunes search
+api via ``itunespy``, ``FixtureProvider`` answers from a local ``json``
+file, for tests and offline runs. Either is wrapped in a
+``CachedProvider`` so each artist search and collection lookup only goes
+to the provider once per ``config["streams"]["metadata"]["ttl_days"]``.
+Providers deal in the raw iTunes ``json`` records, which is what gets
+cached; ``AlbumRecord`` and ``TrackRecord`` give them the attribute
+access of their ``itunespy`` counterparts.
+"""
+
+import re
+import abc
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from nltk import distance
+
+from clamm import config
+from clamm import util
+
+SEC_PER_DAY = 60 * 60 * 24
+
+
+class MetadataProvider(abc.ABC):
+    """ Interface of a metadata provider.
+
+    Both methods return lists of raw iTunes ``json`` records (dicts).
+    """
+
+    @abc.abstractmethod
+    def search_album(self, artist):
+        """ album records matching an ``artist`` search term """
+
+    @abc.abstractmethod
+    def lookup(self, collection_id):
+        """ the album record of ``collection_id`` followed by its track
+        records """
+
+
+class ItunesProvider(MetadataProvider):
+    """ the iTunes search api, via ``itunespy`` """
+
+    def search_album(self, artist):
+        import itunespy
+        return [item.json for item in itunespy.search_album(artist)]
+
+    def lookup(self, collection_id):
+        import itunespy
+        return [item.json for item in
+                itunespy.lookup(id=collection_id, entity="song")]
+
+
+class FixtureProvider(MetadataProvider):
+    """ answers from a local ``json`` file of the form::
+
+        {"search": {"<artist>": [<album record>, ...]},
+         "lookup": {"<collection_id>": [<album record>, <track record>,
+                                        ...]}}
+    """
+
+    def __init__(self, path):
+        with open(path) as fptr:
+            self.fixture = json.load(fptr)
+
+    def search_album(self, artist):
+        return self.fixture["search"].get(artist, [])
+
+    def lookup(self, collection_id):
+        return self.fixture["lookup"].get(str(collection_id), [])
+
+
+class CachedProvider(MetadataProvider):
+    """ persistent response cache in front of another provider. The
+    cache is written by ``save``, not on every miss.
+
+    Parameters
+    ----------
+    provider: MetadataProvider
+    cache: util.JsonCache
+    """
+
+    def __init__(self, provider, cache):
+        self.provider = provider
+        self.cache = cache
+
+    def cached(self, key, func, arg):
+        """ cached response for ``key``, filled by ``func(arg)`` on a
+        miss. Empty responses are not cached. """
+        records = self.cache.get(key)
+        if records is None:
+            records = func(arg)
+            if records:
+                self.cache.set(key, records)
+        return records
+
+    def search_album(self, artist):
+        return self.cached(
+            "search:{}".format(artist), self.provider.search_album, artist)
+
+    def lookup(self, collection_id):
+        return self.cached(
+            "lookup:{}".format(collection_id), self.provider.lookup,
+            collection_id)
+
+    def save(self):
+        self.cache.save()
+
+
+class Record():
+    """ attribute access to a raw iTunes record, ``collectionName`` is
+    available as ``collection_name`` etc.
+    """
+
+    def __init__(self, record):
+        self.json = record
+
+    def __getattr__(self, name):
+        key = re.sub(r"_([a-z])", lambda m: m.group(1).upper(), name)
+        try:
+            return self.__dict__["json"][key]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class TrackRecord(Record):
+    """ stands in for ``itunespy.track.Track`` """
+
+    @property
+    def track_time(self):
+        return self.json["trackTimeMillis"]
+
+
+class AlbumRecord(Record):
+    """ stands in for ``itunespy.music_album.MusicAlbum`` """
+
+    def __init__(self, record, tracks):
+        Record.__init__(self, record)
+        self.tracks = tracks
+
+    def get_tracks(self):
+        return self.tracks
+
+
+def get_provider():
+    """ the configured provider, behind the response cache """
+    mcfg = config["streams"]["metadata"]
+    if mcfg["provider"] == "fixture":
+        provider = FixtureProvider(mcfg["fixture"])
+    else:
+        provider = ItunesProvider()
+
+    cache = util.JsonCache(
+        config["path"]["metadata"], ttl=mcfg["ttl_days"] * SEC_PER_DAY)
+    return CachedProvider(provider, cache)
+
+
+def match_album(provider, artist, album, threshold):
+    """seek an iTunes ``collection_id`` by iterating over albums of a
+    search artist and finding the minimum ``nltk.distance.edit_distance``
+    to ``album``.
+
+    Returns
+    -------
+    query: AlbumRecord
+        or ``None`` if no album is within ``threshold``.
+    """
+    min_dist, min_query = 10000, None
+    for aquery in provider.search_album(artist):
+        dist = distance.edit_distance(aquery["collectionName"], album)
+        if dist < min_dist:
+            min_dist = dist
+            min_query = aquery
+
+    if min_query is None or min_dist >= threshold:
+        return None
+
+    records = provider.lookup(min_query["collectionId"])
+    albums = [r for r in records if r.get("wrapperType") == "collection"]
+    tracks = [TrackRecord(r) for r in records
+              if r.get("wrapperType") == "track"]
+    tracks.sort(key=lambda t: (t.json.get("discNumber", 1), t.track_number))
+
+    return AlbumRecord(albums[0] if albums else min_query, tracks)
+
+
+def prefetch(pairs, threshold=8):
+    """resolve the metadata of many ``(artist, album)`` pairs
+    concurrently, filling the response cache ahead of the streams. The
+    cache is saved once, when all are resolved.
+
+    Returns
+    -------
+    found: dict
+        ``AlbumRecord`` (or ``None``) keyed by ``(artist, album)``
+    """
+    provider = get_provider()
+    n_workers = config["streams"]["metadata"]["n_prefetch_workers"]
+
+    def fetch(pair):
+        return pair, match_album(provider, pair[0], pair[1], threshold)
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        found = dict(pool.map(fetch, pairs))
+    provider.save()
+
+    util.printr("prefetched metadata for {} of {} albums".format(
+        sum(1 for v in found.values() if v is not None), len(found)))
+
+    return found
@@ -0,0 +1,339 @@
+"""in-process access to raw pcm streams and flac encoding of their tracks.
+
+A raw s16le stereo stream only lacks a header to be a wav file, so rather
+than copying a multi-GB file through ``ffmpeg`` to prepend one,
+``PcmReader`` maps the stream into memory and serves frames with the
+``wave.Wave_read`` interface ``to_tracks.Album`` expects. The same reader
+maps the data chunk of a wav file, so either can be analysed directly,
+and ``scan`` feeds every frame to whatever wants to see them all (a
+checksum, the envelope) in one sequential read of the map. Where a wav
+file is wanted anyway, ``write_wav`` converts a stream in the same one
+read, in place if need be.
+
+Tracks are encoded to flac by ``encode_flac``, through the ``soundfile``
+binding to libsndfile when it is installed, else by piping the frames
+into ``ffmpeg``. ``EncoderPool`` keeps a pool of worker processes alive
+for the duration of an album; workers map the stream themselves, so only
+``(path, start, length)`` crosses the process boundary.
+
+Workers can also trim the dead air left around a track by the envelope
+based boundaries, see ``trim_bounds``: the boundaries are refined at
+sample resolution on the frames about to be encoded, so trimming needs no
+second read of the stream.
+"""
+
+import os
+import shutil
+import struct
+import subprocess
+import multiprocessing as mp
+
+import numpy as np
+from tqdm import tqdm
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+FS = 44100
+N_CHANNEL = 2
+SAMPWIDTH = 2
+WAV_HEADER_BYTES = 44
+
+# RIFF sizes are 32 bit, the data chunk of a wav file can be no larger
+MAX_WAV_DATA = 0xFFFFFFFF - (WAV_HEADER_BYTES - 8)
+
+
+class StreamError(Exception):
+    """ StreamError """
+
+    def __init__(self, expression, message):
+        self.expression = expression
+        self.message = message
+
+
+def wav_header(n_frame, nchannels=N_CHANNEL, sampwidth=SAMPWIDTH,
+               framerate=FS):
+    """ the canonical 44 byte RIFF/WAVE header for ``n_frame`` frames of
+    integer pcm, a ``StreamError`` if they do not fit in a wav file """
+    n_data = n_frame * nchannels * sampwidth
+    if n_data > MAX_WAV_DATA:
+        raise StreamError(
+            n_frame, "{} bytes of pcm exceed the 4 GiB limit of a wav "
+            "file, keep the stream raw or as flac".format(n_data))
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + n_data, b"WAVE", b"fmt ", 16, 1, nchannels,
+        framerate, framerate * nchannels * sampwidth, nchannels * sampwidth,
+        8 * sampwidth, b"data", n_data)
+
+
+def data_offset(path):
+    """ byte offset of the pcm data in ``path``, 0 for a raw stream """
+    with open(path, "rb") as fptr:
+        if fptr.read(4) != b"RIFF":
+            return 0
+        fptr.seek(12)
+        while True:
+            chunk = fptr.read(8)
+            if len(chunk) < 8:
+                raise ValueError("no data chunk in {}".format(path))
+            name, size = struct.unpack("<4sI", chunk)
+            if name == b"data":
+                return fptr.tell()
+            fptr.seek(size + size % 2, 1)
+
+
+class PcmReader():
+    """ ``wave.Wave_read`` look-alike over a memory map of a raw s16le
+    stereo stream or the data chunk of a wav file.
+
+    Attributes
+    ----------
+    frames: numpy.memmap
+        ``(n_frame, 2)`` int16 view of the whole stream, nothing is read
+        from disk until it is indexed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        offset = data_offset(path)
+        frames = np.memmap(path, dtype=np.int16, mode="r", offset=offset)
+        n_frame = frames.shape[0] // N_CHANNEL
+        self.frames = frames[:n_frame * N_CHANNEL].reshape(n_frame, N_CHANNEL)
+        self.pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def getnchannels(self):
+        return N_CHANNEL
+
+    def getsampwidth(self):
+        return SAMPWIDTH
+
+    def getframerate(self):
+        return FS
+
+    def getnframes(self):
+        return self.frames.shape[0]
+
+    def tell(self):
+        return self.pos
+
+    def setpos(self, pos):
+        self.pos = int(pos)
+
+    def rewind(self):
+        self.pos = 0
+
+    def readframes(self, n_frame):
+        """ the next ``n_frame`` frames as bytes, like ``wave`` """
+        block = self.frames[self.pos:self.pos + int(n_frame)]
+        self.pos += block.shape[0]
+        return block.tobytes()
+
+    def close(self):
+        self.frames = None
+
+
+def open_stream(path):
+    """ a reader for a raw ``.pcm`` stream or a ``.wav`` file """
+    return PcmReader(path)
+
+
+def scan(path, sinks, bufsize=1 << 22):
+    """hand every frame of the stream or wav file at ``path`` to each of
+    ``sinks``, as bytes, in order and ``bufsize`` at a time, in one
+    sequential read of its memory map """
+    with PcmReader(path) as reader:
+        frames = reader.frames
+        step = max(bufsize // (N_CHANNEL * SAMPWIDTH), 1)
+        for start in tqdm(range(0, frames.shape[0], step), leave=False):
+            buf = frames[start:start + step].tobytes()
+            for sink in sinks:
+                sink(buf)
+
+
+def read_chunks(fptr, n_data, bufsize, sinks=()):
+    """``(offset, chunk)`` of the first ``n_data`` bytes of ``fptr``, in
+    order and ``bufsize`` at a time, each also handed to every one of
+    ``sinks`` """
+    pos = 0
+    with tqdm(total=n_data, unit="B", unit_scale=True,
+              leave=False) as progress:
+        while pos < n_data:
+            fptr.seek(pos)
+            buf = fptr.read(min(bufsize, n_data - pos))
+            if not buf:
+                return
+            for sink in sinks:
+                sink(buf)
+            yield pos, buf
+            pos += len(buf)
+            progress.update(len(buf))
+
+
+def write_wav(pcm_path, wav_path, bufsize=1 << 22, sinks=(),
+              in_place=False):
+    """write the raw stream ``pcm_path`` out as the wav file ``wav_path``,
+    in-process, in one sequential read with a fixed buffer. Every chunk
+    read is handed to each of ``sinks`` too, e.g. a checksum.
+
+    ``in_place`` shifts the stream within its own file to prepend the
+    header and renames it ``wav_path``, so it is never on disk twice. An
+    interrupted in place conversion leaves a damaged stream behind.
+    """
+    frame_bytes = N_CHANNEL * SAMPWIDTH
+    n_data = os.path.getsize(pcm_path) // frame_bytes * frame_bytes
+    bufsize = max(bufsize // frame_bytes, 1) * frame_bytes
+    header = wav_header(n_data // frame_bytes)
+
+    if not in_place:
+        with open(pcm_path, "rb") as src, open(wav_path, "wb") as dst:
+            dst.write(header)
+            for _, buf in read_chunks(src, n_data, bufsize, sinks):
+                dst.write(buf)
+        return
+
+    # each chunk is written back where it was read, behind what is
+    # carried over from the one before; the header is carried first
+    with open(pcm_path, "r+b") as fptr:
+        carry, end = header, 0
+        for pos, buf in read_chunks(fptr, n_data, bufsize, sinks):
+            out = carry + buf
+            fptr.seek(pos)
+            fptr.write(out[:len(buf)])
+            carry, end = out[len(buf):], pos + len(buf)
+        fptr.seek(end)
+        fptr.write(carry)
+        fptr.truncate()
+    shutil.move(pcm_path, wav_path)
+
+
+def encode_flac(frames, flac_path, backend=None):
+    """encode ``(n, 2)`` int16 ``frames`` to ``flac_path``.
+
+    Parameters
+    ----------
+    backend: str, optional
+        ``soundfile`` or ``ffmpeg``, defaults to ``soundfile`` when it is
+        installed.
+    """
+    if backend is None:
+        backend = "ffmpeg" if soundfile is None else "soundfile"
+
+    if backend == "soundfile":
+        soundfile.write(
+            flac_path, frames, FS, format="FLAC", subtype="PCM_16")
+    else:
+        proc = subprocess.Popen(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+             "-f", "s16le", "-ar", "44.1k", "-ac", "2", "-i", "pipe:0",
+             flac_path], stdin=subprocess.PIPE)
+        proc.communicate(np.ascontiguousarray(frames).tobytes())
+
+
+def trim_bounds(frames, trim):
+    """``(first, stop)`` of ``frames`` without leading and trailing
+    silence.
+
+    Silence is any run of samples below ``trim["threshold_db"]`` (dBFS,
+    on either channel) that is longer than ``trim["min_gap_ms"]``, so a
+    track that runs straight into its neighbour, as movements often do,
+    keeps its boundary. ``lead_ms``/``tail_ms`` of the silence are kept
+    before the first and after the last sound.
+    """
+    n_frame = frames.shape[0]
+    level = int(32768 * 10 ** (trim["threshold_db"] / 20))
+    loud = np.flatnonzero(
+        np.abs(frames.astype(np.int32)).max(axis=1) > level)
+    if not loud.size:
+        return 0, n_frame
+
+    def ms2frames(key):
+        return int(trim[key] * FS / 1000)
+
+    first, stop = 0, n_frame
+    if loud[0] > ms2frames("min_gap_ms"):
+        first = max(loud[0] - ms2frames("lead_ms"), 0)
+    if n_frame - 1 - loud[-1] > ms2frames("min_gap_ms"):
+        stop = min(loud[-1] + 1 + ms2frames("tail_ms"), n_frame)
+    return first, stop
+
+
+def fade(frames, n_in, n_out):
+    """ ``frames`` with linear fades over the first ``n_in`` and last
+    ``n_out`` frames """
+    if not n_in and not n_out:
+        return frames
+    gain = np.ones(frames.shape[0])
+    n_in, n_out = min(n_in, len(gain)), min(n_out, len(gain))
+    if n_in:
+        gain[:n_in] = np.linspace(0, 1, n_in, endpoint=False)
+    if n_out:
+        gain[len(gain) - n_out:] *= np.linspace(1, 0, n_out, endpoint=False)
+    return np.round(frames * gain[:, None]).astype(np.int16)
+
+
+def trimmed(frames, trim):
+    """ ``frames`` trimmed by ``trim_bounds``, faded where cut """
+    first, stop = trim_bounds(frames, trim)
+    n_in = int(trim["fade_in_ms"] * FS / 1000) if first else 0
+    n_out = int(trim["fade_out_ms"] * FS / 1000) \
+        if stop < frames.shape[0] else 0
+    return fade(frames[first:stop], n_in, n_out)
+
+
+def encode_segment(job):
+    """ pool worker, ``job`` is ``(path, start_frame, n_frame, flac_path,
+    trim)``, see ``trimmed`` for ``trim``, which may be ``None`` """
+    path, start, n_frame, flac_path, trim = job
+    with PcmReader(path) as reader:
+        frames = reader.frames[start:start + n_frame]
+        if trim is not None:
+            frames = trimmed(frames, trim)
+        encode_flac(frames, flac_path)
+    return flac_path
+
+
+class EncoderPool():
+    """ long-lived worker processes encoding stream segments to flac.
+
+    Parameters
+    ----------
+    n_proc: int, optional
+        number of workers, default is the cpu count
+    """
+
+    def __init__(self, n_proc=None):
+        self.pool = mp.Pool(n_proc)
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, path, start, n_frame, flac_path, trim=None):
+        """ queue the encoding of a segment of the stream at ``path``,
+        trimmed as configured by ``trim``, if given """
+        self.results.append(self.pool.apply_async(encode_segment, (
+            (path, int(start), int(n_frame), flac_path, trim),)))
+
+    def wait(self):
+        """ block until every submitted segment is encoded, returns the
+        flac paths """
+        done = [result.get() for result in self.results]
+        self.results = []
+        return done
+
+    def close(self):
+        self.wait()
+        self.pool.close()
+        self.pool.join()
@@ -1,103 +1,96 @@
 """
 Convert a large audio wav file (album length, i.e. > 30 minutes typically)
-into a series of videos consisting of the audio synchronized with images of the
+into a video consisting of the audio synchronized with images of the
 spectrogram.
+
+The mel spectrogram is computed once, in parallel, by
+``spectral.analyse``; the frame renderers read their window of it from the
+same shared memory.
+
+    $ python -m clamm.streams.plot_big_stft album.wav /path/to/data
 """
 import os
 import sys
 import multiprocessing as mp
 import subprocess
 
-import tqdm
 import numpy as np
-import librosa.core
-import librosa.display
-import librosa.feature
-import matplotlib.pyplot as plt
-plt.switch_backend("agg")
-
-SAMPLERATE = 44.1e3     # samples/sec
-WAVPATH = sys.argv[1]
-BASENAME = os.path.basename(WAVPATH).replace(".wav", "")
-ROOT = "/mnt/nfs-share/music/data"
-FRAMEROOT = ROOT + "/frames/" + BASENAME
-DURATION = 20  #
-NUMPROC = 8
-FFTFREQ = librosa.fft_frequencies(sr=SAMPLERATE)
-F_MAX = np.max(FFTFREQ)
-N_FFT = 2048
-N_HOP = int(1.0 / 4 * N_FFT)
-FILETIME = librosa.core.get_duration(filename=WAVPATH)
-NFRAME = int(FILETIME) / DURATION  # allow truncation
-DUMPFILE = "data.npy"
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from clamm.streams import spectral
+
+DURATION = 20   # seconds of spectrogram per image
 FPS = 5
+NUMPROC = 8
+
+# per renderer process, see init_renderer
+RENDERER = {}
+
+
+def init_renderer(shm_name, shape, frame_rate, basename, frameroot):
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shm_name)
+    RENDERER.update(
+        shm=shm, frame_rate=frame_rate, basename=basename,
+        frameroot=frameroot,
+        mel=np.ndarray(shape, dtype=np.float32, buffer=shm.buf))
 
 
 def single_image(argtuple):
-    y, i_frame, i_second = argtuple
+    """ the image ``i_second`` of window ``i_frame``, a cursor over
+    ``DURATION`` seconds of spectrogram """
+    i_frame, i_second = argtuple
+    frame_rate = RENDERER["frame_rate"]
     fractional_second = float(i_second) / FPS
     abs_index = i_frame * DURATION * FPS + i_second
-    time = DURATION*i_frame + fractional_second
-    titlestr = "%s - file time %0.2f seconds" % (BASENAME, time)
+    time = DURATION * i_frame + fractional_second
+    titlestr = "%s - file time %0.2f seconds" % (RENDERER["basename"], time)
+
+    start = int(i_frame * DURATION * frame_rate)
+    stop = int((i_frame + 1) * DURATION * frame_rate)
+    level = 10 * np.log10(RENDERER["mel"][start:stop] + spectral.EPS)
+    level -= level.max()
 
     # display the spectrogram
-    plt.figure(figsize=(18, 8))
-    librosa.display.specshow(
-        y, x_axis='time', y_axis='mel', sr=SAMPLERATE, hop_length=N_HOP)
-
-    plt.vlines(
-        fractional_second, 0, F_MAX,
-        linestyles='dashed', colors='w', alpha=0.6)
-
-    plt.title(titlestr)
-    plt.savefig(FRAMEROOT + "/%05d.png" % (abs_index))
-    plt.tight_layout()
-    plt.close()
-
-
-def main():
-    """ main
-    """
-
-    pbar = tqdm.tqdm(total=NFRAME)
-    pool = mp.Pool(NUMPROC)
-    init = False
-    if not os.path.exists(FRAMEROOT):
-        os.makedirs(FRAMEROOT)
-
-    for i_frame in range(10, NFRAME):
-        # load the audio
-        x, sr = librosa.core.load(
-            WAVPATH, sr=SAMPLERATE,
-            offset=DURATION * i_frame, duration=DURATION)
-
-        # compute the spectrogram
-        x = librosa.power_to_db(
-            librosa.feature.melspectrogram(
-                y=x, hop_length=N_HOP, n_fft=N_FFT, sr=SAMPLERATE),
-            ref=np.max)
-
-        if not init:
-            f_mean = np.sum(x, axis=1)
-            init = True
-        else:
-            f_mean += np.sum(x, axis=1)
-
-        # loop updates
-        pbar.update(1)
-        pool.map(
-            single_image,
-            [(x, i_frame, i_second) for i_second in range(FPS*DURATION)])
-
-    np.save(BASENAME + 'f_mean.npy', f_mean)
-    pbar.close()
+    fig = Figure(figsize=(18, 8))
+    FigureCanvasAgg(fig)
+    axes = fig.add_subplot(111)
+    axes.imshow(level.T, origin="lower", aspect="auto", cmap="magma",
+                extent=(0, len(level) / frame_rate, 0, level.shape[1]))
+    axes.axvline(fractional_second, linestyle="dashed", color="w",
+                 alpha=0.6)
+    axes.set_xlabel("time (s)")
+    axes.set_ylabel("mel band")
+    axes.set_title(titlestr)
+    fig.tight_layout()
+    fig.savefig(RENDERER["frameroot"] + "/%05d.png" % (abs_index))
+
+
+def main(wavpath, root):
+    """ render the spectrogram video of ``wavpath`` under ``root`` """
+    basename = os.path.basename(wavpath).replace(".wav", "")
+    frameroot = os.path.join(root, "frames", basename)
+    if not os.path.exists(frameroot):
+        os.makedirs(frameroot)
+
+    with spectral.analyse(wavpath, n_proc=NUMPROC) as spec:
+        np.save(basename + 'f_mean.npy', spec.band_mean)
+        n_window = int(spec.mel.shape[0] / spec.frame_rate) // DURATION
+        jobs = [(i_frame, i_second) for i_frame in range(n_window)
+                for i_second in range(FPS * DURATION)]
+        with mp.Pool(NUMPROC, initializer=init_renderer, initargs=(
+                spec.shm.name, spec.mel.shape, spec.frame_rate, basename,
+                frameroot)) as pool:
+            pool.map(single_image, jobs)
 
     subprocess.call([
-        "ffmpeg", '-r', '5', '-i', FRAMEROOT + '%05d.png', '-i', WAVPATH,
+        "ffmpeg", '-r', '5', '-i', frameroot + '/%05d.png', '-i', wavpath,
         '-shortest', '-c:v', 'libx264', '-c:a', 'aac', '-strict', '-2',
         '-pix_fmt', 'yuv420p', '-crf', '23', '-r', '5', '-y',
-        ROOT + "/videos/" + BASENAME + '.mp4'])
+        os.path.join(root, "videos", basename + '.mp4')])
 
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else
+         "/mnt/nfs-share/music/data")
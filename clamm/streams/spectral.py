@@ -0,0 +1,196 @@
+"""mel spectrograms of long streams, computed in worker processes.
+
+A stream is cut into segments of whole STFT frames. Frame ``k`` covers
+samples ``[k * hop, k * hop + n_fft)``, so a segment of frames
+``[f0, f1)`` reads the samples ``[f0 * hop, (f1 - 1) * hop + n_fft)``: the
+segments overlap by ``n_fft - hop`` samples and every frame is computed
+exactly once, as a single pass over the stream would compute it.
+
+Workers map the stream themselves (``pcm.PcmReader``) and write their
+frames straight into one ``multiprocessing.shared_memory`` array, so only
+segment bounds cross the process boundary on the way in. On the way out
+each worker returns the per-band sums of its segment, which are reduced
+into band statistics as they arrive.
+
+The resulting ``Spectrogram`` is what both the spectrogram video
+(``plot_big_stft``) and the track splitter read, rather than each
+decoding the stream again.
+"""
+
+import os
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+from tqdm import tqdm
+
+from clamm import config
+from clamm.streams import pcm
+
+EPS = 1e-10
+
+
+def hz2mel(freq):
+    return 2595 * np.log10(1 + np.asarray(freq) / 700)
+
+
+def mel2hz(mel):
+    return 700 * (10 ** (np.asarray(mel) / 2595) - 1)
+
+
+def mel_filterbank(n_mels, n_fft, rate, fmin=0.0, fmax=None):
+    """ ``(n_mels, n_fft // 2 + 1)`` triangular, area normalized, filters
+    evenly spaced in mel """
+    fmax = rate / 2 if fmax is None else fmax
+    fft_freqs = np.linspace(0, rate / 2, n_fft // 2 + 1)
+    edges = mel2hz(np.linspace(hz2mel(fmin), hz2mel(fmax), n_mels + 2))
+    lower, center, upper = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    rising = (fft_freqs - lower) / (center - lower)
+    falling = (upper - fft_freqs) / (upper - center)
+    weights = np.maximum(0, np.minimum(rising, falling))
+    return weights * (2 / (upper - lower))
+
+
+def n_frames(n_sample, n_fft, hop):
+    """ number of whole STFT frames in ``n_sample`` samples """
+    return 0 if n_sample < n_fft else 1 + (n_sample - n_fft) // hop
+
+
+def segments(n_frame, per_segment):
+    """ ``(f0, f1)`` frame bounds of consecutive segments """
+    return [(f0, min(f0 + per_segment, n_frame))
+            for f0 in range(0, n_frame, per_segment)]
+
+
+def mel_frames(mono, n_fft, hop, filterbank):
+    """ mel power of every whole frame of the 1-d signal ``mono`` """
+    frames = np.lib.stride_tricks.sliding_window_view(mono, n_fft)[::hop]
+    power = np.square(np.abs(
+        np.fft.rfft(frames * np.hanning(n_fft), axis=1)))
+    return power @ filterbank.T
+
+
+# per worker process, see init_worker
+WORKER = {}
+
+
+def init_worker(path, shm_name, shape, n_fft, hop, filterbank):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    WORKER.update(
+        shm=shm, reader=pcm.PcmReader(path), n_fft=n_fft, hop=hop,
+        filterbank=filterbank,
+        mel=np.ndarray(shape, dtype=np.float32, buffer=shm.buf))
+
+
+def analyse_segment(bounds):
+    """ pool worker, fills frames ``[f0, f1)`` of the shared array,
+    returns the count, sums, sums of squares and maxima of their
+    per-band level in dB """
+    f0, f1 = bounds
+    hop, n_fft = WORKER["hop"], WORKER["n_fft"]
+    samples = WORKER["reader"].frames[f0 * hop:(f1 - 1) * hop + n_fft]
+    mono = samples.mean(axis=1) / 32768
+    mel = mel_frames(mono, n_fft, hop, WORKER["filterbank"])
+    WORKER["mel"][f0:f1] = mel
+    level = 10 * np.log10(mel + EPS)
+    return (f1 - f0, level.sum(axis=0), np.square(level).sum(axis=0),
+            level.max(axis=0))
+
+
+class Spectrogram():
+    """ Mel spectrogram held in shared memory.
+
+    Attributes
+    ----------
+    mel: numpy.ndarray
+        ``(n_frame, n_mels)`` float32 mel power, a view of the shared
+        memory, valid until ``close``
+
+    band_mean, band_std, band_max: numpy.ndarray
+        per band statistics of the level, in dB, over the whole stream
+
+    rate, hop: int
+        frame ``k`` starts at sample ``k * hop`` of a ``rate`` Hz stream
+    """
+
+    def __init__(self, shm, shape, rate, hop):
+        self.shm = shm
+        self.mel = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        self.rate = rate
+        self.hop = hop
+        self.band_mean = self.band_std = self.band_max = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def frame_rate(self):
+        return self.rate / self.hop
+
+    @property
+    def times(self):
+        """ start time, in seconds, of each frame """
+        return np.arange(self.mel.shape[0]) / self.frame_rate
+
+    def level(self, start=0, stop=None):
+        """ frames ``[start, stop)`` in dB """
+        return 10 * np.log10(self.mel[start:stop] + EPS)
+
+    def frame_energy(self):
+        """ total power per frame, summed over bands """
+        return self.mel.sum(axis=1)
+
+    def close(self):
+        """ release, and remove, the shared memory """
+        self.mel = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+def analyse(path, n_proc=None, n_fft=None, hop=None, n_mels=None,
+            segment_sec=None):
+    """the mel ``Spectrogram`` of the stream (raw pcm or wav) at ``path``,
+    computed by ``n_proc`` worker processes. Other parameters default to
+    ``config["streams"]["spectral"]``.
+    """
+    scfg = config["streams"]["spectral"]
+    n_fft = n_fft or scfg["n_fft"]
+    hop = hop or scfg["hop"]
+    n_mels = n_mels or scfg["n_mels"]
+    segment_sec = segment_sec or scfg["segment_sec"]
+
+    with pcm.PcmReader(path) as reader:
+        n_frame = n_frames(reader.getnframes(), n_fft, hop)
+    shape = (n_frame, n_mels)
+    shm = shared_memory.SharedMemory(
+        create=True, size=max(1, n_frame * n_mels * 4))
+    spec = Spectrogram(shm, shape, pcm.FS, hop)
+
+    filterbank = mel_filterbank(n_mels, n_fft, pcm.FS)
+    bounds = segments(n_frame, max(1, int(segment_sec * pcm.FS / hop)))
+    total = np.zeros(n_mels)
+    total_sq = np.zeros(n_mels)
+    band_max = np.full(n_mels, -np.inf)
+    try:
+        with mp.Pool(n_proc or os.cpu_count(), initializer=init_worker,
+                     initargs=(path, shm.name, shape, n_fft, hop,
+                               filterbank)) as pool:
+            for count, sums, sums_sq, maxima in tqdm(
+                    pool.imap_unordered(analyse_segment, bounds),
+                    total=len(bounds), leave=False):
+                total += sums
+                total_sq += sums_sq
+                np.maximum(band_max, maxima, out=band_max)
+    except BaseException:
+        spec.close()
+        raise
+
+    if n_frame:
+        spec.band_mean = total / n_frame
+        spec.band_std = np.sqrt(np.maximum(
+            total_sq / n_frame - np.square(spec.band_mean), 0))
+        spec.band_max = band_max
+    return spec
@@ -0,0 +1,205 @@
+"""online track splitting of a stream while it is being captured.
+
+``OnlineSplitter`` is a ``capture.Capture`` consumer. It applies the same
+start/stop rules as ``to_tracks.Album``, i.e. a persistent rise in energy
+marks the start of a track and the energy minimum around the end predicted
+by the iTunes track duration marks its stop, but does so on a rolling
+envelope. A track is written out and handed off for encoding and tagging
+as soon as the stream has played far enough past its predicted end to
+confirm the stop, while the rest of the album is still playing.
+"""
+
+import os
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from clamm import config
+from clamm import util
+from clamm.streams import to_tracks
+
+BLOCK_SEC = to_tracks.DF / to_tracks.FS
+
+
+class OnlineSplitter():
+    """ Split a live stream into tracks, one block at a time.
+
+    Parameters
+    ----------
+    tracks: list
+        ``to_tracks.Track`` objects with ``path`` set, in album order.
+
+    on_track: function, optional
+        called with each ``to_tracks.Track`` once its wav file is
+        complete.
+
+    Attributes
+    ----------
+    threshold: float
+        energy above which a block counts as activity, from
+        ``config["streams"]["capture"]``, as for ``capture.ActivityMonitor``
+
+    persistence: int
+        number of consecutive active blocks that start a track, likewise
+
+    pending: list
+        ``(index, block, energy)`` of blocks not yet assigned to a track,
+        either because no track has started yet or because they fall in
+        the window around the predicted end of the current track.
+    """
+
+    preactivity_offset = int(round(1 / BLOCK_SEC))
+    excursion = int(round(5 / BLOCK_SEC))
+
+    def __init__(self, tracks, on_track=None):
+        capcfg = config["streams"]["capture"]
+        self.threshold = capcfg["threshold"]
+        self.persistence = capcfg["persistence"]
+        self.tracks = tracks
+        self.on_track = on_track
+        self.current = 0
+        self.index = 0
+        self.pending = []
+        self.found_count = 0
+        self.floor = 0      # first block available to the current track
+        self.writer = None
+        self.reference = None
+
+    def feed(self, block, energy):
+        """ consume the next block of the stream """
+        if self.current >= len(self.tracks):
+            return
+
+        if self.writer is None:
+            self.pending.append((self.index, block, energy))
+            self.seek_start(self.index, energy)
+
+        elif self.current == len(self.tracks) - 1 or \
+                self.index < self.reference - self.excursion:
+            self.writer.writeframes(block)
+
+        else:
+            self.pending.append((self.index, block, energy))
+            if self.index >= self.reference + self.excursion:
+                self.stop_track()
+
+        self.index += 1
+
+    def seek_start(self, index, energy):
+        """find persistent activity ending at block ``index``, the start
+        of the current track is then backed off by ``preactivity_offset``
+        """
+        if energy > self.threshold:
+            self.found_count += 1
+        else:
+            self.found_count = 0
+
+        if self.found_count < self.persistence:
+            return
+
+        start = index - self.persistence + 1 - self.preactivity_offset
+        start = max(start, self.floor)
+        self.start_track(start)
+
+    def start_track(self, start):
+        """ open the current track and flush pending blocks into it """
+        track = self.tracks[self.current]
+        track.start_frame = start * to_tracks.DF
+        n_block = int(round(track.duration * to_tracks.MS2SEC / BLOCK_SEC))
+        self.reference = start + n_block
+
+        self.writer = wave.open(track.path, "wb")
+        self.writer.setnchannels(2)
+        self.writer.setsampwidth(2)
+        self.writer.setframerate(to_tracks.FS)
+
+        for index, block, _ in self.pending:
+            if index >= start:
+                self.writer.writeframes(block)
+        self.pending = []
+
+    def stop_track(self, stop=None):
+        """close the current track at the minimum energy point of the
+        pending window, or at ``stop`` if given, and carry the remainder
+        over to the next track.
+        """
+        if stop is None:
+            energy = [item[2] for item in self.pending]
+            stop = self.pending[int(np.argmin(energy))][0]
+
+        for index, block, _ in self.pending:
+            if index < stop:
+                self.writer.writeframes(block)
+        self.pending = [item for item in self.pending if item[0] >= stop]
+        self.writer.close()
+        self.writer = None
+
+        track = self.tracks[self.current]
+        track.end_frame = stop * to_tracks.DF
+        track.n_frame = track.end_frame - track.start_frame
+        util.printr("split {} at {:.1f} sec".format(
+            track.name, stop * BLOCK_SEC))
+
+        if self.on_track:
+            self.on_track(track)
+
+        self.current += 1
+        self.floor = stop
+        self.found_count = 0
+        for index, _, energy in list(self.pending):
+            if self.writer is not None or self.current >= len(self.tracks):
+                break
+            self.seek_start(index, energy)
+
+    def close(self):
+        """ end of stream, whatever is pending belongs to the open track """
+        if self.writer is not None:
+            self.stop_track(stop=self.index)
+
+
+class TrackFinisher():
+    """ Encode and tag split tracks in the background.
+
+    Parameters
+    ----------
+    query: itunespy.music_album.MusicAlbum
+        album query the tracks are tagged from
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.futures = []
+
+    def __call__(self, track):
+        self.futures.append(self.pool.submit(self.finish, track))
+
+    def finish(self, track):
+        """ wav --> flac, then tag """
+        util.wav2flac(track.path)
+        flacpath = track.path.replace(".wav", ".flac")
+        to_tracks.tag_track(flacpath, self.query, track.itrack)
+        if not config["library"]["keep_wavs_once_flacs_made"]:
+            os.remove(track.path)
+
+    def wait(self):
+        """ block until every submitted track is finished """
+        for future in self.futures:
+            future.result()
+        self.pool.shutdown()
+
+
+def album_splitter(stream):
+    """create an ``OnlineSplitter`` for a stream whose ``itunes_query``
+    and ``prepare_target`` have been run, together with the
+    ``TrackFinisher`` it hands tracks to.
+    """
+    tracks = []
+    for i, itrack in enumerate(stream.query.get_tracks()):
+        track = to_tracks.Track(itrack)
+        track.set_path(i, stream.target)
+        tracks.append(track)
+
+    finisher = TrackFinisher(stream.query)
+    return OnlineSplitter(tracks, on_track=finisher), finisher
@@ -4,37 +4,34 @@ and processing audio streams.
 """
 
 import os
-import wave
 from glob import glob
 import sys
+import hashlib
 
-import matplotlib.pyplot as plt
 from tqdm import trange
 import numpy as np
 import taglib
-from nltk import distance
-import itunespy
 
 from clamm import config
 from clamm import util
+from clamm.streams import boundaries
+from clamm.streams import envelope
+from clamm.streams import images
+from clamm.streams import metadata
+from clamm.streams import pcm
+from clamm.streams import spectral
 
 # constants, globals
-plt.switch_backend("agg")
 DF = config["streams"]["downsample_factor"]
 DF = 4410 * 10
 FS = 44100
-FS_DEC = FS / DF
+FS_DEC = FS // DF
 SAMP2MIN = 1 / FS / 60
 MS2SEC = 1 / 1000
 MS2MIN = MS2SEC / 60
 
 
-class StreamError(Exception):
-    """ StreamError """
-
-    def __init__(self, expression, message):
-        self.expression = expression
-        self.message = message
+StreamError = pcm.StreamError
 
 
 class Stream():
@@ -43,22 +40,62 @@ class Stream():
     def __init__(self, streampath):
         """ """
         self.pcmpath = streampath
-        self.wavpath = streampath.replace("pcm", "wav")
+        self.audiopath = streampath
+        self.wavpath = os.path.splitext(
+            streampath.replace("pcm", "wav"))[0] + ".wav"
         self.query = []
         self.artist = []
         self.album = []
         self.name = []
         self.threshold = 8
+        self.checksum = None
+
+    def scan(self):
+        """the md5 of the audio (saved next to it) and its envelope pyramid
+        (cached as by ``envelope.get``), in one sequential read. Streams
+        captured as flac are decoded to wav first.
+
+        A raw pcm stream is analysed where it is, through its memory map,
+        see ``pcm.scan``: ``Album`` reads it as is, so no wav is made. Only
+        when ``config["library"]["keep_pcms_once_wavs_made"]`` is false is
+        it converted to wav, in place, so the stream is never on disk
+        twice, see ``pcm.write_wav``.
+        """
+        if os.path.exists(self.wavpath):
+            self.audiopath = self.wavpath
+            return self
+
+        if self.pcmpath.endswith(".flac"):
+            util.flac2wav(self.pcmpath, self.wavpath)
+            self.audiopath = self.wavpath
+            return self
+
+        util.printr("scanning {}...".format(self.pcmpath))
+        accumulator = envelope.Accumulator(
+            envelope.levels_from_config(),
+            os.path.getsize(self.pcmpath) // envelope.FRAME_BYTES)
+        digest = hashlib.md5()
+        sinks = (digest.update, accumulator.update)
+        if config["library"]["keep_pcms_once_wavs_made"]:
+            pcm.scan(self.pcmpath, sinks)
+        else:
+            os.makedirs(os.path.dirname(self.wavpath), exist_ok=True)
+            pcm.write_wav(
+                self.pcmpath, self.wavpath, sinks=sinks, in_place=True)
+            self.audiopath = self.wavpath
+
+        self.checksum = digest.hexdigest()
+        with open(self.audiopath + ".md5", "w") as fptr:
+            fptr.write(self.checksum + "\n")
+        if config["streams"]["envelope"]["cache"]:
+            envelope.put(self.audiopath, accumulator.pyramid())
 
-    def pcm2wav(self):
-        """ pcm2wav """
-        if not os.path.exists(self.wavpath):
-            util.pcm2wav(self.pcmpath, self.wavpath)
+        return self
 
     def decode_path(self):
         """artist/album names from stream name
         """
-        tmp = self.pcmpath.replace(".pcm", "")
+        tmp = os.path.splitext(self.pcmpath)[0]
         [artist, album] = tmp.split(";")
         self.artist, self.album = os.path.split(artist)[-1], album.strip()
         util.printr("Found and Parsed {} --> {} as target...".format(
@@ -67,20 +104,22 @@ class Stream():
 
         return self
 
-    def itunes_query(self):
+    def itunes_query(self, prefetched=None):
         """seek an iTunes ``collection_id`` by iterating over albums
         of from a search artist and finding the minimum
-        ``nltk.distance.edit_distance``
+        ``nltk.distance.edit_distance``, see ``metadata.match_album``.
+        Responses come from the cached, configured metadata provider,
+        whose cache is saved once the album is matched, unless the album
+        is among the ``prefetched`` records of ``metadata.prefetch``.
         """
-        min_dist = 10000
-        for aquery in itunespy.search_album(self.artist):
-            dist = distance.edit_distance(aquery.collection_name, self.album)
-            if dist < min_dist:
-                min_dist = dist
-                min_query = aquery
-
-        if min_dist < self.threshold:
-            self.query = itunespy.lookup(id=min_query.collection_id)[0]
+        key = (self.artist, self.album)
+        if prefetched is not None and key in prefetched:
+            self.query = prefetched[key]
+        else:
+            provider = metadata.get_provider()
+            self.query = metadata.match_album(
+                provider, self.artist, self.album, self.threshold)
+            provider.save()
 
         if not self.query:
             sys.exit("ERROR: album search failed...")
@@ -114,18 +153,7 @@ class Stream():
         for i, track in enumerate(self.query.get_tracks()):
             tracknum = "%0.2d" % (i + 1)
             globber = glob(os.path.join(self.target, tracknum + "*flac"))
-            flac = taglib.File(globber[0])
-            flac.tags["ALBUM"] = [self.query.collection_name]
-            flac.tags["ALBUMARTIST"] = [self.query.artist_name]
-            flac.tags["ARTIST"] = [track.name]
-            flac.tags["TRACKNUMBER"] = [str(track.number)]
-            flac.tags["DATE"] = [self.query.release_date]
-            flac.tags["LABEL"] = [self.query.copyright]
-            flac.tags["GENRE"] = [self.query.primary_genre_name]
-            flac.tags["TITLE"] = [track.name]
-            flac.tags["COMPILATION"] = ["0"]
-            flac.save()
-            flac.close()
+            tag_track(globber[0], self.query, track)
 
 
 class Album():
@@ -133,8 +161,8 @@ class Album():
 
     Attributes
     ----------
-    wavstream: wave.Wave_read
-        Read access to wave file
+    wavstream: pcm.PcmReader
+        Read access to the raw stream or wave file
 
     framerate: int
         rate, in Hz, of channel samples
@@ -142,12 +170,31 @@ class Album():
     track_list: list
         list of itunespy.track.Track objects containing track tags
 
-    wavstream: wave.File
+    pyramid: envelope.Pyramid
+        finer levels of the envelope, to refine track boundaries found
+        in ``envelope``. ``None`` when only the envelope is known, e.g.
+        when it was saved during capture.
+
+    imager: images.ImageWorker
+        renders the diagnostic images in the background, they are
+        rendered in place without one.
+
+    bounds: list
+        with the ``"novelty"`` detector, the boundaries of all tracks,
+        relative to ``first_nz``, placed at once by ``plan_bounds``.
+        ``None`` with the ``"envelope"`` detector, which finds each track
+        in turn.
 
     """
 
-    def __init__(self, stream):
-        self.wavstream = wave.open(stream.wavpath)
+    pyramid = None
+    bounds = None
+
+    def __init__(self, stream, imager=None):
+        self.imager = imager
+        self.audiopath = stream.audiopath
+        self.wavstream = pcm.open_stream(self.audiopath)
+        self.first_nz = 0
 
         # itunes
         self.track_list = stream.query.get_tracks()
@@ -156,6 +203,7 @@ class Album():
         self.track = []
 
         # inherit from query
+        self.stream_name = stream.name
         self.target = stream.target
         self.name = stream.query.collection_name
         self.release_date = stream.query.release_date
@@ -177,8 +225,10 @@ class Album():
         found_count = 0
         preactivity_offset = 1 * FS_DEC
         firstindex = 0
+        floor = 0
         if self.current > 0:
-            firstindex = self.track[self.current - 1].end_frame / DF
+            floor = self.track[self.current - 1].end_frame
+            firstindex = floor // DF
 
         index = firstindex
         while found_count <= persistence:
@@ -194,17 +244,24 @@ class Album():
             activity = firstindex
         track.start_frame = activity * DF
 
+        if self.pyramid is not None:
+            offset = self.first_nz * DF
+            onset = self.pyramid.onset(
+                (index - persistence - 1) * DF + offset, threshold)
+            track.start_frame = max(
+                onset - offset - preactivity_offset * DF, floor)
+
     def cur_track_stop(self):
         """find the min energy point around a reference
         """
         track = self.track[self.current]
         n_samp_track = int(track.duration * MS2SEC * FS_DEC)
-        reference = track.start_frame / DF + n_samp_track
+        reference = track.start_frame // DF + n_samp_track
         # +- 5 seconds around projected end frame
         excursion = 5 * FS_DEC
         curpos = reference - excursion
         go_till = np.min(
-            [reference + excursion, self.wavstream.getnframes() / DF])
+            [reference + excursion, len(self.envelope)])
         local_min = 1e9
         local_idx = -1
 
@@ -215,11 +272,34 @@ class Album():
             curpos += 1
 
         track.end_frame = local_idx * DF
+        if self.pyramid is not None:
+            offset = self.first_nz * DF
+            track.end_frame = self.pyramid.quietest(
+                track.end_frame + offset) - offset
         track.n_frame = track.end_frame - track.start_frame
 
+    def plan_bounds(self):
+        """place the boundaries of all tracks at once, from the spectral
+        novelty of the stream, see ``boundaries.locate``. The first track
+        starts where the envelope detector finds activity.
+        """
+        self.cur_track_start()
+        offset = self.first_nz * DF
+        with spectral.analyse(self.audiopath) as spec:
+            bounds = boundaries.locate(
+                spec, [t.duration * MS2SEC for t in self.track],
+                self.track[0].start_frame + offset)
+        self.bounds = [bound - offset for bound in bounds]
+
     def locate_track(self):
         """ find track starts/stops within stream
         """
+        if self.bounds is not None:
+            track = self.track[self.current]
+            track.start_frame = self.bounds[self.current]
+            track.end_frame = self.bounds[self.current + 1]
+            track.n_frame = track.end_frame - track.start_frame
+            return self
 
         # find start of track (find activity)
         self.cur_track_start()
@@ -250,19 +330,16 @@ class Album():
 
         return self
 
-    def finalize(self):
-        """ finalize """
-        with wave.open(self.track.path, 'w') as wavtrack:
-            self.wavstream.setpos(self.track.start_frame)
-            y = np.fromstring(
-                self.wavstream.readframes(self.n_frame),
-                dtype=np.int16)
-            y = np.reshape(y, (int(y.shape[0] / 2), 2))
-            wavtrack.setnchannels(2)
-            wavtrack.setsampwidth(2)
-            wavtrack.setnframes(self.n_frame)
-            wavtrack.setframerate(self.wavstream.getframerate())
-            wavtrack.writeframes(y)
+    def finalize(self, encoder):
+        """ hand the current track to ``encoder`` for writing to flac,
+        trimmed of leading/trailing silence as configured, see
+        ``pcm.trim_bounds`` """
+        track = self.track[self.current]
+        trim = config["streams"]["trim"]
+        encoder.submit(
+            self.audiopath, track.start_frame + self.first_nz * DF,
+            track.n_frame, track.path.replace(".wav", ".flac"),
+            trim if trim["enabled"] else None)
 
     def process(self):
         """encapsulate the substance of Album processing
@@ -272,24 +349,38 @@ class Album():
             self.track.append(Track(self.track_list[i]))
             self.track[i].set_path(i, self.target)
 
-        # compute audio power envelope
-        self.envelope = wave_envelope(self.wavstream)
+        # audio power envelope, as captured along with the stream, else
+        # from its (cached) pyramid
+        envpath = envelope_path(self.stream_name)
+        if os.path.exists(envpath):
+            self.envelope = np.load(envpath)
+        else:
+            self.pyramid = envelope.get(self.audiopath, self.wavstream)
+            if self.pyramid.levels[-1] != DF:
+                raise StreamError(
+                    "process", "coarsest envelope level is not DF frames")
+            self.envelope = self.pyramid.coarse
 
         # truncate zeros in beginning
-        first_nz = np.nonzero(self.envelope)[0][0] - FS_DEC * 3
-        self.envelope = self.envelope[first_nz:-1]
+        self.first_nz = max(np.nonzero(self.envelope)[0][0] - FS_DEC * 3, 0)
+        self.envelope = self.envelope[self.first_nz:-1]
         self.imageit()
 
         # test envelope to expected
         n_sec_env = len(self.envelope) / FS_DEC
         n_sec_exp = sum([t.duration * MS2SEC for t in self.track])
         if abs(1 - n_sec_env / n_sec_exp) > .05:
-            raise StreamError("envelope does not match expected duration")
+            raise StreamError(
+                "process", "envelope does not match expected duration")
 
-        # iterate and process tracks
-        for i in range(self.n_track):
-            self.locate_track().status()
-            self.current += 1
+        if config["streams"]["detector"] == "novelty":
+            self.plan_bounds()
+
+        # iterate and process tracks, encoding each as soon as it's found
+        with pcm.EncoderPool() as encoder:
+            for i in range(self.n_track):
+                self.locate_track().status().finalize(encoder)
+                self.current += 1
 
         self.imageit()
 
@@ -298,28 +389,28 @@ class Album():
 
         return self
 
+    @property
+    def splits(self):
+        """ ``(start_frame, n_frame)`` of each track within the stream """
+        return [(track.start_frame + self.first_nz * DF, track.n_frame)
+                for track in self.track]
+
     def imageit(self):
-        """ imageit """
-        x_data = self.envelope < 20**2
+        """ image of the envelope, where it is silent and where tracks are
+        expected to end """
+        silent = (self.envelope < 20**2).astype(float)
         y = self.envelope / (np.max(self.envelope) * 0.008)
-        n = np.shape(x_data)[0]
-        n_min = int(n / FS_DEC / 60)
-
-        plt.figure(figsize=(3 * n_min, 4))
-        plt.plot(x_data, marker=".", linestyle='')
-        # plt.plot(y, marker=".", linestyle='', markersize=3)
-        plt.plot(y, marker=".", linestyle='')
-        plt.ylim(0, 1.1)
-
         marks = np.cumsum([t.duration * MS2SEC * FS_DEC for t in self.track])
-        [plt.axvline(x_data=mark, color="b", linestyle="--") for mark in marks]
 
-        saveit('image')
+        image = images.Image(image_path('image'), len(y), ylim=(0, 1.1))
+        image.band(silent, "C0").band(y, "C1").mark(marks, "b")
+        images.show(image, self.imager)
 
 
 class Track():
     def __init__(self, itrack):
         # copy from itunespy.Track
+        self.itrack = itrack
         self.duration = itrack.track_time
         self.name = itrack.track_name
         self.artist = itrack.artist_name
@@ -336,11 +427,43 @@ class Track():
             root, "%0.2d %s.wav" % (self.index + 1, self.name))
 
 
+def tag_track(path, query, itrack):
+    """populate the tags of a single track file from an iTunes album
+    ``query`` and its ``itrack``.
+    """
+    flac = taglib.File(path)
+    flac.tags["ALBUM"] = [query.collection_name]
+    flac.tags["ALBUMARTIST"] = [query.artist_name]
+    flac.tags["ARTIST"] = [itrack.artist_name]
+    flac.tags["TRACKNUMBER"] = [str(itrack.track_number)]
+    flac.tags["DATE"] = [query.release_date]
+    flac.tags["LABEL"] = [query.copyright]
+    flac.tags["GENRE"] = [query.primary_genre_name]
+    flac.tags["TITLE"] = [itrack.track_name]
+    flac.tags["COMPILATION"] = ["0"]
+    flac.save()
+    flac.close()
+
+
 def get_mean_stereo(wav, N):
     """grab samples from one channel (every other sample) of frame
     """
-    x_data = np.fromstring(wav.readframes(N), dtype=np.int16)
-    return np.mean(np.reshape(x_data, (2, -1)), axis=0)
+    return mean_stereo(wav.readframes(N))
+
+
+def mean_stereo(data):
+    """average the channels of a block of interleaved s16le stereo bytes
+    """
+    x_data = np.frombuffer(data, dtype=np.int16)
+    x_data = x_data[:x_data.shape[0] - x_data.shape[0] % 2]
+    return np.mean(np.reshape(x_data, (-1, 2)), axis=1)
+
+
+def block_energy(data):
+    """audio energy of a block of raw stereo frames, i.e. the variance of
+    the channel mean. This is the quantity the envelope is made of.
+    """
+    return np.var(mean_stereo(data))
 
 
 def wave_envelope(wavstream):
@@ -351,73 +474,88 @@ def wave_envelope(wavstream):
     n_window = int(np.floor(wavstream.getnframes() / DF)) - 1
     x_data = np.zeros(n_window)
     for i in trange(n_window):
-        x_data[i] = np.var(get_mean_stereo(wavstream, DF))
+        x_data[i] = block_energy(wavstream.readframes(DF))
 
     return x_data
 
 
-def saveit(name):
-    """ saveit """
-    savepath = os.path.join(config["path"]["envelopes"], name + ".png")
-    util.printr("saving to {}".format(savepath))
-    plt.savefig(savepath, bbox_inches='tight')
+def envelope_path(name):
+    """ location of the envelope saved for stream ``name`` """
+    return os.path.join(config["path"]["envelopes"], name + ".npy")
+
 
+def split_marker_path(name):
+    """ location of the mark left by a stream ``name`` that was split
+    into tracks while it was captured, see ``splitter`` """
+    return os.path.join(config["path"]["pcm"], name + ".split")
 
-def image_audio_envelope_with_tracks_markers(markers, stream):
-    """track-splitting validation image
+
+def is_split(streampath):
+    """ whether the stream at ``streampath`` was split while captured """
+    name = os.path.splitext(os.path.basename(streampath))[0]
+    return os.path.exists(split_marker_path(name))
+
+
+def image_path(name):
+    """ location of the image ``name`` """
+    return os.path.join(config["path"]["envelopes"], name + ".png")
+
+
+def image_audio_envelope_with_tracks_markers(markers, stream, imager=None):
+    """track-splitting validation image, ``markers`` are the
+    ``(start_frame, n_frame)`` of each track. The envelope is the coarse
+    level of the stream's cached pyramid.
     """
 
-    x_data = wave_envelope(stream.wavpath)
-
-    downsamp = config["streams"]["downsample_factor"]
-    efr = 44100 / downsamp
-    starts = [mark[0] / downsamp for mark in markers]
-    stops = [starts[i] + mark[1] / downsamp for i, mark in enumerate(markers)]
-    n = np.shape(x_data)[0]
-    n_min = int(n / efr / 60)
-
-    # create image (one inch per minute of audio)
-    plt.figure(figsize=(n_min, 10))
-    plt.plot(x_data, marker=".", linestyle='', markersize=0.2)
-    [plt.axvline(
-        x_data=start, color="b", linestyle="--",
-        linewidth=0.3) for start in starts]
-    [plt.axvline(
-        x_data=stop, color="r", linestyle="--",
-        linewidth=0.3) for stop in stops]
-    saveit(stream.name)
-
-
-def stream2tracks(streampath):
-    """process raw pcm stream to tagged album tracks.
+    x_data = envelope.get(stream.audiopath).coarse
+
+    starts = [mark[0] / DF for mark in markers]
+    stops = [starts[i] + mark[1] / DF for i, mark in enumerate(markers)]
+
+    image = images.Image(image_path(stream.name), len(x_data))
+    image.band(x_data, "C0").mark(starts, "b").mark(stops, "r")
+    images.show(image, imager)
+
+
+def stream2tracks(streampath, prefetched=None):
+    """process raw pcm stream to tagged album tracks. Its album metadata
+    is taken from ``prefetched`` when it is there, see
+    ``Stream.itunes_query``.
     """
     util.printr("Begin stream2tracks...")
 
     # initialize the stream
     stream = Stream(streampath)
-    stream.decode_path().itunes_query().prepare_target().pcm2wav()
+    stream.decode_path().itunes_query(prefetched).prepare_target().scan()
 
-    # process the stream into an album
-    album = Album(stream).process()
+    with images.ImageWorker() as imager:
+        # process the stream into an album
+        album = Album(stream, imager).process()
 
-    # finalize the stream into flac files with tags
-    stream.flacify().tagify()
+        # finalize the stream into flac files with tags
+        stream.flacify().tagify()
 
-    # create an image of the audio envelope indicating where track splits
-    # have been located
-    image_audio_envelope_with_tracks_markers(album.splits, stream)
+        # create an image of the audio envelope indicating where track
+        # splits have been located
+        image_audio_envelope_with_tracks_markers(album.splits, stream, imager)
 
     util.printr("Finish stream2tracks.")
 
 
 def main(args):
-    """ main
+    """ main, the album metadata of all the streams is looked up
+    concurrently up front, see ``metadata.prefetch``
     """
 
     # iterate over streams found in config["path"]["pcm"]
     streams = glob(os.path.join(config["path"]["pcm"], "*pcm"))
+    streams.extend(glob(os.path.join(config["path"]["pcm"], "*flac")))
+    streams = [path for path in streams if not is_split(path)]
+    prefetched = metadata.prefetch(
+        [(stream.artist, stream.album) for stream in
+         (Stream(path).decode_path() for path in streams)])
     for streampath in streams:
-        stream2tracks(streampath)
+        stream2tracks(streampath, prefetched)
 
 
 if __name__ == "__main__":
@@ -6,33 +6,43 @@ interface to the clamm's tag database.
 from __future__ import unicode_literals, print_function
 import os
 import re
+import sys
 import json
 import copy
-from collections import OrderedDict
+import glob
+import shutil
+import fnmatch
+from collections import OrderedDict, Counter
 from subprocess import call
-import codecs
 
 import ipdb
 from translate import Translator
 import prompt_toolkit as ptk
 from nltk import distance
 import taglib
-import wikipedia
-import nltk
 
 from clamm import config, installed_location
 from clamm import util
+from clamm import timing
+from clamm import snapshot
+from clamm import enrich
+from clamm import phrases
 
 class SafeTagFile(taglib.File):
     """ Allow for consistent file tagging.
 
     Subclasses ``taglib.File`` and creates a deep copy of a
-    ``taglib.File`` objects
+    ``taglib.File`` objects. Parsing and copying are timed as the
+    ``taglib`` and ``deepcopy`` phases of ``timer``, if attached.
     """
 
+    timer = None
+
     def __init__(self, filepath):
-        taglib.File.__init__(self, filepath)
-        self.tag_copy = copy.deepcopy(self.tags)
+        with timing.timed(self.timer, "taglib"):
+            taglib.File.__init__(self, filepath)
+        with timing.timed(self.timer, "deepcopy"):
+            self.tag_copy = copy.deepcopy(self.tags)
 
 
 class Suggestor():
@@ -42,6 +52,10 @@ class Suggestor():
     by populating history with a list of items from one of the tag
     database sets.
 
+    The history is only filled on the first prompt, from the set current
+    at that time, so a suggestor costs nothing until it is used. Get
+    them from ``TagDatabase.suggest``, which holds one per category.
+
     Parameters
     ----------
     tagdb: tags.TagDatabase
@@ -54,9 +68,20 @@ class Suggestor():
     """
 
     def __init__(self, tagdb, category="artist"):
-        self.history = ptk.history.InMemoryHistory()
-        for item in tagdb.sets[category]:
-            self.history.append(item)
+        self.tagdb = tagdb
+        self.category = category
+        self._history = None
+
+    @property
+    def history(self):
+        if self._history is None:
+            self._history = ptk.history.InMemoryHistory()
+            # prompt_toolkit >= 2 renamed append to append_string
+            append = getattr(self._history, "append_string", None) or \
+                self._history.append
+            for item in sorted(self.tagdb.sets[self.category]):
+                append(item)
+        return self._history
 
     def prompt(self, pmsg):
         r = ptk.prompt(
@@ -68,6 +93,172 @@ class Suggestor():
         return r
 
 
+class TagMatcher():
+    """ Match tag keys against many patterns at once.
+
+    The patterns are compiled once into a single alternation, so testing a
+    key costs one regex match regardless of the number of patterns.
+
+    Parameters
+    ----------
+    patterns: list
+        glob patterns, e.g. ``MUSICBRAINZ_*``, or regular expressions
+        prefixed with ``re:``, e.g. ``re:ITUN.*``. Matching is case
+        insensitive and against the whole key.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        alternation = []
+        for i, pattern in enumerate(self.patterns):
+            if pattern.startswith("re:"):
+                expr = pattern[3:]
+            else:
+                expr = fnmatch.translate(pattern)
+            alternation.append("(?P<p{}>{})".format(i, expr))
+        self.regex = re.compile("|".join(alternation), re.IGNORECASE)
+
+    def match(self, key):
+        """ the pattern matching ``key``, ``None`` if there is none """
+        hit = self.regex.fullmatch(key)
+        if hit is None:
+            return None
+        return self.patterns[int(hit.lastgroup[1:])]
+
+
+class TagRewriter():
+    """ Remove families of tags from many files in one walk.
+
+    Parameters
+    ----------
+    patterns: list
+        see ``TagMatcher``
+
+    Attributes
+    ----------
+    hits: collections.Counter
+        number of tags removed per pattern
+    n_file: int
+        number of files that had at least one tag removed
+    """
+
+    def __init__(self, patterns):
+        self.matcher = TagMatcher(patterns)
+        self.hits = Counter()
+        self.n_file = 0
+
+    @classmethod
+    def junk(cls):
+        """ preset for ``config["library"]["tags"]["junk"]`` """
+        return cls([glob.escape(key)
+                    for key in config["library"]["tags"]["junk"]])
+
+    def apply(self, tagfile):
+        """remove matching tags from ``tagfile.tags``
+
+        Returns
+        -------
+        changed: bool
+            ``True`` if anything was removed, i.e. the file needs writing
+        """
+        keep = {}
+        changed = False
+        for key, val in tagfile.tags.items():
+            pattern = self.matcher.match(key)
+            if pattern is None:
+                keep[key] = val
+            else:
+                self.hits[pattern] += 1
+                changed = True
+
+        if changed:
+            tagfile.tags = keep
+            self.n_file += 1
+
+        return changed
+
+    def report(self):
+        """ print per-pattern hit counts """
+        util.printr("removed tags from {} files".format(self.n_file))
+        for pattern in self.matcher.patterns:
+            print("\t{}: {}".format(pattern, self.hits[pattern]))
+
+
+class TagEntry():
+    """ One artist or composer of the tag database.
+
+    A ``__slots__`` record standing in for the dict ``tags.json`` holds
+    per entry, with the same item access (``entry["permutations"]``,
+    ``"count" in entry``, ``entry.get("count", 0)``), so the rest of the
+    database code is unchanged. Fields outside ``FIELDS`` are kept in
+    ``extra`` and written back as they came.
+    """
+
+    FIELDS = ("full_name", "sort", "abbreviated", "borndied",
+              "permutations", "period", "nationality", "instrument",
+              "ordinality", "count")
+    __slots__ = FIELDS + ("extra",)
+
+    def __init__(self, fields):
+        self.extra = None
+        for key, val in fields.items():
+            self[key] = intern_value(val)
+
+    def __getitem__(self, key):
+        try:
+            if key in self.FIELDS:
+                return getattr(self, key)
+            if self.extra is not None:
+                return self.extra[key]
+        except AttributeError:
+            pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, val):
+        if key in self.FIELDS:
+            setattr(self, key, val)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = val
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [key for key in self.FIELDS if hasattr(self, key)]
+        return keys + list(self.extra or ())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+
+CATEGORIES = ("artist", "composer")
+FIELD_SETS = ("nationality", "instrument", "period")
+
+
+def intern_value(val):
+    """ ``sys.intern`` strings, including those in lists """
+    if isinstance(val, str):
+        return sys.intern(val)
+    if isinstance(val, list):
+        return [intern_value(item) for item in val]
+    return val
+
+
 class TagDatabase:
     """
     Primary object for interaction with the library tag database.
@@ -79,56 +270,118 @@ class TagDatabase:
     path: str
         path to ``tags.json`` file, set via ``config["path"]["database"]``
 
-    arange: Arrangement
-        Arrangement instance used for verifying track instrumental
-        arrangement.
+    digest: bytes
+        ``sha256`` of the ``tags.json`` content last loaded
+
+    artist, composer: dict
+        ``TagEntry`` keyed by name. Names and field values are interned,
+        so each distinct string is held once, by the entries, the
+        ``sets`` and the ``index`` alike.
+
+    sets: dict
+        frozenset of names per category, see ``update_sets``
+
+    index: dict
+        per {artist, composer}, the entry key of each name permutation
+
+    matchers: dict
+        per {nationality, instrument, period}, a ``phrases.PhraseMatcher``
+        of the set, for ``get_field``
 
     new_item: dict
         container for new item to be added to database. _item_ can be one of
         {artist, composer, arrangement}
+
+    stats: stats.LibraryStats
+        library statistics used for artist ranking, if attached.
+
+    timer: timing.PhaseTimer
+        times ``refresh``, if attached.
+
+    enricher: enrich.Enricher
+        fetches the wikipedia candidates of new items, created on first
+        use, see ``prefetch``.
     """
 
+    stats = None
+    timer = None
+    enricher = None
+    digest = None
+
     def __init__(self):
         self.path = config["path"]["database"]
         self.load()
-        self.arange = Arrangement()
+        self.update_sets()
         self.new_item = {}
-        self.tokenizr = nltk.tokenize.WordPunctTokenizer()
 
-        # auto_suggest
+        # auto_suggest, shared by all users of the database
         self.suggest = {
-            "artist": Suggestor(self, category="artist"),
-            "composer": Suggestor(self, category="composer"),
-            "period": Suggestor(self, category="period"),
-            "instrument": Suggestor(self, category="instrument"),
-            "nationality": Suggestor(self, category="nationality")}
-
-        self.update_sets()
+            category: Suggestor(self, category=category)
+            for category in ("artist", "composer", "period", "instrument",
+                             "nationality")}
 
     def dump(self):
-        """ dump """
-        with codecs.open(self.path, "w", encoding="utf-8") as fptr:
-            json.dump(self._db, fptr, ensure_ascii=False, indent=4)
+        """ write ``tags.json``, returns the digest of its content """
+        tagdb = dict(self._db, sets={
+            key: sorted(val) for key, val in self.sets.items()})
+        raw = json.dumps(tagdb, ensure_ascii=False, indent=4,
+                         default=TagEntry.to_dict).encode("utf-8")
+        with open(self.path, "wb") as fptr:
+            fptr.write(raw)
+        return snapshot.digest(raw)
 
     def load(self):
-        with open(self.path, "r") as fptr:
-            self._db = json.load(fptr)
-
-        # make a back up
-        call([
-            'cp',
-            self.path,
-            os.path.join(installed_location, "templates", "tags.json")])
+        """load ``tags.json``, from its binary snapshot when that was
+        made from the same content (see ``clamm.snapshot``). Otherwise the
+        ``json`` is parsed and the snapshot rebuilt, and if its content
+        differs from what was loaded last, it is backed up. What was
+        loaded last, by any process, is told by the header of the old
+        snapshot, see ``snapshot.saved_digest``.
+        """
+        with open(self.path, "rb") as fptr:
+            raw = fptr.read()
+        digest = snapshot.digest(raw)
+        use_snapshot = config["database"]["snapshot"]
+
+        self._db = None
+        if use_snapshot:
+            self._db = snapshot.load(
+                self.path, digest, TagEntry, CATEGORIES)
+
+        if self._db is None:
+            self._db = json.loads(raw.decode("utf-8"))
+
+            # entries as records; the sets are rebuilt by update_sets
+            self._db.pop("sets", None)
+            for category in CATEGORIES:
+                self._db[category] = {
+                    sys.intern(key): TagEntry(val)
+                    for key, val in self._db[category].items()}
+
+            if digest not in (self.digest, snapshot.saved_digest(self.path)):
+                self.backup()
+            if use_snapshot:
+                snapshot.save(self.path, digest, self._db,
+                              TagEntry.FIELDS, CATEGORIES)
 
         self.artist = self._db["artist"]
         self.composer = self._db["composer"]
         self.exceptions = self._db["exceptions"]
-        self.sets = self._db["sets"]
+        self.digest = digest
+
+    def backup(self):
+        """ copy ``tags.json`` over the packaged template """
+        target = os.path.join(installed_location, "templates", "tags.json")
+        if os.path.abspath(target) != os.path.abspath(self.path):
+            shutil.copyfile(self.path, target)
 
     def refresh(self):
-        self.dump()
-        self.load()
-        self.update_sets()
+        """ write the database out and bring the sets up to date; it is
+        only loaded back when the content changed """
+        with timing.timed(self.timer, "refresh"):
+            if self.dump() != self.digest:
+                self.load()
+            self.update_sets()
 
     def update_sets(self):
         """
@@ -165,21 +418,36 @@ class TagDatabase:
                  for artist in self.artist.keys()]
         instruments = messylist2set(ilist)
 
-        # compile and write to disk
+        # compile, written to disk by dump
         self.sets = {
-            "period": periods,
-            "artist": artists,
-            "composer": composers,
-            "nationality": nationalities,
-            "instrument": instruments}
-        self._db['sets'] = {key: list(val) for key, val in self.sets.items()}
+            "period": frozenset(periods),
+            "artist": frozenset(artists),
+            "composer": frozenset(composers),
+            "nationality": frozenset(nationalities),
+            "instrument": frozenset(instruments)}
+
+        # phrase matchers, only the difference to the last sets is applied
+        if not hasattr(self, "matchers"):
+            self.matchers = {
+                category: phrases.PhraseMatcher() for category in FIELD_SETS}
+        for category, matcher in self.matchers.items():
+            matcher.update(self.sets[category])
+
+        # permutation --> key, the first entry listing it wins
+        self.index = {}
+        for category in ("artist", "composer"):
+            index = self.index[category] = {}
+            for key, val in self._db[category].items():
+                for perm in val["permutations"]:
+                    if isinstance(perm, str):
+                        index.setdefault(perm, key)
 
     def match_from_perms(self, name, category="artist"):
-        for key, val in self._db[category].items():
-            if name in val["permutations"]:
-                return key
-        raise KeyNotFoundError(
-            "No match from permutations for {}...".format(name))
+        try:
+            return self.index[category][name]
+        except (KeyError, TypeError):
+            raise KeyNotFoundError(
+                name, "No match from permutations for {}...".format(name))
 
     def add_new_perm(self, key, perm, category="artist"):
         """
@@ -199,11 +467,26 @@ class TagDatabase:
         util.printr("proposed item for database:")
         util.pretty_dict(self.new_item)
         if not raw_input("Accept? [y]/n: "):
-            self._db[category][self.new_item["full_name"]] = self.new_item
+            self._db[category][self.new_item["full_name"]] = \
+                TagEntry(self.new_item)
             self.refresh()
         else:
             raise TagDatabaseError("get_new_item: proposed item rejected")
 
+    def get_enricher(self):
+        if self.enricher is None:
+            self.enricher = enrich.Enricher()
+        return self.enricher
+
+    def prefetch(self, names, category="artist"):
+        """ start fetching, in the background, the wikipedia candidates of
+        those ``names`` that are not in the database yet """
+        unknown = [
+            name for name in names if name not in self.sets[category] and
+            name not in self._db["exceptions"]["artists_to_ignore"]]
+        if unknown:
+            self.get_enricher().prefetch(unknown)
+
     def get_new_item(self, item, category="artist"):
         """
         resolves fields for a new item by attempting auto-population
@@ -214,8 +497,9 @@ class TagDatabase:
 
         util.printr("Searching for information on %s..." % (item))
 
-        # attempt to match the item to a wiki entry
-        page = wiki_query(item)
+        # attempt to match the item to a wiki entry, candidates are
+        # usually prefetched already
+        page = wiki_query(item, self.get_enricher())
 
         if page:
             # if match is found, autotag with verification
@@ -321,25 +605,46 @@ class TagDatabase:
         # store the result
         self.new_item = new
 
-    def verify_arrangement(self, artist_set, tagfile, skipflag=False):
-        """
-        Arrangements are used to synchronize artist entries
-        in the database with files in the library.
+    def plan_album(self, rows, skipflag=False):
+        """Compute the arrangements of one album.
+
+        Arrangements are used to synchronize artist entries in the
+        database with files in the library. Planning is a pure function of
+        the album's tag rows and the database, which is only read, so
+        albums can be planned in parallel and in any order.
+
+        Parameters
+        ----------
+        rows: list
+            ``(path, tags)`` of each track of the album
+        skipflag: bool, optional
+            skip tracks that already have an ARRANGEMENT
+
+        Returns
+        -------
+        plans: dict
+            ``ArrangementPlan`` keyed by path. Tracks sharing an
+            arrangement share a plan. Compilations are left out, as are
+            skipped tracks.
         """
+        plans, by_sar = {}, {}
+        for path, ftags in rows:
+            if "ARRANGEMENT" in ftags and skipflag:
+                continue
+            # not interested in arrangements for compilations
+            if ftags.get("COMPILATION", ["0"])[0] == "1":
+                continue
 
-        if "ARRANGEMENT" in tagfile.tags and skipflag:
-            return
-        if "COMPILATION" not in tagfile.tags:
-            tagfile.tags["COMPILATION"] = ["0"]
-        # not interested in arrangements for compilations
-        if tagfile.tags["COMPILATION"][0] == "1":
-            return
+            sar = self.sort_arrangement(util.artist_tagset(ftags))
+            if not sar:
+                continue
+
+            key = tuple(sar.keys())
+            if key not in by_sar:
+                by_sar[key] = ArrangementPlan(sar)
+            plans[path] = by_sar[key]
 
-        sar = self.get_sorted_arrangement(tagfile, artist_set=artist_set)
-        # if len(sar) == 0:
-        #     return
-        self.arange.update(sar, tagfile)
-        return self.arange
+        return plans
 
     def verify_composer(self, qname):
         """Verify the queried composer is in the database.
@@ -498,29 +803,53 @@ class TagDatabase:
         sar: OrderedDict
             Arrangement sorted by ARTIST's library frequency.
         """
-        if artist_set is not None:
-            sar = {aname: (
-                self.artist[aname]["instrument"],
-                self.artist[aname]["count"]) for aname in artist_set}
-        else:
+        if artist_set is None:
             artist_set = get_artist_tagset(tagfile)
-            sar = OrderedDict()
-            for aname in artist_set:
+        return self.sort_arrangement(artist_set)
+
+    def sort_arrangement(self, artist_set):
+        """ sorted instrument/ARTIST arrangement of ``artist_set``, see
+        ``get_sorted_arrangement``. Names without a database entry are
+        left out. """
+        sar = OrderedDict()
+        for aname in artist_set:
+            try:
                 akey = self.match_from_perms(aname)
-                if akey is not None:
-                    sar[akey] = (self.artist[akey]["instrument"],
-                                 self.artist[akey]["count"])
+            except KeyNotFoundError:
+                continue
+            sar[akey] = (self.artist[akey]["instrument"],
+                         self.artist_rank(akey))
 
         sar = OrderedDict(sorted(
             sar.items(), key=lambda t: t[1][1], reverse=True))
         return sar
 
+    def artist_rank(self, akey):
+        """ library frequency of an artist, across its permutations, as a
+        sort key ``(seen, tracks, count)``.
+
+        ``tracks`` are counted by ``stats`` when the database is attached
+        to the library statistics, ``count`` is that stored in
+        ``tags.json``. The two are not on the same scale, so they are
+        never compared with each other: artists the statistics have
+        ``seen`` rank above those they have not, each by their own
+        count, and fresh or partial statistics do not rank every artist
+        0.
+        """
+        tracks = 0
+        if self.stats is not None:
+            tracks = self.stats.artist_count(
+                [akey] + self.artist[akey]["permutations"])
+        return (tracks > 0, tracks, self.artist[akey].get("count", 0))
+
     def get_field(self, summary, category="nationality"):
         """ Get a given category field from the Wikipedia summary.
 
-        Guess the tag value by matching the category sets against the
-        summary words. If guessing fails, fall back on manual entry
-        with ``tags.Suggestor``.
+        Guess the tag value by matching the category set against the
+        summary, see ``phrases.PhraseMatcher``, so multi-word values are
+        found too. Guesses are offered in the order they occur in the
+        summary. If guessing fails, fall back on manual entry with
+        ``tags.Suggestor``.
 
         Parameters
         ----------
@@ -535,11 +864,7 @@ class TagDatabase:
         result: str
             The value for the sought field.
         """
-        known_set = self.sets[category]
-        guess = [word
-                 for word in self.tokenizr.tokenize(summary)
-                 if word in known_set]
-        guess = list(set(guess))    # make sure entries are unique
+        guess = self.matchers[category].ranked(summary)
         result = None
 
         while guess:
@@ -556,109 +881,52 @@ class TagDatabase:
         return result
 
 
-class Arrangement:
-    """ Manage the instrument/artist grouping for an audio file.
+class ArrangementPlan:
+    """ The instrument/artist grouping to apply to tracks of an album.
 
     Attributes
     ----------
-    album: str
-        Name of current album
-
-    commit_flag: bool
-        If ``False``, prevents arrangement from being written to file.
+    sar: OrderedDict
+        sorted arrangement compiled by ``TagDatabase.sort_arrangement``
 
     prima: int
         Index into sorted artist list indicating which artist should be
-        treated as ALBUM_ARTIST.
+        treated as ALBUMARTIST. The default, 0, is the highest ranking
+        (via ARTIST frequency count) artist.
 
     arrangement: str
-        current instrumental ARRANGMENT. If more than one ARTIST,
-        list of instruments is semicolon delimited and order identical
-        to ARTIST.
-
-    sar: OrderedDict
-        sorted arrangement compiled by ``tags.get_sorted_arrangement``
-
-    trackc: int
-        track count associated with current album.
+        instrumental ARRANGEMENT. If more than one ARTIST, list of
+        instruments is semicolon delimited and order identical to ARTIST.
 
     artist: str
-        current ARTIST name. If more than one ARTIST, list is semicolon
-        delimited.
+        ARTIST name. If more than one ARTIST, list is semicolon delimited.
 
     albumartist: str
-        current ALBUM_ARTIST name
+        ALBUMARTIST name
     """
 
-    def __init__(self):
-        self.album = ""
-        self.commit_flag = False
-        self.prima = 0
-        self.arrangement = ""
-        self.sar = OrderedDict()  # sorted arrangement
-        self.trackc = 1
-        self.artist = ""
-        self.albumartist = ""
-
-    def update(self, sar, tagfile):
-        """Conditionally update album/artist attributes.
-
-        The default value for ``prima`` corresponds to the highest
-        ranking (via ARTIST frequency count) ``artist``. This behavior
-        can be changed via
-        ``config["database"]["prompt_for_album_artist"]`` to prompt
-        for a custom ordering.
-        """
+    def __init__(self, sar, prima=0):
         self.sar = sar
-
-        if self.is_changed(tagfile, sar):
-            self.commit_flag = True
-            self.album = tagfile.tags["ALBUM"]
-            self.prima = 0  # default value
-
-            if len(self.sar.keys()) > 1 and \
-                    config["database"]["prompt_for_album_artist"]:
-
-                util.printr("ranking arrangement:")
-                print("\n\tarrangement: {}\n\ttitle: {}\n\talbum: {}"
-                      .format(
-                          self.sar,
-                          tagfile.tags["TITLE"],
-                          tagfile.tags["ALBUM"]))
-
-                response = raw_input("[#]ordering, [s]kip, ... ? ")
-
-                if isinstance(eval(response), int):
-                    self.prima = int(response)
-                else:
-                    util.printr(
-                        "Unable to parse response, using default ordering")
-
+        self.prima = prima
         self.unpack()
 
-    def apply(self, tagfile):
-        """ apply """
-        if self.commit_flag:
-            tagfile.tags["ARRANGEMENT"] = self.arrangement
-            tagfile.tags["ALBUMARTIST"] = self.albumartist
-            tagfile.tags["ARTIST"] = self.artist
-            tagfile.tags = {key: val for key, val in tagfile.tags.items()
-                            if key not in
-                            config["library"]["tags"]["prune_artist"]}
-            util.commit_to_libfile(tagfile)
-
-    def is_changed(self, tagfile, sar):
-        """ Test if album or artist has changed.
-
-        Returns
-        -------
-        is_changed: bool
-            True if either ``tagfile`` or ``sar`` has changed.
-        """
+    def reorder(self, prima):
+        """ use the artist at index ``prima`` as ALBUMARTIST """
+        if 0 <= prima < len(self.sar):
+            self.prima = prima
+            self.unpack()
 
-        is_diff_album = tagfile.tags["ALBUM"] != self.album
-        is_delta_sar = str(self.sar) != str(sar)
-        return is_diff_album or is_delta_sar
+    def apply(self, tagfile):
+        """ write the arrangement to ``tagfile`` """
+        if "COMPILATION" not in tagfile.tags:
+            tagfile.tags["COMPILATION"] = ["0"]
+        tagfile.tags["ARRANGEMENT"] = [self.arrangement]
+        tagfile.tags["ALBUMARTIST"] = [self.albumartist]
+        tagfile.tags["ARTIST"] = [self.artist]
+        tagfile.tags = {key: val for key, val in tagfile.tags.items()
+                        if key not in
+                        config["library"]["tags"]["prune_artist"]}
+        return util.commit_to_libfile(tagfile)
 
     def unpack(self):
         """ unpack """
@@ -715,15 +983,15 @@ def get_borndied(summary):
         return raw_input("Enter Dates: ")
 
 
-def wiki_query(search):
+def wiki_query(search, enricher):
     """ Perform a Wikipedia search
 
-    Fetches a result from wikipedia and prompts user to select correct
-    page, if one exists.
+    Fetches a result from wikipedia, through ``enricher``, and prompts
+    user to select correct page, if one exists.
     """
 
-    # call out to wikipedia
-    results = wikipedia.search(search)
+    # candidates, prefetched or fetched now
+    results = enricher.candidates(search)["results"]
 
     # print options
     util.printr("options: ")
@@ -740,18 +1008,20 @@ def wiki_query(search):
 
     # default, accept the first result
     if not idx:
-        return wikipedia.page(results[0])
+        idx = 0
 
     # handle cases
     idx = int(idx)
     if (idx) >= 0:
-        return wikipedia.page(results[idx])
+        if idx >= len(results):
+            return []
+        return enricher.page(search, results[idx]) or []
     elif (idx) == -1:
         return []
     elif (idx) == -2:
-        return wiki_query(raw_input("Try a new search string: "))
+        return wiki_query(raw_input("Try a new search string: "), enricher)
     elif (idx) == -3:
-        wiki_query(get_translation(search))
+        return wiki_query(get_translation(search), enricher)
     else:
         return []
 
@@ -769,14 +1039,7 @@ def get_translation(search):
 
 def get_artist_tagset(tagfile):
     """ get_artist_tagset """
-    tags = tagfile.tags
-    atags = {
-        t: re.split(
-            util.SPLIT_REGEX,
-            ', '.join(tags[t]))
-        for t in util.ARTIST_TAG_NAMES if t in tags.keys()}
-    aset = set([v.strip() for val in atags.values() for v in val])
-    return aset
+    return util.artist_tagset(tagfile.tags)
 
 
 def get_nearest_name(qname, name_set):
@@ -808,7 +1071,7 @@ def messylist2set(alist):
     """
     clean = [item
              for item in alist
-             if isinstance(item, str) or isinstance(item, unicode)
+             if isinstance(item, str) or isinstance(item, util.unicode)
              and len(item) > 0]
     return set(clean)
 
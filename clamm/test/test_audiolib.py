@@ -0,0 +1,39 @@
+""" test module for clamm.audiolib
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from clamm import audiolib
+
+
+class TestAudiolib(unittest.TestCase):
+    """ TestAudiolib """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_convert_never_overwrites(self):
+        """ a conversion onto an existing file is skipped, both files are
+        left as they were """
+        src, dst = (os.path.join(self.tmp, "foo" + ext)
+                    for ext in (".mp3", ".flac"))
+        for path in (src, dst):
+            with open(path, "w") as fptr:
+                fptr.write(path)
+
+        self.assertIsNone(audiolib.convert_audio(src, dst, {}))
+        for path in (src, dst):
+            with open(path) as fptr:
+                self.assertEqual(fptr.read(), path)
+        self.assertEqual(sorted(os.listdir(self.tmp)),
+                         ["foo.flac", "foo.mp3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+""" test module for clamm.streams.boundaries
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from clamm import config
+from clamm.streams import boundaries
+from clamm.streams import pcm
+from clamm.streams import spectral
+
+
+def tone(freq, sec):
+    t = np.arange(int(sec * pcm.FS)) / pcm.FS
+    return 8000 * np.sin(2 * np.pi * freq * t)
+
+
+class TestBoundaries(unittest.TestCase):
+    """ TestBoundaries """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.ncfg = dict(config["streams"]["novelty"])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        config["streams"]["novelty"] = self.ncfg
+
+    def test_best_path(self):
+        """ the strong boundary wins over a weak one at the expected
+        duration, unless it is beyond the tolerance """
+        score = np.zeros(100)
+        score[[18, 20, 45]] = [1.0, 0.2, 1.0]
+        path = boundaries.best_path(score, 0, [20, 27], [3, 3], 1.0)
+        self.assertEqual(path, [0, 18, 45])
+
+        path = boundaries.best_path(score, 0, [22, 23], [3, 3], 1.0)
+        self.assertEqual(path, [0, 22, 45])
+
+        with self.assertRaises(boundaries.BoundaryError):
+            boundaries.best_path(score, 0, [60, 60], [3, 3], 1.0)
+
+    def test_locate(self):
+        """an attacca, found by its flux, and a gap, found by its
+        quietness, despite expected durations a second or so off """
+        config["streams"]["novelty"].update(tolerance_sec=2)
+        mono = np.concatenate([
+            tone(440, 8), tone(2000, 6), np.zeros(2 * pcm.FS),
+            tone(880, 7), np.zeros(pcm.FS)])
+        path = os.path.join(self.tmp, "stream.pcm")
+        np.repeat(mono.astype(np.int16)[:, None], 2, axis=1).tofile(path)
+
+        with spectral.analyse(path, n_proc=2, n_fft=1024, hop=256,
+                              n_mels=40) as spec:
+            bounds = boundaries.locate(spec, [8.8, 7.0, 8.5], 0)
+
+        seconds = np.array(bounds) / pcm.FS
+        self.assertEqual(seconds[0], 0)
+        self.assertAlmostEqual(seconds[1], 8, delta=0.2)
+        self.assertTrue(13.9 < seconds[2] < 16.2)
+        self.assertTrue(22.9 < seconds[3] < 24.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
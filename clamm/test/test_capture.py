@@ -0,0 +1,100 @@
+""" test module for clamm.streams.capture
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from clamm import config
+from clamm.streams import capture
+from clamm.streams import to_tracks
+
+
+def synthetic_stream(n_silent, n_loud, n_tail):
+    """ silence, a sine tone, then silence, in whole capture blocks """
+    n = capture.BLOCK_FRAMES
+    t = np.arange(n_loud * n) / to_tracks.FS
+    tone = (8000 * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+    mono = np.concatenate([
+        np.zeros(n_silent * n, dtype=np.int16), tone,
+        np.zeros(n_tail * n, dtype=np.int16)])
+    return np.repeat(mono, 2).tobytes()
+
+
+class TestCapture(unittest.TestCase):
+    """ TestCapture """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = dict(config["path"]), dict(config["streams"]["capture"])
+        config["path"]["pcm"] = self.tmp
+        config["path"]["envelopes"] = self.tmp
+        config["streams"]["capture"].update({
+            "format": "pcm", "persistence": 2, "preroll_sec": 1,
+            "silence_sec": 3, "stall_sec": 1, "start_sec": 2})
+
+    def tearDown(self):
+        config["path"].update(self.saved[0])
+        config["streams"]["capture"].update(self.saved[1])
+        shutil.rmtree(self.tmp)
+
+    def feed(self, data):
+        """ write ``data`` to a pipe from a thread, return the read end """
+        rfd, wfd = os.pipe()
+
+        def writer():
+            try:
+                with os.fdopen(wfd, "wb") as fptr:
+                    fptr.write(data)
+            except BrokenPipeError:
+                pass    # capture stops reading once the stream finishes
+
+        threading.Thread(target=writer, daemon=True).start()
+        return os.fdopen(rfd, "rb")
+
+    def test_start_and_finish_from_energy(self):
+        """ leading silence is dropped beyond the preroll, trailing
+        silence ends the capture and is never written """
+        data = synthetic_stream(5, 10, 6)
+        path = capture.capture_stream(self.feed(data), "artist; album")
+
+        n_block = capture.BLOCK_FRAMES * capture.FRAME_BYTES
+        self.assertEqual(os.path.getsize(path), 11 * n_block)
+        envelope = np.load(to_tracks.envelope_path("artist; album"))
+        self.assertEqual(len(envelope), 11)
+        self.assertEqual(np.count_nonzero(envelope), 10)
+        self.assertFalse(os.path.exists(path + ".part"))
+
+    def test_never_started(self):
+        """ a closed source without activity is an error """
+        data = synthetic_stream(3, 0, 0)
+        with self.assertRaises(to_tracks.StreamError):
+            capture.capture_stream(self.feed(data), "artist; album")
+
+    def test_threshold_level(self):
+        """block energy is that of the mean of the channels of each frame,
+        the threshold sits between -70 and -60 dBFS and above dither """
+        n = capture.BLOCK_FRAMES
+        t = np.arange(n) / to_tracks.FS
+        threshold = config["streams"]["capture"]["threshold"]
+
+        def level(dbfs, right=1):
+            tone = 32768 * 10 ** (dbfs / 20) * np.sqrt(2) * \
+                np.sin(2 * np.pi * 440 * t)
+            frames = np.stack([tone, right * tone], axis=1)
+            return to_tracks.block_energy(frames.astype(np.int16).tobytes())
+
+        self.assertGreater(level(-60), threshold)
+        self.assertLess(level(-70), threshold)
+        self.assertEqual(level(-20, right=-1), 0)
+        dither = np.random.RandomState(0).randint(-2, 3, 2 * n)
+        self.assertLess(to_tracks.block_energy(
+            dither.astype(np.int16).tobytes()), 1.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
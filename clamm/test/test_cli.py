@@ -1,9 +1,11 @@
-""" test module for clamm.py
+""" test module for clamm.__main__
 """
 
+import os
 import unittest
 
-from clamm import cli
+from clamm import __main__ as cli
+from clamm import config, installed_location
 
 
 class TestCli(unittest.TestCase):
@@ -14,7 +16,19 @@ class TestCli(unittest.TestCase):
 
     def test_tags_show(self):
         """ test_tags_show """
-        cli.tags_show("")
+        database = config["path"]["database"]
+        config["path"]["database"] = os.path.join(
+            installed_location, "templates", "tags.json")
+        try:
+            cli.tags_show("")
+        finally:
+            config["path"]["database"] = database
+
+    def test_parse_inputs(self):
+        args = cli.parse_inputs().parse_args(
+            ["library", "action", "--remove_junk_tags"])
+        self.assertEqual((args.cmd, args.sub_cmd), ("library", "action"))
+        self.assertTrue(args.remove_junk_tags)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,151 @@
+""" test module for clamm.enrich
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from clamm import config
+from clamm import enrich
+
+PAGE = {"title": "Glenn Gould", "url": "https://en.wikipedia.org/wiki/GG",
+        "summary": "Glenn Herbert Gould (1932 - 1982) was a Canadian "
+                   "classical pianist."}
+FIXTURE = {
+    "search": {"Glenn Gould": ["Glenn Gould", "Glenn Gould Prize"],
+               "Gould": ["Gould", "Glenn Gould"]},
+    "page": {"Glenn Gould": PAGE}}
+
+
+class SlowProvider(enrich.FixtureProvider):
+    """ blocks every search until released, counting calls """
+
+    def __init__(self, path):
+        enrich.FixtureProvider.__init__(self, path)
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+        self.n_search = 0
+
+    def search(self, term):
+        with self.lock:
+            self.n_search += 1
+        self.release.wait(5)
+        return enrich.FixtureProvider.search(self, term)
+
+
+class StuckProvider(enrich.FixtureProvider):
+    """ blocks the search of "Nobody" until released """
+
+    def __init__(self, path):
+        enrich.FixtureProvider.__init__(self, path)
+        self.release = threading.Event()
+
+    def search(self, term):
+        if term == "Nobody":
+            self.release.wait(5)
+        return enrich.FixtureProvider.search(self, term)
+
+
+class TestEnrich(unittest.TestCase):
+    """ TestEnrich """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fixture = os.path.join(self.tmp, "fixture.json")
+        with open(self.fixture, "w") as fptr:
+            json.dump(FIXTURE, fptr)
+        self.saved = (config["path"]["enrich"],
+                      dict(config["database"]["enrich"]))
+        config["path"]["enrich"] = os.path.join(self.tmp, "cache.json")
+        config["database"]["enrich"].update(
+            {"provider": "fixture", "fixture": self.fixture})
+
+    def tearDown(self):
+        config["path"]["enrich"] = self.saved[0]
+        config["database"]["enrich"].update(self.saved[1])
+        shutil.rmtree(self.tmp)
+
+    def test_prefetch_is_concurrent(self):
+        slow = SlowProvider(self.fixture)
+        provider = enrich.CachedProvider(slow, enrich.get_provider().cache)
+        with enrich.Enricher(provider) as enricher:
+            enricher.prefetch(["Glenn Gould", "Gould", "Nobody"])
+            # every search is in flight at once, prefetch did not wait
+            for _ in range(500):
+                if slow.n_search == 3:
+                    break
+                threading.Event().wait(0.01)
+            self.assertEqual(slow.n_search, 3)
+            slow.release.set()
+
+            found = enricher.candidates("Glenn Gould")
+            self.assertEqual(found["results"][0], "Glenn Gould")
+            self.assertEqual(found["pages"], {"Glenn Gould": PAGE})
+
+    def test_candidates_wait_on_their_own_name(self):
+        """ a slow name does not hold up the others prefetched with it,
+        and the cache is saved once all are in """
+        stuck = StuckProvider(self.fixture)
+        provider = enrich.CachedProvider(stuck, enrich.get_provider().cache)
+        with enrich.Enricher(provider) as enricher:
+            enricher.prefetch(["Nobody", "Glenn Gould"])
+            found = enricher.candidates("Glenn Gould")
+            self.assertEqual(found["pages"], {"Glenn Gould": PAGE})
+            self.assertFalse(enricher.futures["Nobody"].done())
+            self.assertFalse(os.path.exists(config["path"]["enrich"]))
+
+            stuck.release.set()
+            enricher.candidates("Nobody")
+            for _ in range(500):
+                if os.path.exists(config["path"]["enrich"]):
+                    break
+                threading.Event().wait(0.01)
+            self.assertTrue(os.path.exists(config["path"]["enrich"]))
+
+    def test_provider_interface(self):
+        with self.assertRaises(TypeError):
+            enrich.WikiProvider()
+            self.assertEqual(enricher.candidates("Nobody")["results"], [])
+            page = enricher.page("Gould", "Glenn Gould")
+            self.assertEqual(page.summary, PAGE["summary"])
+
+    def test_cache(self):
+        with enrich.Enricher() as enricher:
+            enricher.candidates("Glenn Gould")
+        os.remove(self.fixture)
+        with open(self.fixture, "w") as fptr:
+            json.dump({"search": {}, "page": {}}, fptr)
+        with enrich.Enricher() as enricher:
+            found = enricher.candidates("Glenn Gould")
+        self.assertEqual(found["pages"], {"Glenn Gould": PAGE})
+
+    def test_candidates_wait_on_their_own_name(self):
+        """ a slow name does not hold up the others prefetched with it,
+        and the cache is saved once all are in """
+        stuck = StuckProvider(self.fixture)
+        provider = enrich.CachedProvider(stuck, enrich.get_provider().cache)
+        with enrich.Enricher(provider) as enricher:
+            enricher.prefetch(["Nobody", "Glenn Gould"])
+            found = enricher.candidates("Glenn Gould")
+            self.assertEqual(found["pages"], {"Glenn Gould": PAGE})
+            self.assertFalse(enricher.futures["Nobody"].done())
+            self.assertFalse(os.path.exists(config["path"]["enrich"]))
+
+            stuck.release.set()
+            enricher.candidates("Nobody")
+            for _ in range(500):
+                if os.path.exists(config["path"]["enrich"]):
+                    break
+                threading.Event().wait(0.01)
+            self.assertTrue(os.path.exists(config["path"]["enrich"]))
+
+    def test_provider_interface(self):
+        with self.assertRaises(TypeError):
+            enrich.WikiProvider()
+
+
+if __name__ == "__main__":
+    unittest.main()
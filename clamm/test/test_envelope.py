@@ -0,0 +1,112 @@
+""" test module for clamm.streams.envelope
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from clamm import config
+from clamm.streams import envelope
+from clamm.streams import pcm
+from clamm.streams import to_tracks
+
+ONSET = 3 * pcm.FS + 12345
+
+
+class TestEnvelope(unittest.TestCase):
+    """ TestEnvelope """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = dict(config["path"])
+        config["path"]["envelopes"] = os.path.join(self.tmp, "envelopes")
+        rng = np.random.default_rng(0)
+        frames = np.zeros((8 * pcm.FS + 1000, 2), dtype=np.int16)
+        frames[ONSET:] = rng.integers(-4000, 4000, size=(
+            frames.shape[0] - ONSET, 1))
+        self.frames = frames
+        self.path = os.path.join(self.tmp, "stream.pcm")
+        frames.tofile(self.path)
+
+    def tearDown(self):
+        config["path"].update(self.saved)
+        shutil.rmtree(self.tmp)
+
+    def test_levels_agree_with_block_energy(self):
+        levels = envelope.levels_from_config()
+        with pcm.open_stream(self.path) as reader:
+            pyramid = envelope.Pyramid.compute(reader, levels, chunk_sec=2)
+        self.assertEqual(pyramid.levels, (441, 4410, 44100))
+        for frames in levels:
+            expected = [
+                to_tracks.block_energy(self.frames[i:i + frames].tobytes())
+                for i in range(0, 8 * pcm.FS, frames)]
+            np.testing.assert_allclose(pyramid[frames], expected, atol=1e-6)
+
+    def test_accumulator_matches_compute(self):
+        """ fed in uneven chunks, as ``pcm.write_wav`` reads them """
+        levels = envelope.levels_from_config()
+        with pcm.open_stream(self.path) as reader:
+            pyramid = envelope.Pyramid.compute(reader, levels)
+        accumulator = envelope.Accumulator(levels, self.frames.shape[0])
+        data = self.frames.tobytes()
+        for start in range(0, len(data), 123457):
+            accumulator.update(data[start:start + 123457])
+        self.assertTrue(accumulator.full)
+        for frames in levels:
+            np.testing.assert_allclose(
+                accumulator.pyramid()[frames], pyramid[frames])
+
+    def test_stream_scan_makes_no_wav(self):
+        """ a kept pcm stream is checksummed and its envelope cached in
+        one read, without a wav copy """
+        saved = config["library"]["keep_pcms_once_wavs_made"]
+        config["library"]["keep_pcms_once_wavs_made"] = True
+        try:
+            stream = to_tracks.Stream(self.path).scan()
+        finally:
+            config["library"]["keep_pcms_once_wavs_made"] = saved
+        self.assertEqual(stream.audiopath, self.path)
+        self.assertFalse(os.path.exists(stream.wavpath))
+        self.assertEqual(
+            stream.checksum, hashlib.md5(self.frames.tobytes()).hexdigest())
+        with open(self.path + ".md5") as fptr:
+            self.assertEqual(fptr.read().strip(), stream.checksum)
+        with pcm.open_stream(self.path) as reader:
+            expected = envelope.Pyramid.compute(
+                reader, envelope.levels_from_config())
+        np.testing.assert_allclose(
+            envelope.get(self.path).coarse, expected.coarse)
+
+    def test_cache_roundtrip(self):
+        pyramid = envelope.get(self.path)
+        self.assertTrue(os.path.isdir(envelope.cache_path(self.path)))
+        cached = envelope.get(self.path)
+        self.assertIsInstance(cached.coarse, np.memmap)
+        np.testing.assert_array_equal(cached.coarse, pyramid.coarse)
+
+    def test_refined_onset(self):
+        pyramid = envelope.get(self.path)
+        coarse = np.flatnonzero(pyramid.coarse > 500)[0] * pyramid.levels[-1]
+        onset = pyramid.onset(coarse, 500)
+        self.assertLess(abs(onset - ONSET), pyramid.levels[0])
+        quiet = pyramid.quietest(coarse)
+        self.assertLess(quiet, ONSET)
+        self.assertLess(abs(quiet - coarse), 2 * pyramid.levels[-1])
+
+    def test_bad_levels(self):
+        saved = config["streams"]["envelope"]["levels_ms"]
+        config["streams"]["envelope"]["levels_ms"] = [1, 10]
+        try:
+            with self.assertRaises(envelope.EnvelopeError):
+                envelope.levels_from_config()
+        finally:
+            config["streams"]["envelope"]["levels_ms"] = saved
+
+
+if __name__ == "__main__":
+    unittest.main()
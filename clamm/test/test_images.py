@@ -0,0 +1,53 @@
+""" test module for clamm.streams.images
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from clamm import config
+from clamm.streams import images
+
+
+def png_size(path):
+    """ (width, height) from the IHDR chunk of a png """
+    with open(path, "rb") as fptr:
+        return struct.unpack(">II", fptr.read(24)[16:24])
+
+
+class TestImages(unittest.TestCase):
+    """ TestImages """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_minmax_keeps_extremes(self):
+        x_data = np.random.default_rng(0).normal(size=100003)
+        index, low, high = images.minmax(x_data, 1000)
+        self.assertEqual(len(index), 1000)
+        self.assertEqual(low.min(), x_data.min())
+        self.assertEqual(high.max(), x_data.max())
+        self.assertTrue(np.all(low <= high))
+        self.assertEqual(len(images.minmax(x_data[:10], 1000)[0]), 10)
+
+    def test_worker_renders_capped_image(self):
+        path = os.path.join(self.tmp, "envelope.png")
+        x_data = np.abs(np.random.default_rng(0).normal(size=10 ** 6))
+        image = images.Image(path, len(x_data))
+        image.band(x_data, "C0").mark(np.arange(0, 10 ** 6, 10 ** 4), "b")
+        with images.ImageWorker() as worker:
+            images.show(image, worker)
+        imcfg = config["streams"]["images"]
+        self.assertEqual(png_size(path),
+                         (imcfg["max_width_px"], imcfg["height_px"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+""" test module for clamm.loudness
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from clamm import loudness
+
+RATE = 44100
+
+
+def sine(amplitude, seconds=10, freq=997):
+    """ stereo sine at ``amplitude`` (linear, full scale is 1) """
+    t = np.arange(int(seconds * RATE)) / RATE
+    return np.repeat(
+        (amplitude * np.sin(2 * np.pi * freq * t))[:, None], 2, axis=1)
+
+
+class TestLoudness(unittest.TestCase):
+    """ TestLoudness """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_sine_loudness(self):
+        """ a -20 dBFS stereo 1 kHz sine is -20 LUFS """
+        x_data = sine(0.1)
+        hist = loudness.histogram(loudness.block_powers(x_data, RATE))
+        self.assertAlmostEqual(loudness.integrated([hist]), -20, delta=0.1)
+        self.assertAlmostEqual(loudness.true_peak(x_data, RATE), 0.1,
+                               delta=1e-3)
+
+    def test_numpy_filter_matches(self):
+        x_data = sine(0.3, seconds=2, freq=60)
+        expected = loudness.block_powers(x_data, RATE)
+        saved, loudness.signal = loudness.signal, None
+        try:
+            powers = loudness.block_powers(x_data, RATE)
+        finally:
+            loudness.signal = saved
+        np.testing.assert_allclose(powers, expected, rtol=1e-6)
+
+    def test_blocks_match_whole_track(self):
+        """ fed in uneven blocks, filter state carries across them """
+        x_data = sine(0.3, seconds=3, freq=3000)
+        for signal in [loudness.signal, None]:
+            saved, loudness.signal = loudness.signal, signal
+            try:
+                expected = loudness.TrackLoudness(RATE)
+                expected.update(x_data)
+                track = loudness.TrackLoudness(RATE)
+                for start in range(0, len(x_data), 10007):
+                    track.update(x_data[start:start + 10007])
+            finally:
+                loudness.signal = saved
+            np.testing.assert_allclose(
+                track.powers(), expected.powers(), rtol=1e-9)
+            self.assertAlmostEqual(track.peak, expected.peak, places=9)
+
+    def test_gating(self):
+        """ silence does not pull an album down, a quieter track does """
+        loud = loudness.histogram(loudness.block_powers(sine(0.1), RATE))
+        quiet = loudness.histogram(loudness.block_powers(sine(0.05), RATE))
+        silent = loudness.histogram(np.zeros(100))
+        self.assertEqual(silent, {})
+        self.assertIsNone(loudness.integrated([silent]))
+        self.assertEqual(loudness.integrated([loud, silent]),
+                         loudness.integrated([loud]))
+        self.assertLess(loudness.integrated([loud, quiet]),
+                        loudness.integrated([loud]))
+
+    @unittest.skipIf(loudness.soundfile is None, "soundfile not installed")
+    def test_album_gain_and_cache(self):
+        paths = []
+        for i, amplitude in enumerate([0.1, 0.05]):
+            paths.append(os.path.join(self.tmp, "{}.flac".format(i)))
+            loudness.soundfile.write(paths[-1], sine(amplitude), RATE)
+
+        cache = loudness.LoudnessCache(os.path.join(self.tmp, "cache.json"))
+        album_gain = loudness.AlbumGain(cache)
+        for path in paths:
+            album_gain.add(path, "album")
+        rgtags = dict(album_gain.tags())
+        cache.save()
+
+        self.assertEqual(rgtags[paths[0]]["REPLAYGAIN_TRACK_GAIN"],
+                         ["1.95 dB"])
+        self.assertEqual(rgtags[paths[0]]["REPLAYGAIN_ALBUM_GAIN"],
+                         rgtags[paths[1]]["REPLAYGAIN_ALBUM_GAIN"])
+        self.assertEqual(rgtags[paths[1]]["REPLAYGAIN_ALBUM_PEAK"],
+                         rgtags[paths[0]]["REPLAYGAIN_TRACK_PEAK"])
+
+        # a re-run decodes nothing, even once the tags have changed
+        os.utime(paths[0], (0, 0))
+        album_gain = loudness.AlbumGain(loudness.LoudnessCache.load(
+            cache.path))
+        for path in paths:
+            album_gain.add(path, "album")
+        self.assertEqual(album_gain.pending, {})
+        self.assertEqual(dict(album_gain.tags()), rgtags)
+
+
+if __name__ == "__main__":
+    unittest.main()
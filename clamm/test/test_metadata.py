@@ -0,0 +1,134 @@
+""" test module for clamm.streams.metadata
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from clamm import config
+from clamm import util
+from clamm.streams import metadata
+from clamm.streams import to_tracks
+
+ALBUM = {"wrapperType": "collection", "collectionId": 42,
+         "collectionName": "Bach: Harpsichord Concertos",
+         "artistName": "Richard Egarr", "copyright": "Harmonia Mundi",
+         "releaseDate": "2008", "primaryGenreName": "Classical"}
+FIXTURE = {
+    "search": {"Richard Egarr": [
+        dict(ALBUM, collectionId=7, collectionName="Handel: Organ Works"),
+        ALBUM]},
+    "lookup": {"42": [ALBUM] + [
+        {"wrapperType": "track", "trackNumber": n, "trackName": "t%d" % n,
+         "artistName": "Richard Egarr", "trackTimeMillis": 1000 * n}
+        for n in (2, 1)]}}
+
+
+class CountingProvider(metadata.FixtureProvider):
+    """ counts calls that reach the provider """
+
+    def __init__(self, path):
+        metadata.FixtureProvider.__init__(self, path)
+        self.n_call = 0
+
+    def search_album(self, artist):
+        self.n_call += 1
+        return metadata.FixtureProvider.search_album(self, artist)
+
+    def lookup(self, collection_id):
+        self.n_call += 1
+        return metadata.FixtureProvider.lookup(self, collection_id)
+
+
+class TestMetadata(unittest.TestCase):
+    """ TestMetadata """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fixture = os.path.join(self.tmp, "fixture.json")
+        with open(self.fixture, "w") as fptr:
+            json.dump(FIXTURE, fptr)
+        self.saved = (config["path"]["metadata"],
+                      dict(config["streams"]["metadata"]))
+        config["path"]["metadata"] = os.path.join(self.tmp, "cache.json")
+        config["streams"]["metadata"].update(
+            {"provider": "fixture", "fixture": self.fixture})
+
+    def tearDown(self):
+        config["path"]["metadata"] = self.saved[0]
+        config["streams"]["metadata"].update(self.saved[1])
+        shutil.rmtree(self.tmp)
+
+    def test_match_album(self):
+        """ nearest album by edit distance, tracks in album order """
+        query = metadata.match_album(
+            metadata.get_provider(), "Richard Egarr",
+            "Bach: Harpsichord Concertos", 8)
+        self.assertEqual(query.collection_id, 42)
+        self.assertEqual(query.copyright, "Harmonia Mundi")
+        self.assertEqual(
+            [t.track_name for t in query.get_tracks()], ["t1", "t2"])
+        self.assertEqual(query.get_tracks()[1].track_time, 2000)
+
+    def test_no_match(self):
+        self.assertIsNone(metadata.match_album(
+            metadata.get_provider(), "Richard Egarr", "Mahler 9", 8))
+
+    def test_cache_persists_and_expires(self):
+        """ a second provider instance is answered from disk, until the
+        entries are older than the ttl """
+        counting = CountingProvider(self.fixture)
+        cache = util.JsonCache(config["path"]["metadata"], ttl=60)
+        metadata.match_album(
+            metadata.CachedProvider(counting, cache), "Richard Egarr",
+            "Bach: Harpsichord Concertos", 8)
+        self.assertEqual(counting.n_call, 2)
+        self.assertFalse(os.path.exists(config["path"]["metadata"]))
+        cache.save()
+
+        cache = util.JsonCache(config["path"]["metadata"], ttl=60)
+        metadata.match_album(
+            metadata.CachedProvider(counting, cache), "Richard Egarr",
+            "Bach: Harpsichord Concertos", 8)
+        self.assertEqual(counting.n_call, 2)
+
+        cache = util.JsonCache(config["path"]["metadata"], ttl=-1)
+        metadata.match_album(
+            metadata.CachedProvider(counting, cache), "Richard Egarr",
+            "Bach: Harpsichord Concertos", 8)
+        self.assertEqual(counting.n_call, 4)
+
+    def test_prefetch(self):
+        """ the cache is saved once, for all the albums """
+        saves = []
+        save = util.JsonCache.save
+        util.JsonCache.save = lambda cache: saves.append(save(cache))
+        try:
+            found = metadata.prefetch([
+                ("Richard Egarr", "Bach: Harpsichord Concertos"),
+                ("Nobody", "Nothing")])
+        finally:
+            util.JsonCache.save = save
+        self.assertEqual(len(saves), 1)
+        self.assertTrue(os.path.exists(config["path"]["metadata"]))
+        self.assertEqual(
+            found[("Richard Egarr", "Bach: Harpsichord Concertos")]
+            .collection_name, "Bach: Harpsichord Concertos")
+        self.assertIsNone(found[("Nobody", "Nothing")])
+
+        # a stream of the listing takes its prefetched record
+        stream = to_tracks.Stream(os.path.join(
+            self.tmp, "Richard Egarr; Bach: Harpsichord Concertos.pcm"))
+        stream.decode_path().itunes_query(found)
+        self.assertIs(stream.query, found[
+            ("Richard Egarr", "Bach: Harpsichord Concertos")])
+
+    def test_provider_interface(self):
+        with self.assertRaises(TypeError):
+            metadata.MetadataProvider()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+""" test module for clamm.streams.pcm
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import wave
+
+import numpy as np
+
+from clamm.streams import pcm
+
+
+class TestPcm(unittest.TestCase):
+    """ TestPcm """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.frames = rng.integers(
+            -2000, 2000, size=(pcm.FS, 2)).astype(np.int16)
+        self.pcm = os.path.join(self.tmp, "stream.pcm")
+        self.frames.tofile(self.pcm)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_write_wav_is_wave_readable(self):
+        wav = os.path.join(self.tmp, "stream.wav")
+        pcm.write_wav(self.pcm, wav)
+        with wave.open(wav) as reader:
+            self.assertEqual(reader.getnframes(), pcm.FS)
+            self.assertEqual(reader.getnchannels(), 2)
+            data = reader.readframes(10)
+        self.assertEqual(data, self.frames[:10].tobytes())
+
+    def test_reader_matches_wave(self):
+        """ raw stream and wav file read the same through PcmReader """
+        wav = os.path.join(self.tmp, "stream.wav")
+        pcm.write_wav(self.pcm, wav)
+        raw, hdr = pcm.open_stream(self.pcm), pcm.open_stream(wav)
+        self.assertEqual(raw.getnframes(), hdr.getnframes())
+        raw.setpos(100)
+        hdr.setpos(100)
+        self.assertEqual(raw.readframes(50), hdr.readframes(50))
+        self.assertEqual(raw.tell(), 150)
+
+    def test_write_wav_in_place(self):
+        """ converting in place, with a buffer that is not a multiple of
+        the header size, gives the same wav as a copy and feeds sinks
+        every frame in order """
+        copy, in_place = (os.path.join(self.tmp, name)
+                          for name in ("copy.wav", "in_place.wav"))
+        with open(self.pcm, "ab") as fptr:
+            fptr.write(b"\x01")     # a partial trailing frame
+        pcm.write_wav(self.pcm, copy, bufsize=1000)
+        seen = []
+        pcm.write_wav(self.pcm, in_place, bufsize=1000, sinks=[seen.append],
+                      in_place=True)
+
+        self.assertFalse(os.path.exists(self.pcm))
+        with open(copy, "rb") as fcopy, open(in_place, "rb") as fin:
+            self.assertEqual(fcopy.read(), fin.read())
+        self.assertEqual(b"".join(seen), self.frames.tobytes())
+        with pcm.open_stream(in_place) as reader:
+            np.testing.assert_array_equal(reader.frames, self.frames)
+
+    def test_scan(self):
+        """ sinks see every whole frame in order, the stream is left as
+        it is """
+        with open(self.pcm, "ab") as fptr:
+            fptr.write(b"\x01\x00")     # a partial trailing frame
+        seen = []
+        pcm.scan(self.pcm, [seen.append], bufsize=1001)
+        self.assertEqual(b"".join(seen), self.frames.tobytes())
+        self.assertEqual(os.path.getsize(self.pcm), self.frames.nbytes + 2)
+
+    def test_wav_size_limit(self):
+        """ a stream too large for a wav file is refused before it is
+        touched """
+        n_frame = pcm.MAX_WAV_DATA // 4
+        self.assertEqual(len(pcm.wav_header(n_frame)), pcm.WAV_HEADER_BYTES)
+        with self.assertRaises(pcm.StreamError):
+            pcm.wav_header(n_frame + 1)
+
+        with open(self.pcm, "r+b") as fptr:
+            fptr.truncate(4 << 30)      # sparse
+        with self.assertRaises(pcm.StreamError):
+            pcm.write_wav(self.pcm, self.pcm + ".wav", in_place=True)
+        with open(self.pcm, "rb") as fptr:
+            self.assertEqual(fptr.read(16), self.frames[:4].tobytes())
+
+    @unittest.skipIf(pcm.soundfile is None, "soundfile not installed")
+    def test_encoder_pool(self):
+        flac = os.path.join(self.tmp, "track.flac")
+        with pcm.EncoderPool(n_proc=1) as encoder:
+            encoder.submit(self.pcm, 1000, 5000, flac)
+        decoded, rate = pcm.soundfile.read(flac, dtype="int16")
+        self.assertEqual(rate, pcm.FS)
+        np.testing.assert_array_equal(decoded, self.frames[1000:6000])
+
+    def test_trim_bounds(self):
+        trim = {"threshold_db": -60, "min_gap_ms": 200, "lead_ms": 100,
+                "tail_ms": 300, "fade_in_ms": 5, "fade_out_ms": 20}
+        quiet = np.zeros((pcm.FS, 2), dtype=np.int16)
+        frames = np.concatenate([quiet, self.frames, quiet[:1000]])
+        self.assertEqual(pcm.trim_bounds(frames, trim),
+                         (pcm.FS - 4410, len(frames)))
+
+        out = pcm.trimmed(frames, trim)
+        self.assertEqual(len(out), len(frames) - pcm.FS + 4410)
+        self.assertEqual(out[0, 0], 0)
+        np.testing.assert_array_equal(out[4410 + 220:], frames[pcm.FS + 220:])
+
+        # gapless: nothing to trim, nothing faded
+        np.testing.assert_array_equal(
+            pcm.trimmed(self.frames, trim), self.frames)
+
+    @unittest.skipIf(pcm.soundfile is None, "soundfile not installed")
+    def test_encoder_pool_trims(self):
+        trim = {"threshold_db": -60, "min_gap_ms": 200, "lead_ms": 0,
+                "tail_ms": 0, "fade_in_ms": 0, "fade_out_ms": 0}
+        padded = os.path.join(self.tmp, "padded.pcm")
+        quiet = np.zeros((pcm.FS // 2, 2), dtype=np.int16)
+        np.concatenate([quiet, self.frames, quiet]).tofile(padded)
+        flac = os.path.join(self.tmp, "track.flac")
+        with pcm.EncoderPool(n_proc=1) as encoder:
+            encoder.submit(padded, 0, 2 * pcm.FS, flac, trim)
+        decoded, _ = pcm.soundfile.read(flac, dtype="int16")
+        first = np.flatnonzero(np.abs(self.frames).max(axis=1) > 32)[0]
+        np.testing.assert_array_equal(decoded[:100], self.frames[
+            first:first + 100])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+""" test module for clamm.phrases
+"""
+
+import unittest
+
+from clamm import phrases
+
+SUMMARY = ("Vladimir Horowitz was a Jewish Soviet-born American classical "
+           "pianist, much admired by British-Italian and American critics "
+           "alike, though never by fans of Americana.")
+
+
+class TestPhraseMatcher(unittest.TestCase):
+    """ TestPhraseMatcher """
+
+    def setUp(self):
+        self.matcher = phrases.PhraseMatcher([
+            "American", "Jewish Soviet-born American", "Soviet-born American",
+            "British-Italian", "Italian", "French"])
+
+    def test_find_all_ranked_by_position(self):
+        found = self.matcher.find(SUMMARY)
+        self.assertEqual([phrase for _, phrase in found], [
+            "Jewish Soviet-born American", "Soviet-born American",
+            "American", "British-Italian", "Italian", "American"])
+        start = SUMMARY.index("Jewish")
+        self.assertEqual(found[0], (start, "Jewish Soviet-born American"))
+        self.assertEqual(self.matcher.ranked(SUMMARY), [
+            "Jewish Soviet-born American", "Soviet-born American",
+            "American", "British-Italian", "Italian"])
+
+    def test_case_and_word_boundaries(self):
+        self.assertEqual(self.matcher.ranked("an AMERICAN pianist"),
+                         ["American"])
+        self.assertEqual(self.matcher.ranked("Americana, Frenchness"), [])
+
+    def test_incremental_update(self):
+        self.matcher.update(["Italian", "Russian", "Soviet-born American"])
+        self.assertEqual(self.matcher.ranked(SUMMARY),
+                         ["Soviet-born American", "Italian"])
+        self.assertEqual(self.matcher.ranked("a Russian Italian"),
+                         ["Russian", "Italian"])
+        self.assertNotIn("French", self.matcher)
+        self.assertEqual(len(self.matcher), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+""" test module for clamm.recent
+"""
+
+import os
+import stat
+import time
+import shutil
+import tempfile
+import unittest
+
+from clamm import config
+from clamm import recent
+from clamm import util
+
+STUB = """#!/bin/sh
+for arg in "$@"; do echo "$arg" >> "{}"; done
+"""
+
+
+class CountingIndex(recent.RecentlyAdded):
+    """ records the folders listed """
+
+    def examine(self, folder, cutoff, delta):
+        self.listed.append(folder)
+        return recent.RecentlyAdded.examine(self, folder, cutoff, delta)
+
+
+class TestRecent(unittest.TestCase):
+    """ TestRecent """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = dict(config["path"])
+        self.library = os.path.join(self.tmp, "library")
+        config["path"].update(
+            library=self.library, playlist=os.path.join(self.tmp, "pl"),
+            recent=os.path.join(self.tmp, "recent.json"))
+
+        # a local cmus-remote that logs its arguments
+        self.log = os.path.join(self.tmp, "cmus.log")
+        bindir = os.path.join(self.tmp, "bin")
+        os.makedirs(bindir)
+        stub = os.path.join(bindir, "cmus-remote")
+        with open(stub, "w") as fptr:
+            fptr.write(STUB.format(self.log))
+        os.chmod(stub, os.stat(stub).st_mode | stat.S_IEXEC)
+        self.env_path = os.environ["PATH"]
+        os.environ["PATH"] = bindir + os.pathsep + self.env_path
+
+    def tearDown(self):
+        os.environ["PATH"] = self.env_path
+        config["path"].update(self.saved)
+        shutil.rmtree(self.tmp)
+
+    def album(self, *parts, n_track=2):
+        folder = os.path.join(self.library, *parts)
+        os.makedirs(folder)
+        tracks = [os.path.join(folder, "%02d.flac" % (i + 1))
+                  for i in range(n_track)]
+        for track in tracks + [os.path.join(folder, "cover.jpg")]:
+            open(track, "w").close()
+        return tracks
+
+    def pushed(self):
+        try:
+            with open(self.log) as fptr:
+                lines = fptr.read().splitlines()
+        except IOError:
+            return []
+        os.remove(self.log)
+        return lines
+
+    def playlist(self):
+        with open(self.m3u) as fptr:
+            return sorted(fptr.read().splitlines())
+
+    def test_refresh_pushes_changes(self):
+        """cmus is sent only the tracks added since the last refresh, the
+        playlist file holds them all """
+        self.m3u = os.path.join(config["path"]["playlist"],
+                                recent.PLAYLIST_NAME)
+        option = config["opt"]["cmus-remote"]
+        partitas = self.album("Bach", "Partitas")
+        added, removed = recent.refresh()
+        self.assertEqual((added, removed), (partitas, []))
+        self.assertEqual(self.pushed(), [option] + partitas)
+        self.assertEqual(self.playlist(), partitas)
+
+        # nothing new, nothing sent
+        self.assertEqual(recent.refresh(), ([], []))
+        self.assertEqual(self.pushed(), [])
+
+        suites = self.album("Bach", "Suites", n_track=1)
+        recent.refresh()
+        self.assertEqual(self.pushed(), [option] + suites)
+        self.assertEqual(self.playlist(), sorted(partitas + suites))
+
+        # an expired album leaves the file, nothing is sent
+        shutil.rmtree(os.path.join(self.library, "Bach", "Suites"))
+        self.assertEqual(recent.refresh(), ([], suites))
+        self.assertEqual(self.pushed(), [])
+        self.assertEqual(self.playlist(), partitas)
+
+    def test_lists_changed_folders_only(self):
+        self.album("Bach", "Partitas")
+        self.album("Handel", "Suites")
+        index = CountingIndex()
+        index.listed = []
+        index.update()
+        self.assertEqual(len(index.listed), 5)
+
+        # as if the last update ran well after the folders were made
+        time.sleep(0.1)
+        index.high_water = time.time() - 0.05
+        index.listed = []
+        goldberg = self.album("Bach", "Goldberg", n_track=1)
+        self.assertEqual(index.update(), (goldberg, []))
+        bach = os.path.join(self.library, "Bach")
+        self.assertEqual(sorted(index.listed),
+                         [bach, os.path.join(bach, "Goldberg")])
+
+        # albums age out
+        later = time.time() + \
+            (config["library"]["recently_added_day_age"] + 1) * \
+            util.SEC_PER_DAY
+        added, removed = index.update(now=later)
+        self.assertEqual(added, [])
+        self.assertEqual(len(removed), 5)
+        self.assertEqual(index.tracks, [])
+
+    def test_save_load(self):
+        tracks = self.album("Bach", "Partitas")
+        index = recent.RecentlyAdded()
+        index.update()
+        index.save()
+        loaded = recent.RecentlyAdded.load()
+        self.assertEqual(loaded.tracks, tracks)
+        self.assertEqual(loaded.high_water, index.high_water)
+        self.assertEqual(
+            recent.RecentlyAdded.load(root=self.tmp).folders, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+""" test module for clamm.snapshot
+"""
+
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from clamm import config, installed_location
+from clamm import snapshot
+from clamm import tags
+
+TAGDB = {
+    "artist": {
+        "Glenn Gould": {"full_name": "Glenn Gould", "count": 50,
+                        "permutations": ["Glenn Gould", "Gould, Glenn"],
+                        "instrument": ["piano"], "borndied": None,
+                        "website": "gould.ca"}},
+    "composer": {
+        "J.S. Bach": {"full_name": "J.S. Bach", "period": "Baroque",
+                      "permutations": ["J.S. Bach", "Bach"]}},
+    "exceptions": {"artists_to_ignore": ["Various"]}}
+
+
+class TestSnapshot(unittest.TestCase):
+    """ TestSnapshot """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "tags.json")
+        self.write(TAGDB)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, tagdb):
+        with open(self.path, "w") as fptr:
+            json.dump(tagdb, fptr)
+        with open(self.path, "rb") as fptr:
+            self.digest = snapshot.digest(fptr.read())
+
+    def save(self):
+        snapshot.save(self.path, self.digest, TAGDB, tags.TagEntry.FIELDS,
+                      tags.CATEGORIES)
+
+    def load(self):
+        return snapshot.load(
+            self.path, self.digest, tags.TagEntry, tags.CATEGORIES)
+
+    def test_roundtrip(self):
+        self.save()
+        tagdb = self.load()
+        gould = tagdb["artist"]["Glenn Gould"]
+        self.assertIsInstance(gould, tags.TagEntry)
+        for category in tags.CATEGORIES:
+            self.assertEqual(
+                {key: val.to_dict() for key, val in tagdb[category].items()},
+                TAGDB[category])
+        self.assertEqual(tagdb["exceptions"], TAGDB["exceptions"])
+        self.assertNotIn("period", gould)
+
+    def test_stale_snapshot_is_ignored(self):
+        self.save()
+        edited = dict(TAGDB, exceptions={"artists_to_ignore": []})
+        time.sleep(0.01)
+        self.write(edited)
+        self.assertIsNone(self.load())
+
+    def test_rewritten_json_keeps_snapshot(self):
+        """ the digest decides, not the age of the files """
+        self.save()
+        time.sleep(0.01)
+        self.write(TAGDB)
+        self.assertIsNotNone(self.load())
+
+    def test_unchanged_refresh_is_not_backed_up(self):
+        backups = []
+        with open(os.path.join(installed_location, "templates",
+                               "tags.json")) as fptr:
+            self.write(json.load(fptr))
+        saved = config["path"]["database"]
+        config["path"]["database"] = self.path
+        backup = tags.TagDatabase.backup
+        tags.TagDatabase.backup = lambda tagdb: backups.append(tagdb.digest)
+        try:
+            tagdb = tags.TagDatabase()
+            tagdb.refresh()     # as dumped, once
+            tagdb.refresh()
+            self.assertEqual(len(backups), 2)
+
+            akey = sorted(tagdb.artist)[0]
+            tagdb.artist[akey]["count"] = 51
+            tagdb.refresh()
+            self.assertEqual(len(backups), 3)
+            self.assertEqual(tags.TagDatabase().artist[akey]["count"], 51)
+            self.assertEqual(len(backups), 3)
+
+            # a cold parse, in a new process, of content already backed up
+            snap = snapshot.path_for(self.path)
+            with open(snap, "r+b") as fptr:
+                fptr.truncate(snapshot.HEADER.size)
+            tags.TagDatabase()
+            self.assertEqual(len(backups), 3)
+        finally:
+            tags.TagDatabase.backup = backup
+            config["path"]["database"] = saved
+
+    def test_missing_or_corrupt_snapshot(self):
+        self.assertIsNone(self.load())
+        with open(snapshot.path_for(self.path), "wb") as fptr:
+            fptr.write(b"garbage")
+        self.assertIsNone(self.load())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+""" test module for clamm.streams.spectral
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from clamm.streams import pcm
+from clamm.streams import spectral
+
+
+class TestSpectral(unittest.TestCase):
+    """ TestSpectral """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        t = np.arange(3 * pcm.FS) / pcm.FS
+        tone = 8000 * np.sin(2 * np.pi * np.where(t < 1.5, 440, 3000) * t)
+        self.frames = np.repeat(tone.astype(np.int16)[:, None], 2, axis=1)
+        self.path = os.path.join(self.tmp, "stream.pcm")
+        self.frames.tofile(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_segments_match_single_pass(self):
+        """ parallel segments give exactly the frames of one pass """
+        n_fft, hop, n_mels = 1024, 256, 40
+        with spectral.analyse(self.path, n_proc=2, n_fft=n_fft, hop=hop,
+                              n_mels=n_mels, segment_sec=0.3) as spec:
+            mono = self.frames.mean(axis=1) / 32768
+            expected = spectral.mel_frames(
+                mono, n_fft, hop,
+                spectral.mel_filterbank(n_mels, n_fft, pcm.FS))
+            self.assertEqual(spec.mel.shape, (
+                spectral.n_frames(len(mono), n_fft, hop), n_mels))
+            np.testing.assert_allclose(spec.mel, expected, rtol=1e-4)
+
+            level = 10 * np.log10(expected + spectral.EPS)
+            np.testing.assert_allclose(spec.band_mean, level.mean(axis=0),
+                                       rtol=1e-6)
+            np.testing.assert_allclose(spec.band_std, level.std(axis=0),
+                                       rtol=1e-4, atol=1e-6)
+
+            # the tone moves up the bands half way through
+            peak = np.argmax(spec.mel, axis=1)
+            half = len(peak) // 2
+            self.assertLess(peak[half - 10], peak[half + 10])
+            self.assertAlmostEqual(spec.times[-1], (len(peak) - 1) * hop /
+                                   pcm.FS)
+
+    def test_filterbank(self):
+        bank = spectral.mel_filterbank(10, 512, pcm.FS)
+        self.assertEqual(bank.shape, (10, 257))
+        self.assertTrue(np.all(bank >= 0))
+        self.assertTrue(np.all(bank.sum(axis=1) > 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+""" test module for clamm.streams.splitter
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import wave
+from types import SimpleNamespace
+
+import numpy as np
+
+from clamm import config
+from clamm.streams import splitter
+from clamm.streams import to_tracks
+
+
+def tone_blocks(n_block, amplitude=8000):
+    """ ``n_block`` blocks of stereo sine tone (or silence) """
+    n = int(to_tracks.DF) * n_block
+    t = np.arange(n) / to_tracks.FS
+    mono = (amplitude * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+    data = np.repeat(mono, 2).tobytes()
+    size = len(data) // n_block
+    return [data[i * size:(i + 1) * size] for i in range(n_block)]
+
+
+class TestOnlineSplitter(unittest.TestCase):
+    """ TestOnlineSplitter """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def make_tracks(self, durations):
+        tracks = []
+        for i, sec in enumerate(durations):
+            itrack = SimpleNamespace(
+                track_time=sec * 1000, track_name="t%d" % i,
+                artist_name="a", track_number=i + 1)
+            track = to_tracks.Track(itrack)
+            track.set_path(i, self.tmp)
+            tracks.append(track)
+        return tracks
+
+    def test_tracks_emitted_before_stream_ends(self):
+        """ each track is closed at the silent gap near its expected end,
+        the first one while the stream is still being fed """
+        layout = [(2, 0), (20, 8000), (3, 0), (15, 8000), (2, 0),
+                  (10, 8000), (2, 0)]
+        blocks = []
+        for n_block, amplitude in layout:
+            blocks.extend(tone_blocks(n_block, amplitude))
+
+        done = []
+        tracks = self.make_tracks([22, 18, 12])
+        online = splitter.OnlineSplitter(tracks, on_track=done.append)
+        for block in blocks[:35]:
+            online.feed(block, to_tracks.block_energy(block))
+        self.assertEqual(len(done), 1)
+
+        for block in blocks[35:]:
+            online.feed(block, to_tracks.block_energy(block))
+        online.close()
+
+        self.assertEqual([t.name for t in done], ["t0", "t1", "t2"])
+        stops = [t.end_frame // int(to_tracks.DF) for t in done]
+        self.assertTrue(22 <= stops[0] <= 25)
+        self.assertTrue(40 <= stops[1] <= 42)
+        for track in done:
+            with wave.open(track.path) as wav:
+                self.assertEqual(wav.getnframes(), track.n_frame)
+        self.assertTrue(all(os.path.exists(t.path) for t in tracks))
+
+    def test_threshold_from_config(self):
+        """ activity is judged as during capture """
+        capcfg = config["streams"]["capture"]
+        saved = dict(capcfg)
+        capcfg.update(threshold=1e9, persistence=3)
+        try:
+            online = splitter.OnlineSplitter(self.make_tracks([5]))
+        finally:
+            capcfg.update(saved)
+        self.assertEqual((online.threshold, online.persistence), (1e9, 3))
+        for block in tone_blocks(5):
+            online.feed(block, to_tracks.block_energy(block))
+        self.assertIsNone(online.writer)
+
+
+if __name__ == "__main__":
+    unittest.main()
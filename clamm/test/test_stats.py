@@ -0,0 +1,74 @@
+""" test module for clamm.stats
+"""
+
+import os
+import pathlib
+import tempfile
+import unittest
+
+from clamm import stats
+from clamm import util
+
+
+def ftags(artist, composer, arrangement="piano"):
+    return {"ARTIST": [artist], "COMPOSER": [composer],
+            "ARRANGEMENT": [arrangement], "ALBUM": ["Album"],
+            "ALBUMARTIST": [artist]}
+
+
+class TestLibraryStats(unittest.TestCase):
+    """ TestLibraryStats """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "stats.json")
+        self.libstats = stats.LibraryStats(self.path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_observe_applies_diff(self):
+        """ a retagged file moves its counts rather than adding to them """
+        self.libstats.observe("/a/1.flac", ftags("Gould", "Bach"))
+        self.libstats.observe("/a/2.flac", ftags("Gould", "Bach"))
+        self.libstats.observe("/a/1.flac", ftags("Gould", "Mozart"))
+
+        self.assertEqual(self.libstats.composer["Bach"], 1)
+        self.assertEqual(self.libstats.composer["Mozart"], 1)
+        self.assertEqual(self.libstats.artist["Gould"], 2)
+        self.assertEqual(self.libstats.album["/a"]["n_track"], 2)
+
+    def test_remove_drops_empty_entries(self):
+        self.libstats.observe("/a/1.flac", ftags("Gould", "Bach"))
+        self.libstats.remove("/a/1.flac")
+
+        self.assertNotIn("Gould", self.libstats.artist)
+        self.assertNotIn("/a", self.libstats.album)
+
+    def test_persistence(self):
+        """ aggregates survive a save/load round trip, and an unchanged
+        file leaves the stats clean """
+        self.libstats.observe("/a/1.flac", ftags("Gould", "Bach"))
+        self.libstats.save()
+
+        loaded = stats.LibraryStats.load(self.path)
+        self.assertEqual(loaded.artist, self.libstats.artist)
+        self.assertEqual(loaded.grouping["piano"], 1)
+
+        loaded.observe("/a/1.flac", ftags("Gould", "Bach"))
+        self.assertFalse(loaded.dirty)
+
+        # pytaglib may hand out a pathlib.Path
+        loaded.observe(pathlib.Path("/a/2.flac"), ftags("Gould", "Bach"))
+        loaded.save()
+        self.assertIn("/a/2.flac", stats.LibraryStats.load(self.path).files)
+
+    def test_commit_hook_is_scoped(self):
+        """ a hook only hears the commits of its block """
+        with util.commit_hook(self.libstats.on_commit):
+            self.assertIn(self.libstats.on_commit, util.commit_hooks)
+        self.assertEqual(util.commit_hooks, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
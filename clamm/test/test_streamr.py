@@ -0,0 +1,106 @@
+""" test module for clamm.lp2flac.z_streamr
+"""
+
+import io
+import os
+import tempfile
+import threading
+import unittest
+import wave
+
+import numpy as np
+
+from clamm.lp2flac import z_streamr
+
+
+class TestStreamr(unittest.TestCase):
+    """ TestStreamr """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        # a little over 3 blocks, so the last block is short
+        n_frame = 3 * 16384 + 1000
+        self.frames = (3000 * np.sin(np.arange(n_frame) / 20)).astype(
+            np.int16)[:, None].repeat(2, axis=1)
+        self.frames[:, 1] += rng.integers(-5, 5, n_frame).astype(np.int16)
+        self.data = self.frames.tobytes()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def roundtrip(self, codec, path):
+        server = z_streamr.StreamServer("127.0.0.1", 0, codec=codec)
+        result = {}
+
+        def run():
+            result["sent"] = server.serve(io.BytesIO(self.data), drop=False)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        listener = z_streamr.StreamListener(*server.address, timeout=10)
+        metrics = listener.listen(path)
+        thread.join()
+        return result["sent"], metrics
+
+    def test_codecs_are_lossless(self):
+        codecs = ["none", "zlib"]
+        if z_streamr.soundfile is not None:
+            codecs.append("flac")
+        for codec in codecs:
+            path = os.path.join(self.tmp.name, codec + ".pcm")
+            sent, received = self.roundtrip(codec, path)
+            with open(path, "rb") as fptr:
+                self.assertEqual(fptr.read(), self.data, codec)
+            self.assertEqual(sent["sent"], 4)
+            self.assertEqual(received["missing"], 0)
+            if codec != "none":
+                self.assertLess(sent["bytes_wire"], sent["bytes_raw"])
+
+    def test_listen_to_wav(self):
+        path = os.path.join(self.tmp.name, "side.wav")
+        self.roundtrip("zlib", path)
+        with wave.open(path) as reader:
+            self.assertEqual(reader.getnframes(), len(self.frames))
+            self.assertEqual(reader.readframes(10), self.frames[:10].tobytes())
+
+    @unittest.skipIf(z_streamr.soundfile is None, "soundfile not installed")
+    def test_album_source_is_gapless(self):
+        """ the tracks of two albums come out back to back, through a
+        ring buffer smaller than a track """
+        folder = self.tmp.name
+        parts = np.array_split(self.frames, 4)
+        for i, part in enumerate(parts):
+            album = os.path.join(folder, "album{}".format(i // 2))
+            os.makedirs(album, exist_ok=True)
+            z_streamr.soundfile.write(
+                os.path.join(album, "{:02d}.flac".format(i)), part, 44100)
+
+        source = z_streamr.AlbumSource(folder, ring_sec=0.1)
+        data = b"".join(iter(lambda: source.read(5000), b""))
+        source.close()
+        self.assertEqual(len(source.tracks), 4)
+        self.assertEqual(data, self.data)
+
+    def test_ring_buffer_wraps(self):
+        ring = z_streamr.RingBuffer(8)
+        ring.write(b"abcdef")
+        self.assertEqual(ring.read(4), b"abcd")
+        ring.write(b"ghijk")
+        ring.close()
+        self.assertEqual(b"".join(iter(lambda: ring.read(8), b"")),
+                         b"efghijk")
+
+    def test_send_buffer_drops_oldest(self):
+        buf = z_streamr.SendBuffer(2, drop=True)
+        for block in (b"a", b"b", b"c"):
+            buf.put(block)
+        buf.close()
+        self.assertEqual(buf.dropped, 1)
+        self.assertEqual(buf.get(), (1, b"b"))
+        self.assertEqual(buf.get(), (2, b"c"))
+        self.assertIsNone(buf.get())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+""" test module for clamm.tags
+"""
+
+import sys
+import unittest
+from types import SimpleNamespace
+
+from clamm import config
+from clamm import stats
+from clamm import tags
+
+
+class TestTagRewriter(unittest.TestCase):
+    """ TestTagRewriter """
+
+    def test_matcher(self):
+        matcher = tags.TagMatcher(["MUSICBRAINZ_*", "re:ITUN(NORM|SMPB)"])
+        self.assertEqual(matcher.match("MUSICBRAINZ_TRACKID"),
+                         "MUSICBRAINZ_*")
+        self.assertEqual(matcher.match("iTunNORM"), "re:ITUN(NORM|SMPB)")
+        self.assertIsNone(matcher.match("ITUNES"))
+        self.assertIsNone(matcher.match("ARTIST"))
+
+    def test_rewrite_only_on_match(self):
+        rewriter = tags.TagRewriter(["MUSICBRAINZ_*", "ASIN"])
+        tagfile = SimpleNamespace(tags={
+            "ARTIST": ["x"], "MUSICBRAINZ_ALBUMID": ["1"],
+            "MUSICBRAINZ_TRACKID": ["2"], "ASIN": ["3"]})
+        clean = SimpleNamespace(tags={"ARTIST": ["x"]})
+
+        self.assertTrue(rewriter.apply(tagfile))
+        self.assertFalse(rewriter.apply(clean))
+        self.assertEqual(tagfile.tags, {"ARTIST": ["x"]})
+        self.assertEqual(rewriter.hits["MUSICBRAINZ_*"], 2)
+        self.assertEqual(rewriter.hits["ASIN"], 1)
+        self.assertEqual(rewriter.n_file, 1)
+
+    def test_junk_preset_is_literal(self):
+        rewriter = tags.TagRewriter.junk()
+        junk = config["library"]["tags"]["junk"]
+        tagfile = SimpleNamespace(tags={key: ["v"] for key in junk})
+        tagfile.tags["MEDIAX"] = ["v"]
+        rewriter.apply(tagfile)
+        self.assertEqual(list(tagfile.tags), ["MEDIAX"])
+
+
+def make_tagdb(artist):
+    """ a TagDatabase over an in-memory ``artist`` category only """
+    tagdb = tags.TagDatabase.__new__(tags.TagDatabase)
+    artist = {sys.intern(key): tags.TagEntry(val)
+              for key, val in artist.items()}
+    tagdb._db = {"artist": artist, "composer": {}, "exceptions": {}}
+    tagdb.artist, tagdb.composer = artist, {}
+    tagdb.update_sets()
+    return tagdb
+
+
+class TestPlanAlbum(unittest.TestCase):
+    """ TestPlanAlbum """
+
+    def setUp(self):
+        self.tagdb = make_tagdb({
+            "Glenn Gould": {"permutations": ["Glenn Gould", "G. Gould"],
+                            "instrument": "Piano", "count": 50},
+            "Yo-Yo Ma": {"permutations": ["Yo-Yo Ma"],
+                         "instrument": "Cello", "count": 80}})
+
+    def test_tracks_share_plans(self):
+        rows = [
+            ("1.flac", {"ARTIST": ["G. Gould; Yo-Yo Ma"]}),
+            ("2.flac", {"ARTIST": ["Yo-Yo Ma, Glenn Gould"]}),
+            ("3.flac", {"ARTIST": ["Glenn Gould"]}),
+            ("4.flac", {"ARTIST": ["Glenn Gould"],
+                        "COMPILATION": ["1"]})]
+        plans = self.tagdb.plan_album(rows)
+
+        self.assertIs(plans["1.flac"], plans["2.flac"])
+        self.assertNotIn("4.flac", plans)
+        self.assertEqual(plans["1.flac"].artist, "Yo-Yo Ma; Glenn Gould")
+        self.assertEqual(plans["1.flac"].arrangement, "Cello; Piano")
+        self.assertEqual(plans["3.flac"].albumartist, "Glenn Gould")
+
+        plans["1.flac"].reorder(1)
+        self.assertEqual(plans["2.flac"].albumartist, "Glenn Gould")
+
+    def test_order_independent(self):
+        rows = [("%d.flac" % i, {"ARTIST": [name]})
+                for i, name in enumerate(["Yo-Yo Ma", "Glenn Gould"] * 3)]
+        forward = self.tagdb.plan_album(rows)
+        backward = self.tagdb.plan_album(rows[::-1])
+        self.assertEqual(
+            {p: plan.artist for p, plan in forward.items()},
+            {p: plan.artist for p, plan in backward.items()})
+
+    def test_skip_existing(self):
+        rows = [("1.flac", {"ARTIST": ["Yo-Yo Ma"],
+                            "ARRANGEMENT": ["Cello"]})]
+        self.assertEqual(self.tagdb.plan_album(rows, skipflag=True), {})
+        self.assertIn("1.flac", self.tagdb.plan_album(rows))
+
+    def test_rank_falls_back_to_count(self):
+        """ statistics that have not seen an artist leave it the count of
+        ``tags.json``, which is never weighed against theirs """
+        self.tagdb.stats = stats.LibraryStats("unused.json")
+        self.tagdb.stats.observe("/a/1.flac", {"ARTIST": ["G. Gould"]})
+        gould = self.tagdb.artist_rank("Glenn Gould")
+        self.assertEqual(gould[:2], (True, 1))
+        self.assertEqual(self.tagdb.artist_rank("Yo-Yo Ma"), (False, 0, 80))
+        self.assertGreater(gould, self.tagdb.artist_rank("Yo-Yo Ma"))
+        self.assertEqual(
+            list(self.tagdb.sort_arrangement({"Yo-Yo Ma", "Glenn Gould"})),
+            ["Glenn Gould", "Yo-Yo Ma"])
+
+        # without statistics, tags.json counts alone
+        self.tagdb.stats = None
+        self.assertEqual(self.tagdb.artist_rank("Yo-Yo Ma"), (False, 0, 80))
+
+
+class TestTagEntry(unittest.TestCase):
+    """ TestTagEntry """
+
+    def test_item_access(self):
+        entry = tags.TagEntry({"full_name": "Glenn Gould",
+                               "permutations": ["Glenn Gould"],
+                               "wiki": "en"})
+        self.assertEqual(entry["permutations"], ["Glenn Gould"])
+        self.assertEqual(entry["wiki"], "en")
+        self.assertNotIn("count", entry)
+        self.assertEqual(entry.get("count", 0), 0)
+        with self.assertRaises(KeyError):
+            entry["period"]
+
+        entry["count"] = 3
+        self.assertEqual(entry.to_dict(), {
+            "full_name": "Glenn Gould", "permutations": ["Glenn Gould"],
+            "count": 3, "wiki": "en"})
+
+    def test_names_are_shared(self):
+        """ entries, sets and index hold the same string objects """
+        tagdb = make_tagdb({"Glenn " + "Gould": {
+            "permutations": ["Glenn " + "Gould"], "instrument": "Piano"}})
+        key = tagdb.match_from_perms("Glenn Gould")
+        name = next(iter(tagdb.sets["artist"]))
+        self.assertIs(key, name)
+        self.assertIs(tagdb.artist[key]["permutations"][0], name)
+        with self.assertRaises(tags.KeyNotFoundError):
+            tagdb.match_from_perms("Gould, Glenn")
+
+    def test_field_matchers_follow_sets(self):
+        tagdb = make_tagdb({"Vladimir Horowitz": {
+            "permutations": ["Vladimir Horowitz"], "instrument": "Piano",
+            "nationality": "Jewish Soviet-born American"}})
+        matcher = tagdb.matchers["nationality"]
+        summary = "a Jewish Soviet-born American pianist"
+        self.assertEqual(matcher.ranked(summary),
+                         ["Jewish Soviet-born American"])
+
+        tagdb.artist["Vladimir Horowitz"]["nationality"] = "American"
+        tagdb.update_sets()
+        self.assertIs(tagdb.matchers["nationality"], matcher)
+        self.assertEqual(matcher.ranked(summary), ["American"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+""" test module for clamm.timing
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+from clamm import timing
+
+
+class TestPhaseTimer(unittest.TestCase):
+    """ TestPhaseTimer """
+
+    def test_summary(self):
+        timer = timing.PhaseTimer(n_slowest=2)
+        for seconds in (0.1, 0.2, 0.3, 0.4):
+            timer.add("taglib", seconds)
+        for i, seconds in enumerate((0.5, 0.1, 0.9)):
+            timer.file("/lib/{}.flac".format(i), seconds)
+        with timer.phase("listdir"):
+            pass
+        timer.stop()
+
+        summary = timer.summary()
+        taglib = summary["phases"]["taglib"]
+        self.assertEqual(taglib["count"], 4)
+        self.assertAlmostEqual(taglib["total"], 1.0)
+        self.assertAlmostEqual(taglib["p50"], 0.25)
+        self.assertEqual(summary["phases"]["listdir"]["count"], 1)
+        self.assertEqual(summary["files"], 3)
+        self.assertEqual([item["path"] for item in summary["slowest"]],
+                         ["/lib/2.flac", "/lib/0.flac"])
+
+    def test_timed_without_timer(self):
+        with timing.timed(None, "refresh"):
+            pass
+
+    def test_dump(self):
+        timer = timing.PhaseTimer()
+        with timing.timed(timer, "refresh"):
+            pass
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "walk.json")
+            timing.dump({"action:noop": timer.summary()}, path)
+            with open(path) as fptr:
+                loaded = json.load(fptr)
+        self.assertIn("refresh", loaded["action:noop"]["phases"])
+
+
+if __name__ == "__main__":
+    unittest.main()
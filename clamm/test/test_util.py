@@ -0,0 +1,70 @@
+""" test module for clamm.util
+"""
+
+import threading
+import time
+import unittest
+
+from clamm import util
+
+
+class TestBoundedExecutor(unittest.TestCase):
+    """ TestBoundedExecutor """
+
+    def test_backpressure(self):
+        """ submit blocks while max_pending jobs are outstanding """
+        gate = threading.Event()
+        executor = util.BoundedExecutor(max_workers=1, max_pending=2)
+        executor.submit(gate.wait)
+        executor.submit(gate.wait)
+
+        submitted = threading.Event()
+
+        def producer():
+            executor.submit(gate.wait)
+            submitted.set()
+
+        threading.Thread(target=producer, daemon=True).start()
+        time.sleep(0.1)
+        self.assertFalse(submitted.is_set())
+
+        gate.set()
+        self.assertTrue(submitted.wait(1))
+        executor.shutdown()
+        self.assertEqual(executor.count["done"], 3)
+
+    def test_failures_are_tracked(self):
+        def fail(arg):
+            raise ValueError(arg)
+
+        executor = util.BoundedExecutor(max_workers=2)
+        executor.submit(fail, "x")
+        executor.submit(len, "ok")
+        count = executor.join()
+        self.assertEqual((count["done"], count["failed"]), (1, 1))
+        self.assertEqual(executor.errors[0][0], ("x",))
+        self.assertEqual(executor.results, [(("ok",), 2)])
+        executor.shutdown()
+
+    def test_join_waits_for_accounting(self):
+        """ join returns only once every job is counted, not merely once
+        its future is done """
+        executor = util.BoundedExecutor(max_workers=4)
+        settle = executor.settle
+
+        def slow_settle(future, args):
+            time.sleep(0.01)
+            settle(future, args)
+
+        executor.settle = slow_settle
+        for i in range(8):
+            executor.submit(abs, -i)
+        count = executor.join()
+        self.assertEqual(count["done"], 8)
+        self.assertEqual(sorted(r for _, r in executor.results),
+                         list(range(8)))
+        executor.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
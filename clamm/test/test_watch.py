@@ -0,0 +1,160 @@
+""" test module for clamm.watch
+"""
+
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from clamm import config
+from clamm import watch
+from clamm.streams import to_tracks
+
+
+class FakeWatcher():
+    """ hands out queued batches of changes """
+
+    def __init__(self):
+        self.batches = []
+
+    def changes(self, timeout=None):
+        return self.batches.pop(0) if self.batches else []
+
+    def close(self):
+        pass
+
+
+class RecordingWatch(watch.Watch):
+    """ records what would be ingested """
+
+    def ingest(self, key):
+        self.ingested.append(key)
+
+
+class TestWatch(unittest.TestCase):
+    """ TestWatch """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = dict(config["path"])
+        config["path"]["library"] = os.path.join(self.tmp, "library")
+        config["path"]["pcm"] = os.path.join(self.tmp, "pcm")
+        self.album = os.path.join(self.tmp, "library", "Bach", "Partitas")
+        os.makedirs(self.album)
+        os.makedirs(config["path"]["pcm"])
+
+    def tearDown(self):
+        config["path"].update(self.saved)
+        shutil.rmtree(self.tmp)
+
+    def touch(self, path):
+        with open(path, "wb") as fptr:
+            fptr.write(b"\0" * 16)
+
+    def test_debounced_per_album(self):
+        """ a burst of events ingests each album once, after it settles,
+        and the events of an ingestion are dropped """
+        now = [0.0]
+        watcher = FakeWatcher()
+        daemon = RecordingWatch(None, watcher, clock=lambda: now[0])
+        daemon.ingested = []
+        delay = daemon.debouncer.delay
+        other = os.path.join(self.tmp, "library", "Bach", "Suites")
+        stream = os.path.join(config["path"]["pcm"], "Bach; Suites.pcm")
+
+        watcher.batches = [
+            [os.path.join(self.album, "01.flac"),
+             os.path.join(self.album, "cover.jpg"), stream],
+            [os.path.join(self.album, "02.flac"),
+             os.path.join(other, "01.flac")]]
+        daemon.step()
+        now[0] = delay / 2
+        daemon.step()
+        self.assertEqual(daemon.ingested, [])
+        self.assertEqual(daemon.debouncer.timeout(now[0]), delay / 2)
+
+        # the stream settles first, its tracks land in the album
+        now[0] = delay
+        watcher.batches = [[], [os.path.join(self.album, "01.flac")]]
+        daemon.step()
+        self.assertEqual(daemon.ingested, [stream])
+
+        # ingesting an album writes to it, which is not a change
+        now[0] = 1.5 * delay
+        watcher.batches = [[], [os.path.join(other, "01.flac")]]
+        daemon.step()
+        self.assertEqual(daemon.ingested, [stream, other])
+        now[0] = 2 * delay
+        daemon.step()
+        self.assertEqual(daemon.ingested, [stream, other, self.album])
+        self.assertIsNone(daemon.debouncer.timeout(now[0]))
+
+    def test_streams_split_online_are_skipped(self):
+        split = []
+        stream2tracks = to_tracks.stream2tracks
+        to_tracks.stream2tracks = split.append
+        try:
+            daemon = watch.Watch(None, FakeWatcher())
+            for name in ("Bach; Suites", "Bach; Partitas"):
+                self.touch(os.path.join(config["path"]["pcm"], name + ".pcm"))
+            open(to_tracks.split_marker_path("Bach; Suites"), "w").close()
+            for name in ("Bach; Suites", "Bach; Partitas"):
+                daemon.ingest(os.path.join(self.tmp, "pcm", name + ".pcm"))
+        finally:
+            to_tracks.stream2tracks = stream2tracks
+        self.assertEqual(split, [
+            os.path.join(config["path"]["pcm"], "Bach; Partitas.pcm")])
+
+    def test_no_prompts_without_a_terminal(self):
+        """ interactive actions are dropped when stdin is not a tty, and
+        none are configured by default """
+        self.assertFalse(set(config["library"]["watch"]["actions"]) &
+                         set(watch.INTERACTIVE))
+        saved = config["library"]["watch"]["actions"], sys.stdin
+        config["library"]["watch"]["actions"] = [
+            "synchronize_composer", "remove_junk_tags", "synchronize_artist"]
+        sys.stdin = io.StringIO()
+        try:
+            daemon = watch.Watch(None, FakeWatcher())
+        finally:
+            config["library"]["watch"]["actions"], sys.stdin = saved
+        self.assertEqual(daemon.actions, ["remove_junk_tags"])
+
+    def test_polling_watcher(self):
+        watcher = watch.PollingWatcher([self.album], interval=0)
+        track = os.path.join(self.album, "01.flac")
+        self.touch(track)
+        self.assertEqual(watcher.changes(0), [track])
+        self.assertEqual(watcher.changes(0), [])
+        with open(track, "ab") as fptr:
+            fptr.write(b"\1")
+        self.assertEqual(watcher.changes(0), [track])
+
+    @unittest.skipIf(watch.load_libc() is None, "no inotify")
+    def test_inotify_watcher(self):
+        watcher = watch.InotifyWatcher([os.path.join(self.tmp, "library")])
+        try:
+            track = os.path.join(self.album, "01.flac")
+            self.touch(track)
+            self.assertEqual(watcher.changes(1), [track])
+
+            # files of a folder moved in are reported, and it is watched
+            staged = os.path.join(self.tmp, "staged")
+            os.makedirs(staged)
+            self.touch(os.path.join(staged, "01.flac"))
+            moved = os.path.join(self.tmp, "library", "Bach", "Suites")
+            os.rename(staged, moved)
+            self.assertEqual(watcher.changes(1),
+                             [os.path.join(moved, "01.flac")])
+            self.touch(os.path.join(moved, "02.flac"))
+            self.assertEqual(watcher.changes(1),
+                             [os.path.join(moved, "02.flac")])
+            self.assertEqual(watcher.changes(0), [])
+        finally:
+            watcher.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+"""wall time instrumentation of library walks.
+
+A ``PhaseTimer`` records how long each phase of a walk takes, every time
+it runs: listing directories, parsing tags with taglib, copying them,
+the action itself, committing to file, refreshing the tag database and
+so on. Phases nest, e.g. ``commit`` runs within an ``action:*`` phase and
+is included in its time. Per-file totals are kept to name the slowest
+files.
+
+    $ clamm library --timing --timing_json walk.json action --prune_artist_tags
+
+For call-level detail, ``--profile`` runs the whole command under
+``cProfile`` instead.
+"""
+
+import json
+import time
+import heapq
+from contextlib import contextmanager
+
+import numpy as np
+
+from clamm import util
+
+PERCENTILES = (50, 90, 99)
+
+
+class PhaseTimer():
+    """ Wall time and call count per phase.
+
+    Attributes
+    ----------
+    samples: dict
+        durations, in seconds, of every run of each phase
+    slowest: list
+        heap of the ``n_slowest`` ``(seconds, path)`` per-file totals
+    """
+
+    def __init__(self, n_slowest=10):
+        self.samples = {}
+        self.slowest = []
+        self.n_slowest = n_slowest
+        self.n_file = 0
+        self.tic = time.perf_counter()
+        self.wall = None
+
+    @contextmanager
+    def phase(self, name):
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - tic)
+
+    def add(self, name, seconds):
+        self.samples.setdefault(name, []).append(seconds)
+
+    def file(self, path, seconds):
+        """ record the total time spent on one file """
+        self.n_file += 1
+        item = (seconds, str(path))
+        if len(self.slowest) < self.n_slowest:
+            heapq.heappush(self.slowest, item)
+        else:
+            heapq.heappushpop(self.slowest, item)
+
+    def stop(self):
+        """ end of the walk """
+        self.wall = time.perf_counter() - self.tic
+
+    def summary(self):
+        """ the timings as a ``json`` serializable dict """
+        wall = self.wall or time.perf_counter() - self.tic
+        phases = {}
+        for name, samples in self.samples.items():
+            samples = np.array(samples)
+            phases[name] = {
+                "count": len(samples), "total": float(samples.sum()),
+                "mean": float(samples.mean()), "max": float(samples.max())}
+            for pct in PERCENTILES:
+                phases[name]["p{}".format(pct)] = float(
+                    np.percentile(samples, pct))
+        return {
+            "wall": wall, "files": self.n_file,
+            "files_per_sec": self.n_file / wall if wall else 0.0,
+            "phases": phases,
+            "slowest": [{"path": path, "seconds": seconds} for
+                        seconds, path in sorted(self.slowest, reverse=True)]}
+
+    def show(self):
+        """ print the summary, phases by total time """
+        summary = self.summary()
+        util.printr("{files} files in {wall:.2f} sec, {files_per_sec:.1f}"
+                    " files/sec".format(**summary))
+        print("\t{:28s} {:>7s} {:>9s} {:>9s} {:>9s} {:>9s}".format(
+            "phase", "count", "total", "p50 ms", "p90 ms", "p99 ms"))
+        for name, phase in sorted(summary["phases"].items(),
+                                  key=lambda t: t[1]["total"], reverse=True):
+            print("\t{:28s} {:7d} {:9.3f} {:9.3f} {:9.3f} {:9.3f}".format(
+                name, phase["count"], phase["total"], 1e3 * phase["p50"],
+                1e3 * phase["p90"], 1e3 * phase["p99"]))
+        if summary["slowest"]:
+            print("\tslowest files:")
+            for item in summary["slowest"]:
+                print("\t{:9.3f}  {}".format(item["seconds"], item["path"]))
+
+
+@contextmanager
+def timed(timer, name):
+    """ ``timer.phase(name)``, or nothing when ``timer`` is ``None`` """
+    if timer is None:
+        yield
+    else:
+        with timer.phase(name):
+            yield
+
+
+def dump(summaries, path):
+    """ write walk summaries, keyed by action, to ``path`` """
+    with open(path, "w") as fptr:
+        json.dump(summaries, fptr, indent=4)
@@ -2,10 +2,15 @@
 """
 
 import os
+import re
 import sys
+import json
 import time
 import inspect
+import threading
 import subprocess
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import colorama
 
@@ -19,6 +24,24 @@ ARTIST_TAG_NAMES = ["ALBUMARTIST_CREDIT",
                     "ALBUMARTIST"]
 SEC_PER_DAY = 60*60*24
 
+try:
+    unicode
+except NameError:
+    unicode = str
+
+# callables run with each tagfile written by ``commit_to_libfile``
+commit_hooks = []
+
+
+@contextmanager
+def commit_hook(hook):
+    """ run ``hook`` with each tagfile committed within the block """
+    commit_hooks.append(hook)
+    try:
+        yield hook
+    finally:
+        commit_hooks.remove(hook)
+
 
 def commit_to_libfile(tagfile):
     """common entry point for writing values from tag database into
@@ -34,6 +57,9 @@ def commit_to_libfile(tagfile):
         if is_new or is_dif:
             n_delta_fields += 1
 
+    # deleted fields are changes too
+    n_delta_fields += len(set(tagfile.tag_copy) - set(tagfile.tags))
+
     # short-circuit if no changes to be made
     if n_delta_fields == 0:
         return (n_tracks_updated, n_delta_fields)
@@ -44,8 +70,9 @@ def commit_to_libfile(tagfile):
         printr("Proposed: ")
         pretty_dict(sorted(tagfile.tags))
 
-        if not input("Accept? [y]/n: "):
-            tagfile.save()
+        if input("Accept? [y]/n: "):
+            return (0, 0)
+        tagfile.save()
 
     else:
         tagfile.save()
@@ -55,9 +82,21 @@ def commit_to_libfile(tagfile):
                     colorama.Fore.RED + "." + colorama.Fore.WHITE),
                 sys.stdout.flush()])
 
+    for hook in commit_hooks:
+        hook(tagfile)
+
     return (n_tracks_updated, n_delta_fields)
 
 
+def artist_tagset(tags):
+    """ set of artist names across the ARTIST-like fields of ``tags`` """
+    atags = {
+        t: re.split(SPLIT_REGEX, ', '.join(tags[t]))
+        for t in ARTIST_TAG_NAMES if t in tags.keys()}
+    aset = set([v.strip() for val in atags.values() for v in val])
+    return aset
+
+
 def pretty_dict(d):
     for k, v in d.items():
         print("\t{}: {}".format(k, v))
@@ -94,25 +133,33 @@ def printr(func_or_msg, verbosic_precedence=3, caller=True):
         func_or_msg()
 
 
-def start_shairport(filepath):
-    """make sure no duplicate processes and start up shairport-sync
+def start_shairport():
+    """make sure no duplicate processes and start up shairport-sync,
+    returns the process, whose ``stdout`` carries the raw pcm stream.
     """
 
-    subprocess.Popen(['killall', 'shairport-sync'])
+    subprocess.call(['killall', 'shairport-sync'])
 
-    time.sleep(1)
-
-    with open(filepath, "w") as fptr:
-        subprocess.Popen(
-            ['shairport-sync', '-o=stdout'], stdout=fptr)
+    proc = subprocess.Popen(
+        ['shairport-sync', '-o=stdout'], stdout=subprocess.PIPE)
 
     printr("shairport up and running.")
 
+    return proc
+
 
 def pcm2wav(pcm_name, wav_name):
+    """ convert a raw s16le stereo stream to a wav file, in-process, see
+    ``streams.pcm.write_wav`` """
+    from clamm.streams import pcm
+    pcm.write_wav(pcm_name, wav_name)
+
+
+def flac2wav(flac_name, wav_name):
+    """utility for using ``ffmpeg`` to convert a flac file to a wav file
+    """
     subprocess.call(
-        ["ffmpeg", "-hide_banner", "-y", "-f",
-         "s16le", "-ar", "44.1k", "-ac", "2", "-i", pcm_name, wav_name])
+        ["ffmpeg", "-hide_banner", "-y", "-i", flac_name, wav_name])
 
 
 def wav2flac(wav_name):
@@ -135,30 +182,130 @@ def generate_playlist(artist, album):
     subprocess.Popen(['osascript', osa_prog])
 
 
-class SimpleState(object):
-    def __init__(self, filepath):
-        self.count = 0
-        self.filepath = filepath
-
-    def get_state(self, state):
-        """ return the file size, sampled with a 1 second gap to
-        determine if the file is being written to.
-        """
+class JsonCache():
+    """ A small persistent key/value cache, stored as ``json``.
 
-        init_size = os.path.getsize(self.filepath)
-        time.sleep(1)
-        last_size = os.path.getsize(self.filepath)
+    Entries older than ``ttl`` seconds are treated as missing. Access is
+    guarded by a lock so the cache can be shared by worker threads.
 
-        self.count += 2
-        if self.count % 60 == 0:
-            sys.stdout.write(".")
-            sys.stdout.flush()
+    Parameters
+    ----------
+    path: str
+        location of the cache file
+    ttl: float, optional
+        time to live of an entry in seconds, ``None`` never expires.
+    """
 
-        if state == "finishd":
-            return last_size == init_size
+    def __init__(self, path, ttl=None):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        try:
+            with open(path) as fptr:
+                self.entries = json.load(fptr)
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def get(self, key):
+        """ cached value for ``key``, or ``None`` if missing/expired """
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl is not None and time.time() - entry["time"] > self.ttl:
+            return None
+        return entry["value"]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = {"time": time.time(), "value": value}
+
+    def save(self):
+        """ write the cache to disk, atomically """
+        with self.lock:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as fptr:
+                json.dump(self.entries, fptr, ensure_ascii=False)
+            os.replace(tmp, self.path)
+
+
+class BoundedExecutor():
+    """ A worker pool with backpressure and completion tracking.
+
+    ``submit`` blocks once ``max_pending`` jobs are queued or running,
+    so a producer (e.g. a library walk) can never get further ahead of the
+    workers than that.
+
+    Parameters
+    ----------
+    max_workers: int, optional
+        default is the cpu count
+    max_pending: int, optional
+        default is twice ``max_workers``
+    processes: bool, optional
+        run jobs in worker processes rather than threads, for work that
+        holds the GIL. Jobs and their results must then be picklable.
+
+    Attributes
+    ----------
+    count: dict
+        number of jobs submitted, done and failed
+    results: list
+        ``(job args, result)`` of each job done
+    errors: list
+        ``(job args, exception)`` of each failed job
+    """
 
-        elif state == "startd":
-            return last_size > init_size
+    def __init__(self, max_workers=None, max_pending=None, processes=False):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        pool_type = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self.pool = pool_type(max_workers=self.max_workers)
+        self.slots = threading.BoundedSemaphore(
+            max_pending or 2 * self.max_workers)
+        self.finished = threading.Condition()
+        self.count = {"submitted": 0, "done": 0, "failed": 0}
+        self.results = []
+        self.errors = []
+
+    def submit(self, func, *args):
+        """ queue ``func(*args)``, blocking while the queue is full """
+        self.slots.acquire()
+        with self.finished:
+            self.count["submitted"] += 1
+        try:
+            future = self.pool.submit(func, *args)
+        except Exception:
+            self.settle(None, args)
+            raise
+        future.add_done_callback(lambda f: self.settle(f, args))
+        return future
+
+    def settle(self, future, args):
+        """ account for a job that completed, or never got queued """
+        with self.finished:
+            if future is None:
+                self.count["submitted"] -= 1
+            elif future.exception() is None:
+                self.count["done"] += 1
+                self.results.append((args, future.result()))
+            else:
+                self.count["failed"] += 1
+                self.errors.append((args, future.exception()))
+            self.finished.notify_all()
+        self.slots.release()
+
+    def join(self):
+        """ block until every submitted job has completed and been
+        accounted for """
+        with self.finished:
+            self.finished.wait_for(
+                lambda: self.count["done"] + self.count["failed"] ==
+                self.count["submitted"])
+            return dict(self.count)
+
+    def shutdown(self):
+        self.join()
+        self.pool.shutdown()
 
 
 def is_audio_file(name):
@@ -0,0 +1,330 @@
+"""watch the library and the stream folder, and ingest what lands there.
+
+``clamm library watch`` keeps ``config["path"]["library"]`` and
+``config["path"]["pcm"]`` under watch:
+
+- a new or rewritten audio file in the library marks its folder, the
+  album, as changed. Once an album has seen no event for
+  ``config["library"]["watch"]["debounce_sec"]``, so a whole import has
+  landed, the configured ``actions`` are walked over that folder only and
+  its tracks are added to the recently-added playlist, see ``recent``.
+- a new stream (``.pcm`` or ``.flac``) in the stream folder, once settled,
+  is split into tracks (``streams.stream2tracks``), which land in the
+  library and are ingested in turn. Streams already split while they
+  were captured (``to_tracks.is_split``) are left alone.
+
+The default actions never prompt. Actions that do (``INTERACTIVE``) are
+only run when configured and the daemon has a terminal to prompt on;
+otherwise they are skipped, and the names they would have asked about
+are left to ``clamm library action`` run by hand.
+
+Changes come from inotify, through ``ctypes``, where the platform has it,
+and otherwise from polling the folders every ``poll_sec``. Events caused
+by ingesting an album (tag writes, conversions) are dropped, so an album
+is not ingested again on account of its own ingestion.
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+from clamm import config
+from clamm import recent
+from clamm import util
+
+STREAM_TYPES = (".pcm", ".flac")
+
+# actions that prompt on stdin for what they cannot resolve
+INTERACTIVE = (
+    "handle_composer_as_artist", "synchronize_artist",
+    "synchronize_composer")
+
+# inotify(7)
+IN_CLOEXEC = 0o2000000
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT = struct.Struct("iIII")
+READ_BYTES = 1 << 16
+
+
+class WatchError(Exception):
+    """ WatchError """
+
+    def __init__(self, expression, message):
+        self.expression = expression
+        self.message = message
+
+
+def load_libc():
+    """ the C library, if it has inotify, else ``None`` """
+    try:
+        libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def walk_files(root):
+    """ every file path under ``root`` """
+    for folder, _, files in os.walk(root):
+        for name in files:
+            yield os.path.join(folder, name)
+
+
+class InotifyWatcher():
+    """ Changed files under ``roots``, from inotify.
+
+    Every folder is watched; folders created (or moved in) later are
+    watched as they appear, and the files they already hold reported.
+    """
+
+    def __init__(self, roots, libc=None):
+        self.libc = libc or load_libc()
+        if self.libc is None:
+            raise WatchError("InotifyWatcher", "no inotify in the C library")
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.folders = {}
+        for root in roots:
+            self.add_tree(root)
+
+    def add(self, folder):
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise WatchError(
+                    folder, "out of inotify watches, raise "
+                    "fs.inotify.max_user_watches or poll instead")
+            if err != errno.ENOENT:
+                raise OSError(err, os.strerror(err), folder)
+            return
+        self.folders[wd] = folder
+
+    def add_tree(self, root):
+        for folder, _, _ in os.walk(root):
+            self.add(folder)
+
+    def changes(self, timeout=None):
+        """ paths of the files changed, waiting up to ``timeout`` seconds
+        (``None`` is forever) for the first """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        data = os.read(self.fd, READ_BYTES)
+        changed = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, size = EVENT.unpack_from(data, pos)
+            name = data[pos + EVENT.size:pos + EVENT.size + size]
+            pos += EVENT.size + size
+            if mask & IN_Q_OVERFLOW:
+                util.printr("inotify queue overflowed, events were lost")
+                continue
+            if mask & IN_IGNORED:
+                self.folders.pop(wd, None)
+                continue
+            folder = self.folders.get(wd)
+            if folder is None:
+                continue
+
+            path = os.path.join(folder, os.fsdecode(name.rstrip(b"\0")))
+            if mask & IN_ISDIR:
+                self.add_tree(path)
+                changed.extend(walk_files(path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                changed.append(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher():
+    """ Changed files under ``roots``, by comparing the modification time
+    and size of every file every ``interval`` seconds """
+
+    def __init__(self, roots, interval):
+        self.roots = roots
+        self.interval = interval
+        self.state = self.scan()
+
+    def scan(self):
+        state = {}
+        for root in self.roots:
+            for path in walk_files(root):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                state[path] = (stat.st_mtime_ns, stat.st_size)
+        return state
+
+    def changes(self, timeout=None):
+        if timeout is None or timeout > self.interval:
+            timeout = self.interval
+        time.sleep(timeout)
+        state = self.scan()
+        changed = [path for path, stat in state.items()
+                   if self.state.get(path) != stat]
+        self.state = state
+        return changed
+
+    def close(self):
+        pass
+
+
+def get_watcher(roots, backend=None):
+    """the watcher configured by ``config["library"]["watch"]``:
+    ``inotify``, ``poll``, or ``auto``, inotify where there is one
+    """
+    wcfg = config["library"]["watch"]
+    backend = backend or wcfg["backend"]
+    if backend != "poll":
+        try:
+            return InotifyWatcher(roots)
+        except (WatchError, OSError) as err:
+            if backend == "inotify":
+                raise
+            util.printr("inotify unavailable ({}), polling".format(err))
+    return PollingWatcher(roots, wcfg["poll_sec"])
+
+
+class Debouncer():
+    """ Keys, e.g. albums, that saw no event for ``delay`` seconds """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.pending = {}
+
+    def touch(self, key, now):
+        self.pending[key] = now
+
+    def timeout(self, now):
+        """ seconds until the next key settles, ``None`` if none is
+        pending """
+        if not self.pending:
+            return None
+        return max(0, min(self.pending.values()) + self.delay - now)
+
+    def settled(self, now):
+        """ the keys settled by ``now``, which are no longer pending """
+        ready = sorted(key for key, last in self.pending.items()
+                       if now - last >= self.delay)
+        for key in ready:
+            del self.pending[key]
+        return ready
+
+
+class Watch():
+    """ The watch daemon.
+
+    Parameters
+    ----------
+    args: Namespace
+        command line arguments, handed to ``audiolib.AudioLib`` to walk
+        the actions
+    watcher: InotifyWatcher or PollingWatcher, optional
+        default is ``get_watcher`` over the library and stream folders
+    clock: callable, optional
+        monotonic seconds
+    """
+
+    def __init__(self, args, watcher=None, clock=time.monotonic):
+        wcfg = config["library"]["watch"]
+        self.args = args
+        self.library = os.path.abspath(config["path"]["library"])
+        self.streams = os.path.abspath(config["path"]["pcm"])
+        if watcher is None:
+            watcher = get_watcher(
+                [root for root in (self.library, self.streams)
+                 if os.path.isdir(root)],
+                getattr(args, "backend", None))
+        self.watcher = watcher
+        self.clock = clock
+        self.debouncer = Debouncer(wcfg["debounce_sec"])
+        self.actions = wcfg["actions"]
+        if not sys.stdin.isatty():
+            skipped = [name for name in self.actions if name in INTERACTIVE]
+            if skipped:
+                util.printr("no terminal to prompt on, skipping {}".format(
+                    ", ".join(skipped)))
+            self.actions = [
+                name for name in self.actions if name not in INTERACTIVE]
+
+        # the action walker, created on first use
+        self.alib = None
+
+    def album_of(self, path):
+        """ what a change to ``path`` is to ingest: a stream, an album
+        folder, or ``None`` """
+        path = os.path.abspath(path)
+        if path.startswith(self.streams + os.sep):
+            return path if path.endswith(STREAM_TYPES) else None
+        if path.startswith(self.library + os.sep) and \
+                util.is_audio_file(path):
+            return os.path.dirname(path)
+        return None
+
+    def observe(self, paths, skip=None):
+        now = self.clock()
+        for path in paths:
+            key = self.album_of(path)
+            if key is not None and key != skip:
+                self.debouncer.touch(key, now)
+
+    def step(self, timeout=None):
+        """ wait up to ``timeout`` for changes, then ingest whatever
+        settled """
+        self.observe(self.watcher.changes(timeout))
+        for key in self.debouncer.settled(self.clock()):
+            self.ingest(key)
+            # drop the events of the ingestion itself
+            self.observe(self.watcher.changes(0), skip=key)
+
+    def ingest(self, key):
+        if key.startswith(self.streams + os.sep):
+            from clamm.streams import to_tracks
+            if to_tracks.is_split(key):
+                util.printr("{} was split online, skipping".format(key))
+                return
+            util.printr("splitting new stream {}...".format(key))
+            to_tracks.stream2tracks(key)
+            return
+
+        util.printr("ingesting {}...".format(key))
+        if self.alib is None:
+            from clamm import audiolib
+            self.alib = audiolib.AudioLib(self.args)
+        self.alib.root = key
+        for name in self.actions:
+            self.alib.func = name
+            self.alib.walker(getattr(self.alib.ltfa, name))
+        recent.refresh([key])
+
+    def run(self):
+        util.printr("watching {} and {}...".format(
+            self.library, self.streams))
+        try:
+            while True:
+                self.step(self.debouncer.timeout(self.clock()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.watcher.close()
@@ -23,6 +23,9 @@ setup(name='clamm',
           'numpy>=1.13',
           'matplotlib>=2.1'
       ],
+      extras_require={
+          'fast': ['scipy>=1.0', 'soundfile>=0.10']
+      },
       entry_points={
           'console_scripts': ['clamm=clamm.__main__:main']
       },